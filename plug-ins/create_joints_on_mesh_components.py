@@ -1,15 +1,29 @@
 from __future__ import division
 
+# モジュール
+import time
+import threading
+import concurrent.futures
+import numpy as np
+
 # Mayaモジュール
 import maya.mel as mel
+import maya.utils
 import maya.api.OpenMaya as om2
+import maya.api.OpenMayaAnim as om2a
 import maya.api.OpenMayaUI as omUI
 import maya.api.OpenMayaRender as omR
 
 # 自前のモジュール
 import util.util as TKCM_Util
+import util.chain_math as TKCM_ChainMath
+import util.topology_cache as TKCM_TopologyCache
+import util.mesh_cache as TKCM_MeshCache
 import importlib
 importlib.reload( TKCM_Util )
+importlib.reload( TKCM_ChainMath )
+importlib.reload( TKCM_TopologyCache )
+importlib.reload( TKCM_MeshCache )
 
 #############################################################################################################################
 #OpenMaya2.0を使用したプラグインであることを宣言する
@@ -35,70 +49,206 @@ class cmd_create_joints_on_mesh_components(om2.MPxCommand):
         
         ##################################################################################
         ## 処理
-        create_joint_count = 0 # 生成するジョイントの数を指定する変数（root,tipを含んだ数）
+        plan_options = MakePlanOptions(flagValues);
+        if flagValues["-bake"] and ( flagValues["-hairCards"] or flagValues["-tubeRings"] ):
+            om2.MGlobal.displayError("bake supports component chains only");
+            return;
+        if plan_options["create_type"] == 4 and plan_options["spacing"] <= 0.0:
+            om2.MGlobal.displayError("spacing must be greater than 0");
+            return;
+        if plan_options["create_count"] < 0:
+            om2.MGlobal.displayError("createCount must be 0 or greater");
+            return;
+        if flagValues["-hairCards"]:
+            # メッシュを繋がっていない部分（カード）ごとに分けて、全カードのチェインをまとめて算出する（分割数はcreateCountで固定）
+            target_meshes = self.collectMeshes(flagValues);
+            if target_meshes is None:
+                return False;
+            plan_options["create_type"] = 1;
+            plan = ComputeHairCardPlan(target_meshes, plan_options);
+        elif flagValues["-tubeRings"]:
+            # 選択したリングからチューブに沿ってリングを辿り、各リングの重心をチェインにする
+            chains = self.collectChains(flagValues);
+            if chains is None:
+                return False;
+            tube_keys = MakeTubeRingKeys(chains, flagValues["-startComponent"], flagValues["-reverseOrder"]);
+            plan_key = MakePlanKey(tube_keys + MakeGeometryKeys(chains), plan_options); # プレビューの後にメッシュが変更されていればキーが変わるので再利用しない
+            plan = GetPreviewPlan(plan_key) if flagValues["-usePreviewPlan"] else None;
+            if plan is None:
+                poi_pos, poi_nml, poi_offsets = SampleTubeRings(chains, flagValues["-startComponent"], flagValues["-reverseOrder"]);
+                plan = MakeJointChainPlan(plan_key, poi_pos, poi_nml, poi_offsets, plan_options);
+        else:
+            # 処理対象のチェインを取得する（-chain、-mesh/-componentIdsのどちらも無い場合は選択中のコンポーネントを1本のチェインとして扱う）
+            chains = self.collectChains(flagValues);
+            if chains is None:
+                return False;
+
+            if flagValues["-compareSampling"]: # 一括取得と従来の取得方法の結果と処理時間を比較するだけで終了する（先頭のチェインだけを対象にする）
+                self.setResult(CompareComponentSampling(*chains[0]));
+                return;
+
+            if flagValues["-bake"]: # フレーム範囲でチェインを評価して、ジョイントの移動と回転にキーを打つ
+                self.bake(chains, plan_options, flagValues);
+                return;
+
+            # ジョイントの位置と向きを算出する（プレビューで同じチェインと同じオプションの計算が済んでいる場合は、メッシュを読まずにその結果をそのまま使う）
+            plan_key = MakePlanKey(MakeChainKeys(chains) + MakeGeometryKeys(chains), plan_options); # プレビューの後にメッシュが変更されていればキーが変わるので再利用しない
+            plan = GetPreviewPlan(plan_key) if flagValues["-usePreviewPlan"] and flagValues["-referenceSampling"] == False else None;
+            if plan is None and plan_options["create_type"] == 4 and flagValues["-queryPlan"] == False:
+                # 間隔を指定した場合はジョイント数が非常に多くなることがあるので、一定数ごとに計算してそのままMDagModifierに積む
+                poi_pos, poi_nml, poi_offsets = SampleChains(chains, flagValues["-referenceSampling"]);
+                self.dag_modifier = om2.MDagModifier();
+                self.joint_objects, root_ids = BuildSpacedJointChains(self.dag_modifier, poi_pos, poi_nml, poi_offsets, plan_options, flagValues["-setOnJointOrient"], flagValues["-jointName"]);
+                if len(self.joint_objects) == 0:
+                    om2.MGlobal.displayError("there are no joints to create");
+                    return;
+                self.root_objects = [self.joint_objects[i] for i in root_ids];
+                self.prev_sel_list = om2.MGlobal.getActiveSelectionList();
+                self.redoIt();
+                return;
+            if plan is None:
+                plan = ComputeJointChainPlan(chains, plan_options, plan_key, flagValues["-referenceSampling"]);
+        if plan.jointCount() == 0:
+            om2.MGlobal.displayError("there are no joints to create");
+            return;
+        if plan_options["create_type"] == 3: # 簡略化した結果のジョイント数と元のラインとの最大距離を表示する
+            om2.MGlobal.displayInfo("joints: {}  max error: {:.4g} (tolerance: {:.4g})".format(plan.jointCount(), plan.placement_error, plan_options["tolerance"]));
+
+        if flagValues["-queryPlan"]: # ジョイントは作成せずに、ジョイントごとに[ワールド座標XYZ, 親に対するローカル回転XYZ(degree)]の6要素を並べた配列を返す
+            self.setResult(plan.toFlatArray().tolist());
+            return;
+
+        # ジョイントチェインを作成する（全チェインの全ジョイントを1つのMDagModifierに積んでおき、redoIt()でまとめて実行する = アンドゥも1回で済む）
+        joint_names = MakeJointNames(flagValues["-jointName"], plan.joint_offsets)
+        self.dag_modifier = om2.MDagModifier();
+        self.joint_objects = BuildJointChain(self.dag_modifier, plan.joint_pos, plan.frames, plan.local_rad, plan.parent_ids, flagValues["-setOnJointOrient"], joint_names)
+        self.root_objects = [self.joint_objects[i] for i in plan.rootIds()]
+        self.prev_sel_list = om2.MGlobal.getActiveSelectionList();
+        self.redoIt();
 
-        # コンポーネントの選択順にIDリストを取得するためのオプションを有効にする
-        if mel.eval("selectPref -query -trackSelectionOrder") == False:
+    def redoIt(self):
+        self.dag_modifier.doIt();
+        if self.anim_modifier is not None:
+            self.anim_modifier.doIt();
+
+        # ジョイントチェインのルートジョイントを選択状態にして、ルートジョイントの名前を返す
+        root_sel_list = om2.MSelectionList();
+        root_names = [];
+        for root_obj in self.root_objects:
+            root_path = om2.MDagPath.getAPathTo(root_obj);
+            root_sel_list.add(root_path);
+            root_names.append(root_path.partialPathName());
+        om2.MGlobal.setActiveSelectionList(root_sel_list);
+        self.clearResult();
+        self.setResult(root_names);
+
+    def undoIt(self):
+        # 作成したジョイントをまとめて削除して、コマンド実行前の選択状態に戻す
+        if self.anim_modifier is not None:
+            self.anim_modifier.undoIt();
+        self.dag_modifier.undoIt();
+        om2.MGlobal.setActiveSelectionList(self.prev_sel_list);
+
+    def isUndoable(self):
+        return self.dag_modifier is not None;
+
+    #########################################################################################################################
+    ## 書式やソースデータのチェックを行いつつ、必要な情報をメンバー変数に格納する
+
+    # フラグもしくは選択状態から処理対象のチェインのリストを作成する（無効な場合はNoneを返す）
+    # 戻り値: [[コンポーネントのタイプ, コンポーネントID, MFnMesh], ...]
+    def collectChains(self, flagValues:dict) -> list:
+        if len(flagValues["-chain"]) != 0:
+            chains = [];
+            for chain_str in flagValues["-chain"]:
+                valid, chain = ParseChainString(chain_str);
+                if valid == False:
+                    om2.MGlobal.displayError("invalid chain: {}".format(chain_str));
+                    return None;
+                chains.append(chain);
+            return self.orderChains(chains, flagValues);
+
+        if len(flagValues["-mesh"]) != 0:
+            # メッシュとコンポーネントIDを直接受け取る（選択や選択順の設定には一切触れない）
+            valid, chain = MakeChainFromIds(flagValues["-mesh"], flagValues["-componentType"], flagValues["-componentIds"]);
+            if valid == False:
+                om2.MGlobal.displayError("invalid mesh or component ids: {}".format(flagValues["-mesh"]));
+                return None;
+            return self.orderChains([chain], flagValues);
+
+        # コンポーネントの選択順にIDリストを取得するためのオプションを有効にする（隣接関係から順番を求める場合は不要）
+        ordered = flagValues["-orderByAdjacency"] == False and flagValues["-tubeRings"] == False;
+        if ordered and mel.eval("selectPref -query -trackSelectionOrder") == False:
             mel.eval("selectPref -trackSelectionOrder true");
-        
+
         # 処理対象とするメッシュのデータを取得する
         sel_list = om2.MGlobal.getActiveSelectionList();
-        valid, sel_comp_ids, sel_mesh = ParseSelectionList(sel_list)
+        valid, sel_comp_ids, sel_mesh = ParseSelectionList(sel_list, ordered)
         if valid == False:  # ターゲットメッシュの確認と値の取得を行う
-            return False;
-        create_joint_count = len(sel_comp_ids) 
+            return None;
+        return self.orderChains([[TKCM_Util.selectedComponentType(sel_list, 0), sel_comp_ids, sel_mesh]], flagValues);
 
-        # コンポーネントのタイプごとに位置と法線の情報を取得する
-        sel_comp_type = TKCM_Util.selectedComponentType(sel_list, 0);
-        poi_pos_array, poi_nml_array = GetComponentPosAndNml(sel_comp_type, sel_comp_ids, sel_mesh)
-        
-        # 等分割の場合は再計算
-        if flagValues["-createType"] == 1: # evenly intervalタイプの場合
-            poi_pos_array, poi_nml_array = RecomputeIntervalPosAndNml(flagValues["-createCount"], poi_pos_array, poi_nml_array)
-            create_joint_count = len(poi_pos_array)
-        
-        # 回転値を算出するためのデータ（DirectionとUpvector）をコンポーネント間の位置情報から算出する(配列の要素末尾は1つ前の値のコピーを入れておく)
-        poi_dir_array = GetChainPoiDirection(poi_nml_array, poi_pos_array);
-
-        # ジョイントチェインを作成する
-        rest_parent_g_quat = om2.MQuaternion();
-        rest_joint_root_path = "";
-        for i in range (create_joint_count) :
-            # ルート/ティップのジョイント生成をするかのフラグの対応
-            if i == 0 and flagValues["-createRootjoint"] == False:
-                continue; # ルートジョイントの作成をスキップ
-            if i == create_joint_count-1 and flagValues["-createTipJoint"] == False:
-                continue; # ティップジョイントの作成をスキップ
-
-            # ジョイントを生成する向きを算出する
-            joint_g_quat = TKCM_Util.quaternionFromDirectionAndUpvector(poi_dir_array[i], poi_nml_array[i], flagValues["-axisType"], flagValues["-aimAxisNeg"], flagValues["-upAxisNeg"]); # ジョイントのグローバル回転値（Quat）を算出する
-            joint_l_quat = joint_g_quat * rest_parent_g_quat.inverse(); # 前回の計算結果（＝親ジョイントのグローバル回転）を元にローカル回転を算出する
-            joint_rad3 = joint_l_quat.asEulerRotation(); # QuatをEuler(radian)へ変換する
-            joint_deg3 = TKCM_Util.toDeg3(joint_rad3); # チャンネルボックスにセットする回転値が必要なのでEuler(degree)に変換する
-            
-            pos_str = TKCM_Util.toMelString(om2.MVector(poi_pos_array[i])); # 数値をmel用の文字列に変換する 例：(1,2,3) -> '1 2 3 '
-
-            # jointコマンドを実行（位置はグローバル値、回転はローカル値をセットする）
-            if flagValues["-setOnJointOrient"] :
-                ori_str = TKCM_Util.toMelString(joint_deg3); # 数値をmel用の文字列に変換する 例：(1,2,3) -> '1 2 3 '
-                joint_name = mel.eval("joint -position " + pos_str + " -orientation " + ori_str );
+    # -hairCardsの処理対象のメッシュを取得する（-meshが無い場合は選択中の全てのメッシュ）
+    def collectMeshes(self, flagValues:dict) -> list:
+        sel_list = om2.MSelectionList();
+        try:
+            if len(flagValues["-mesh"]) != 0:
+                sel_list.add(flagValues["-mesh"]);
             else:
-                joint_deg3_str = list(map(str, joint_deg3)); # 文字列のリストにしておく　例：(1,2,3) -> ['1','2','3']
-                joint_name = mel.eval("joint -position " + pos_str + " -angleX " + joint_deg3_str[0] + " -angleY " + joint_deg3_str[1] + " -angleZ " + joint_deg3_str[2] );
+                sel_list = om2.MGlobal.getActiveSelectionList();
+        except RuntimeError:
+            pass;
+        target_meshes = [];
+        for i in range(sel_list.length()):
+            try:
+                mesh_path = sel_list.getDagPath(i).extendToShape();
+            except RuntimeError: # DAGノード以外やシェイプの無いトランスフォーム
+                continue;
+            if mesh_path.hasFn(om2.MFn.kMesh):
+                target_meshes.append(om2.MFnMesh(mesh_path));
+        if len(target_meshes) == 0:
+            om2.MGlobal.displayError("select hair card meshes or use -mesh");
+            return None;
+        return target_meshes;
 
-            # 次の計算のために現在のグローバル回転値を保存しておく
-            rest_parent_g_quat = joint_g_quat; 
-            # ジョイントチェインのルートジョイントのパスを記録しておく
-            if len(rest_joint_root_path) == 0:
-                rest_joint_root_path = joint_name;
+    # -orderByAdjacencyがONの場合は、各チェインのコンポーネントを隣接関係に沿って並べ直す（分岐や途切れがある場合はNoneを返す）
+    def orderChains(self, chains:list, flagValues:dict) -> list:
+        if flagValues["-orderByAdjacency"] == False:
+            return chains;
+        for chain in chains:
+            comp_type, comp_ids, target_mesh = chain;
+            status, chain[1] = OrderComponentIds(comp_type, comp_ids, target_mesh, flagValues["-startComponent"], flagValues["-reverseOrder"]);
+            if status not in (TKCM_ChainMath.kPathOpen, TKCM_ChainMath.kPathClosed):
+                om2.MGlobal.displayError("{}: {}".format(kPathMessages[status], MeshPathKey(target_mesh)));
+                return None;
+            if status == TKCM_ChainMath.kPathClosed:
+                om2.MGlobal.displayInfo("closed loop: {} components".format(len(chain[1])));
+        return chains;
+    
+    # フレーム範囲の全フレームのジョイントの位置と回転をまとめて算出して、ジョイントの作成とキーの設定を行う
+    def bake(self, chains:list, plan_options:dict, flagValues:dict):
+        frames = np.arange(flagValues["-startFrame"], flagValues["-endFrame"] + 1.0e-6, 1.0).tolist();
+        if len(frames) == 0:
+            om2.MGlobal.displayError("endFrame must be greater than or equal to startFrame");
+            return;
+        start_time = time.perf_counter();
+        joint_offsets, parent_ids, local_pos, local_rad = ComputeBakedJointChains(chains, plan_options, frames);
+        if local_pos.shape[1] == 0:
+            om2.MGlobal.displayError("there are no joints to create");
+            return;
 
-        # ジョイントチェインのルートジョイントを選択状態にして終了
-        mel.eval("select -r " + rest_joint_root_path);
-        mel.eval("parent -w");
+        # 最初のフレームの姿勢でジョイントを作成する（キーを打つチャンネルのプラグが必要なので先に実行しておく。redoIt()で再度doIt()を呼んでも追加の処理は無い）
+        self.dag_modifier = om2.MDagModifier();
+        self.joint_objects = AddJointNodes(self.dag_modifier, local_pos[0], local_rad[0], parent_ids, False, MakeJointNames(flagValues["-jointName"], joint_offsets), []);
+        self.root_objects = [self.joint_objects[i] for i in joint_offsets[:-1][np.diff(joint_offsets) > 0]];
+        self.prev_sel_list = om2.MGlobal.getActiveSelectionList();
+        self.dag_modifier.doIt();
+
+        self.anim_modifier = om2.MDGModifier();
+        BakeJointChannels(self.anim_modifier, self.joint_objects, frames, local_pos, local_rad);
+        om2.MGlobal.displayInfo("baked: {} joints  {} frames  {:.3f} sec".format(local_pos.shape[1], len(frames), time.perf_counter() - start_time));
+        self.redoIt();
 
-    #########################################################################################################################
-    ## 書式やソースデータのチェックを行いつつ、必要な情報をメンバー変数に格納する
-    
     # 書式（フラグ）の確認を行いつつ、フラグの値をメンバー変数に格納する
     def parseArguments(self, args) -> dict:
         # コマンドの書式をチェックする
@@ -113,11 +263,33 @@ class cmd_create_joints_on_mesh_components(om2.MPxCommand):
         result["-setOnJointOrient"] =argData.flagArgumentBool("setOnJointOrient", 0) if argData.isFlagSet("setOnJointOrient") else False;
         result["-createRootjoint"]  =argData.flagArgumentBool("createRootjoint", 0) if argData.isFlagSet("createRootjoint") else True;
         result["-createTipJoint"]   =argData.flagArgumentBool("createTipJoint", 0) if argData.isFlagSet("createTipJoint") else True;
-        result["-createType"]       =argData.flagArgumentInt("createType", 0) if argData.isFlagSet("createType") else 0; # 0=on centor of component, 1=evenly interval
-        result["-createCount"]      =argData.flagArgumentInt("createCount", 0) if argData.isFlagSet("createCount") else 0; # 生成するジョイント数を指定する（createType==1の時に使用）
+        result["-createType"]       =argData.flagArgumentInt("createType", 0) if argData.isFlagSet("createType") else 0; # 0=on centor of component, 1=evenly interval, 2=curvature adaptive, 3=simplify (tolerance), 4=fixed spacing
+        result["-createCount"]      =argData.flagArgumentInt("createCount", 0) if argData.isFlagSet("createCount") else 0; # 生成するジョイント数を指定する（createType==1,2の時に使用）
         result["-axisType"]         =argData.flagArgumentInt("axisType", 0) if argData.isFlagSet("axisType") else 3; # 0=ZY, 1=ZX, 2=XZ, 3=XY, 4=YX, 5=YZ
         result["-aimAxisNeg"]       =argData.flagArgumentBool("aimAxisNeg", 0) if argData.isFlagSet("aimAxisNeg") else False;
         result["-upAxisNeg"]        =argData.flagArgumentBool("upAxisNeg", 0) if argData.isFlagSet("upAxisNeg") else False;
+        result["-jointName"]        =argData.flagArgumentString("jointName", 0) if argData.isFlagSet("jointName") else ""; # ジョイント名のプレフィックス（空の場合はMayaの既定の名前になる）
+        result["-referenceSampling"]=argData.flagArgumentBool("referenceSampling", 0) if argData.isFlagSet("referenceSampling") else False; # コンポーネントごとにAPIを呼ぶ従来の取得方法を使用する
+        result["-compareSampling"]  =argData.flagArgumentBool("compareSampling", 0) if argData.isFlagSet("compareSampling") else False; # ジョイントは作成せずに取得方法ごとの誤差と処理時間を返す
+        result["-mesh"]             =argData.flagArgumentString("mesh", 0) if argData.isFlagSet("mesh") else ""; # 選択の代わりに処理対象とするメッシュ
+        result["-componentType"]    =argData.flagArgumentInt("componentType", 0) if argData.isFlagSet("componentType") else 1; # 1=vertex, 2=edge, 3=face
+        result["-componentIds"]     =[argData.getFlagArgumentList("componentIds", i).asInt(0) for i in range(argData.numberOfFlagUses("componentIds"))]; # 並べた順がチェインの順になる（複数回指定できる）
+        result["-queryPlan"]        =argData.flagArgumentBool("queryPlan", 0) if argData.isFlagSet("queryPlan") else False; # ジョイントは作成せずに位置と回転の配列を返す
+        result["-orderByAdjacency"] =argData.flagArgumentBool("orderByAdjacency", 0) if argData.isFlagSet("orderByAdjacency") else False; # 選択順ではなくコンポーネントの隣接関係から順番を求める
+        result["-startComponent"]   =argData.flagArgumentInt("startComponent", 0) if argData.isFlagSet("startComponent") else -1; # 隣接関係から順番を求める際に先頭にするコンポーネントID（-1=自動）
+        result["-reverseOrder"]     =argData.flagArgumentBool("reverseOrder", 0) if argData.isFlagSet("reverseOrder") else False; # 隣接関係から求めた順番を逆にする
+        result["-hairCards"]        =argData.flagArgumentBool("hairCards", 0) if argData.isFlagSet("hairCards") else False; # メッシュのカードごとにチェインを作成する
+        result["-tubeRings"]        =argData.flagArgumentBool("tubeRings", 0) if argData.isFlagSet("tubeRings") else False; # 選択したリングからチューブに沿ってリングの重心にジョイントを作成する（-startComponentはアップベクトルの基準にする頂点）
+        result["-curvatureWeight"]  =argData.flagArgumentDouble("curvatureWeight", 0) if argData.isFlagSet("curvatureWeight") else 0.5; # createType==2の時に曲がり具合を距離に対してどれだけ重視するか(0-1)
+        result["-tolerance"]        =argData.flagArgumentDouble("tolerance", 0) if argData.isFlagSet("tolerance") else 0.1; # createType==3の時に元のラインから離れてよい最大距離
+        result["-spacing"]          =argData.flagArgumentDouble("spacing", 0) if argData.isFlagSet("spacing") else 1.0; # createType==4の時のジョイントの間隔（ワールド空間の距離）
+        result["-bake"]             =argData.flagArgumentBool("bake", 0) if argData.isFlagSet("bake") else False; # フレーム範囲でチェインを評価して、ジョイントの移動と回転にキーを打つ（回転値にキーを打つので-setOnJointOrientは無視する）
+        result["-startFrame"]       =argData.flagArgumentDouble("startFrame", 0) if argData.isFlagSet("startFrame") else om2a.MAnimControl.minTime().value; # ベイクする範囲（既定値は再生範囲）
+        result["-endFrame"]         =argData.flagArgumentDouble("endFrame", 0) if argData.isFlagSet("endFrame") else om2a.MAnimControl.maxTime().value;
+        result["-frameType"]        =argData.flagArgumentInt("frameType", 0) if argData.isFlagSet("frameType") else 0; # 0=コンポーネントの法線, 1=rotation minimizing frame（先頭の法線から捩じれが最小になるように運ぶ）
+        result["-normalBlend"]      =argData.flagArgumentDouble("normalBlend", 0) if argData.isFlagSet("normalBlend") else 0.0; # frameType==1の時にアップベクトルをコンポーネントの法線に近づける割合(0-1)
+        result["-usePreviewPlan"]   =argData.flagArgumentBool("usePreviewPlan", 0) if argData.isFlagSet("usePreviewPlan") else True; # プレビューで計算済みの結果があれば再利用する
+        result["-chain"]            =[argData.getFlagArgumentList("chain", i).asString(0) for i in range(argData.numberOfFlagUses("chain"))]; # 1回の指定で1本のチェイン（複数回指定できる）
 
         return result;
 
@@ -126,6 +298,11 @@ class cmd_create_joints_on_mesh_components(om2.MPxCommand):
 
     def __init__(self):
         om2.MPxCommand.__init__(self);
+        self.dag_modifier = None;
+        self.anim_modifier = None; # ベイクした場合のアニメーションカーブの接続
+        self.joint_objects = [];
+        self.root_objects = [];
+        self.prev_sel_list = om2.MSelectionList();
 
     @staticmethod
     def cmdCreator():
@@ -144,12 +321,77 @@ class cmd_create_joints_on_mesh_components(om2.MPxCommand):
         syntax.addFlag( "at", "axisType", om2.MSyntax.kLong );
         syntax.addFlag( "aan", "aimAxisNeg", om2.MSyntax.kBoolean );
         syntax.addFlag( "uan", "upAxisNeg", om2.MSyntax.kBoolean );
+        syntax.addFlag( "jn", "jointName", om2.MSyntax.kString );
+        syntax.addFlag( "rs", "referenceSampling", om2.MSyntax.kBoolean );
+        syntax.addFlag( "cs", "compareSampling", om2.MSyntax.kBoolean );
+        syntax.addFlag( "ch", "chain", om2.MSyntax.kString );
+        syntax.makeFlagMultiUse( "chain" );
+        syntax.addFlag( "ms", "mesh", om2.MSyntax.kString );
+        syntax.addFlag( "cpt", "componentType", om2.MSyntax.kLong );
+        syntax.addFlag( "cid", "componentIds", om2.MSyntax.kLong );
+        syntax.makeFlagMultiUse( "componentIds" );
+        syntax.addFlag( "qp", "queryPlan", om2.MSyntax.kBoolean );
+        syntax.addFlag( "upp", "usePreviewPlan", om2.MSyntax.kBoolean );
+        syntax.addFlag( "oba", "orderByAdjacency", om2.MSyntax.kBoolean );
+        syntax.addFlag( "hcd", "hairCards", om2.MSyntax.kBoolean );
+        syntax.addFlag( "tbr", "tubeRings", om2.MSyntax.kBoolean );
+        syntax.addFlag( "cw", "curvatureWeight", om2.MSyntax.kDouble );
+        syntax.addFlag( "tol", "tolerance", om2.MSyntax.kDouble );
+        syntax.addFlag( "sp", "spacing", om2.MSyntax.kDouble );
+        syntax.addFlag( "bk", "bake", om2.MSyntax.kBoolean );
+        syntax.addFlag( "sf", "startFrame", om2.MSyntax.kDouble );
+        syntax.addFlag( "ef", "endFrame", om2.MSyntax.kDouble );
+        syntax.addFlag( "ft", "frameType", om2.MSyntax.kLong );
+        syntax.addFlag( "nb", "normalBlend", om2.MSyntax.kDouble );
+        syntax.addFlag( "sc", "startComponent", om2.MSyntax.kLong );
+        syntax.addFlag( "ro", "reverseOrder", om2.MSyntax.kBoolean );
+
+        return syntax;
+
+##########################################################################################################################################################################################################################################################
+## ディスクに保存したトポロジーのキャッシュ(util.topology_cache)を削除するコマンド（元に戻せない）
+
+class cmd_create_joints_on_mesh_components_purge_cache(om2.MPxCommand):
+    # コマンド名
+    kPluginCmdName = "createJointsOnMeshComponentsPurgeCache"
 
+    def doIt(self, args):
+        try:
+            argData = om2.MArgDatabase (self.syntax(), args);
+        except:
+            om2.MGlobal.displayError("syntax error: invalid arguments");
+            return;
+        older_than = argData.flagArgumentDouble("olderThan", 0) if argData.isFlagSet("olderThan") else -1.0; # 最後に使ってからこの日数を超えたエントリーだけを削除する（-1=全て）
+        stale_only = argData.flagArgumentBool("staleOnly", 0) if argData.isFlagSet("staleOnly") else False; # 古いフォーマットや壊れたエントリーだけを削除する
+        cache_dir  = argData.flagArgumentString("directory", 0) if argData.isFlagSet("directory") else TKCM_TopologyCache.getCacheDir(); # 削除するキャッシュのディレクトリ（既定値は使用中のディレクトリ）
+        if cache_dir is None:
+            om2.MGlobal.displayWarning("topology cache is disabled: set {} or util.topology_cache.setCacheDir()".format(TKCM_TopologyCache.kCacheDirEnv));
+            self.setResult(0);
+            return;
+
+        TKCM_MeshCache.getMeshCache().discard("adjacency"); # マップしているファイルを削除できるようにメモリのキャッシュから外す
+        removed, removed_bytes = TKCM_TopologyCache.purge(older_than, stale_only, cache_dir);
+        om2.MGlobal.displayInfo("topology cache purged: {} entries  {:.1f} MB  ({})".format(removed, removed_bytes / ( 1024.0 * 1024.0 ), cache_dir));
+        self.setResult(removed);
+
+    def isUndoable(self) -> bool:
+        return False;
+
+    @staticmethod
+    def cmdCreator():
+        return cmd_create_joints_on_mesh_components_purge_cache();
+
+    @staticmethod
+    def syntaxCreator() -> om2.MSyntax:
+        syntax = om2.MSyntax();
+        syntax.addFlag( "ot", "olderThan", om2.MSyntax.kDouble );
+        syntax.addFlag( "so", "staleOnly", om2.MSyntax.kBoolean );
+        syntax.addFlag( "dir", "directory", om2.MSyntax.kString );
         return syntax;
 
 ##########################################################################################################################################################################################################################################################
 # ソースデータに不足がないか確認を行い、選択状態のメッシュとコンポーネントIDのリストを取得する
-def ParseSelectionList(sel_list: om2.MSelectionList) -> [bool, om2.MIntArray, om2.MFnMesh]:
+def ParseSelectionList(sel_list: om2.MSelectionList, ordered: bool = True) -> [bool, om2.MIntArray, om2.MFnMesh]:
     if sel_list.length() != 1:
         print(TKCM_Util.getCodeLocation()); # 選択が複数ある、もしくは選択が無い
         return [False, om2.MIntArray(), om2.MFnMesh()];
@@ -159,8 +401,8 @@ def ParseSelectionList(sel_list: om2.MSelectionList) -> [bool, om2.MIntArray, om
         print(TKCM_Util.getCodeLocation()); # メッシュデータが選択されていない
         return [False, om2.MIntArray(), om2.MFnMesh()];
 
-    # 選択したコンポーネントのIDを取得する（選択した順）
-    sel_comp_ids = TKCM_Util.getSelectedComponentIds(sel_list, 0, True);
+    # 選択したコンポーネントのIDを取得する（orderedがTrueの場合は選択した順）
+    sel_comp_ids = TKCM_Util.getSelectedComponentIds(sel_list, 0, ordered);
     if len(sel_comp_ids) < 2:
         print(TKCM_Util.getCodeLocation()); # コンポーネントの選択数が不足している
         return [False, om2.MIntArray(), om2.MFnMesh()];
@@ -168,7 +410,97 @@ def ParseSelectionList(sel_list: om2.MSelectionList) -> [bool, om2.MIntArray, om
     target_mesh = om2.MFnMesh(sel_dagPath);
     return [True, sel_comp_ids, target_mesh];
 
-# コンポーネントのタイプごとにコンポーネントの中央位置と法線の情報を取得する
+# -chainフラグの文字列（例："pSphere1.vtx[3] pSphere1.vtx[10:12] pSphere1.vtx[5]"）から、記述した順のコンポーネントIDのリストを取得する
+# 全てのコンポーネントが同じメッシュの同じタイプであること
+# 戻り値: [有効か, [コンポーネントのタイプ, コンポーネントID, MFnMesh]]
+def ParseChainString(chain_str:str) -> [bool, list]:
+    comp_ids = []
+    chain_path = None
+    chain_type = TKCM_Util.MeshCompType.kNon
+    for comp_name in chain_str.split():
+        comp_list = om2.MSelectionList()
+        try:
+            comp_list.add(comp_name) # 1つずつ追加して記述した順番を保つ（まとめて追加すると同じメッシュのコンポーネントが統合されて順番が失われる）
+            comp_path, _ = comp_list.getComponent(0)
+        except RuntimeError:
+            return [False, None]
+        comp_type = TKCM_Util.selectedComponentType(comp_list, 0)
+        if comp_path.hasFn(om2.MFn.kMesh) == False or comp_type not in TKCM_Util.kComponentFnTypes:
+            return [False, None]
+        if chain_path is None:
+            chain_path, chain_type = comp_path, comp_type
+        elif comp_type != chain_type or comp_path.extendToShape().node() != om2.MDagPath(chain_path).extendToShape().node():
+            return [False, None]
+        comp_ids.extend(TKCM_Util.getSelectedComponentIds(comp_list, 0))
+    if len(comp_ids) < 2:
+        return [False, None]
+    return [True, [chain_type, om2.MIntArray(comp_ids), om2.MFnMesh(chain_path)]]
+
+# メッシュのパス、コンポーネントのタイプ(1=vertex, 2=edge, 3=face)、コンポーネントIDのリストからチェインを作成する
+# 戻り値: [有効か, [コンポーネントのタイプ, コンポーネントID, MFnMesh]]
+def MakeChainFromIds(mesh_name:str, comp_type:int, comp_ids:list) -> [bool, list]:
+    try:
+        comp_type = TKCM_Util.MeshCompType(comp_type)
+        mesh_path = om2.MSelectionList().add(mesh_name).getDagPath(0)
+    except (ValueError, RuntimeError):
+        return [False, None]
+    if comp_type not in TKCM_Util.kComponentFnTypes or mesh_path.hasFn(om2.MFn.kMesh) == False or len(comp_ids) < 2:
+        return [False, None]
+    target_mesh = om2.MFnMesh(mesh_path)
+    comp_count = {TKCM_Util.MeshCompType.kVertex: target_mesh.numVertices, TKCM_Util.MeshCompType.kEdge: target_mesh.numEdges, TKCM_Util.MeshCompType.kFace: target_mesh.numPolygons}[comp_type]
+    if min(comp_ids) < 0 or max(comp_ids) >= comp_count:
+        return [False, None]
+    return [True, [comp_type, om2.MIntArray(comp_ids), target_mesh]]
+
+# 隣接関係から順番を求められなかった場合のメッセージ
+kPathMessages = {
+    TKCM_ChainMath.kPathBranching: "components are branching",
+    TKCM_ChainMath.kPathDisconnected: "components are not connected as a single chain",
+    TKCM_ChainMath.kPathInvalidStart: "start component is not an end of the chain",
+}
+
+# 順不同のコンポーネントIDをメッシュ上の隣接関係に沿って並べる（メッシュのフェースの頂点リストからCSRの隣接リストを作って端から辿る）
+# start_id: 先頭にするコンポーネントID（-1の場合は自動）, reverse: 並びを逆にする
+# 戻り値: [TKCM_ChainMath.kPath*, 並べたコンポーネントID]
+def OrderComponentIds(comp_type:TKCM_Util.MeshCompType, comp_ids:om2.MIntArray, target_mesh:om2.MFnMesh, start_id:int = -1, reverse:bool = False) -> [int, om2.MIntArray]:
+    comp_ids = np.array(comp_ids, dtype=np.int64)
+    face_counts, face_offsets, face_vertices = ReadMeshFaceVertices(target_mesh)
+    edge_vtx = ReadEdgeVertices(target_mesh, comp_ids) if comp_type == TKCM_Util.MeshCompType.kEdge else None
+    mesh_edges = ReadMeshAdjacency(target_mesh)[0] if comp_type == TKCM_Util.MeshCompType.kVertex else None
+    ordered_ids, status = TKCM_ChainMath.orderComponents(comp_type.value, comp_ids, face_counts, face_offsets, face_vertices, edge_vtx, start_id, reverse, mesh_edges)
+    return [status, om2.MIntArray(ordered_ids.tolist())]
+
+# メッシュを識別するための文字列（トランスフォームとシェイプのどちらで指定されても同じになるようにシェイプのフルパスにする）
+def MeshPathKey(target_mesh:om2.MFnMesh) -> str:
+    return target_mesh.getPath().extendToShape().fullPathName()
+
+# 複数のチェインの位置と法線を取得して連結する（同じメッシュの同じタイプのチェインはまとめて1回でサンプリングしてから各チェインに分配する）
+# chains: [[コンポーネントのタイプ, コンポーネントID, MFnMesh], ...]
+# 戻り値: [位置(N,3), 法線(N,3), 各チェインの先頭位置(チェイン数+1)]
+def SampleChains(chains:list, reference_sampling:bool = False, space :om2.MSpace = om2.MSpace.kWorld) -> [np.ndarray, np.ndarray, np.ndarray]:
+    offsets = TKCM_ChainMath.chainOffsets([len(comp_ids) for _, comp_ids, _ in chains])
+    groups = {}
+    for chain_id, (comp_type, _, target_mesh) in enumerate(chains):
+        groups.setdefault((MeshPathKey(target_mesh), comp_type), []).append(chain_id)
+
+    pos = np.empty((offsets[-1], 3))
+    nml = np.empty((offsets[-1], 3))
+    for chain_ids in groups.values():
+        comp_type, _, target_mesh = chains[chain_ids[0]]
+        group_ids = om2.MIntArray([i for chain_id in chain_ids for i in chains[chain_id][1]])
+        if reference_sampling:
+            ref_pos_array, ref_nml_array = GetComponentPosAndNml(comp_type, group_ids, target_mesh, space)
+            group_pos = np.array(ref_pos_array, dtype=np.float64)[:, :3];
+            group_nml = np.array(ref_nml_array, dtype=np.float64);
+        else:
+            group_pos, group_nml = GetComponentPosAndNmlArray(comp_type, group_ids, target_mesh, space)
+        # グループ内の順番で各チェインの位置へ書き戻す
+        dst_ids = np.concatenate([np.arange(offsets[chain_id], offsets[chain_id + 1]) for chain_id in chain_ids])
+        pos[dst_ids] = group_pos
+        nml[dst_ids] = group_nml
+    return [pos, nml, offsets]
+
+# コンポーネントのタイプごとにコンポーネントの中央位置と法線の情報を取得する（コンポーネントごとにAPIを呼ぶ参照用の実装）
 def GetComponentPosAndNml(comp_type:TKCM_Util.MeshCompType, component_id:om2.MIntArray, target_mesh:om2.MFnMesh, space :om2.MSpace = om2.MSpace.kWorld) -> [om2.MPointArray(), om2.MVectorArray()]:
     poi_pos_array = om2.MPointArray();
     poi_nml_array = om2.MVectorArray();
@@ -186,7 +518,7 @@ def GetComponentPosAndNml(comp_type:TKCM_Util.MeshCompType, component_id:om2.MIn
 
             pos = ( om2.MVector(target_mesh.getPoint(vtx0, space)) + om2.MVector(target_mesh.getPoint(vtx1, space)) ) * 0.5; # エッジの中央位置を算出する
             poi_pos_array.append(om2.MPoint(pos));
-            nml = ( all_poi_nml[vtx0] + all_poi_nml[vtx0] ) * 0.5; # エッジの両端の頂点法線の中央位置を算出する
+            nml = ( all_poi_nml[vtx0] + all_poi_nml[vtx1] ) * 0.5; # エッジの両端の頂点法線の中央位置を算出する
             poi_nml_array.append(nml);
     elif comp_type == TKCM_Util.MeshCompType.kFace:
         # フェースモード
@@ -201,47 +533,491 @@ def GetComponentPosAndNml(comp_type:TKCM_Util.MeshCompType, component_id:om2.MIn
             poi_nml_array.append(target_mesh.getPolygonNormal(compID, space));
     return [poi_pos_array, poi_nml_array]
 
-# 頂点位置リストを元にして次の頂点への向きを返す（算出した向きと頂点法線が平行になる場合は、法線リストを微調整する）
-def GetChainPoiDirection(io_chain_poi_nml:om2.MVectorArray, chain_poi_pos:om2.MVectorArray) -> om2.MVectorArray:
-    poi_dir_array = om2.MVectorArray();
-    for i in range (len(chain_poi_pos) - 1) :
-        dir = ( chain_poi_pos[i+1] - chain_poi_pos[i] ).normal();
-        poi_dir_array.append(dir);
-    poi_dir_array.append(poi_dir_array[-1]);
-    # ディレクションと法線の向きが平行の場合は回転値の計算が出来ないため予め対処しておく
-    for i in range (len(io_chain_poi_nml)) :
-        if poi_dir_array[i].isParallel(io_chain_poi_nml[i]):
-            # 平行と判定された場合は前後の値を用いて法線の値を微調整しておく
-            lerpVal = (io_chain_poi_nml[i] + io_chain_poi_nml[i-1]) * 0.5 if i == len(io_chain_poi_nml)-1 else (io_chain_poi_nml[i] + io_chain_poi_nml[i+1]) * 0.5;
-            io_chain_poi_nml[i] = lerpVal.normal();
-    return poi_dir_array
-
-def RecomputeIntervalPosAndNml(div_count:int, poi_pos_array:om2.MPointArray(), poi_nml_array:om2.MVectorArray())->[om2.MPointArray(), om2.MVectorArray()]:
-    interval_pos_array = om2.MPointArray()
-    interval_nml_array = om2.MVectorArray()
-    # コンポーネント間の距離を算出しておく（リストは[0]=0.0スタートの加算式で配列の要素末尾が全長値となる）
-    length_pack = om2.MFloatArray(1, 0.0);
-    for i in range (len(poi_pos_array) - 1) :
-        length = TKCM_Util.getDistanceAtoB(poi_pos_array[i], poi_pos_array[i+1]);
-        length_pack.append(length_pack[-1] + length);
-    
-    e = length_pack[-1]/(div_count+1);
-    interval_pos_array.append(poi_pos_array[0])
-    interval_nml_array.append(poi_nml_array[0])
-    for i in range (div_count+1) :
-        if i==0:
+# GetComponentPosAndNml()の一括処理版：メッシュのデータを1度だけ取得して全コンポーネントの中央位置と法線を(N,3)の配列でまとめて算出する
+def GetComponentPosAndNmlArray(comp_type:TKCM_Util.MeshCompType, component_id:om2.MIntArray, target_mesh:om2.MFnMesh, space :om2.MSpace = om2.MSpace.kWorld) -> [np.ndarray, np.ndarray]:
+    topology = ReadComponentTopology(comp_type, np.array(component_id, dtype=np.int64), target_mesh)
+    return ComponentPosAndNmlFromTopology(comp_type, topology, target_mesh, space)
+
+# コンポーネントの中央位置の計算に使う頂点IDの情報を取得する（メッシュが変形しても変わらないので、ライブノードではキャッシュしておく）
+# use_cache: Falseの場合はメッシュごとのキャッシュ(util.mesh_cache)を通さずにMFnMeshから直接読む（ノードのinMeshなどのメッシュデータ用）
+def ReadComponentTopology(comp_type:TKCM_Util.MeshCompType, comp_ids:np.ndarray, target_mesh:om2.MFnMesh, use_cache:bool = True) -> tuple:
+    if comp_type == TKCM_Util.MeshCompType.kVertex:
+        return (comp_ids,)
+    elif comp_type == TKCM_Util.MeshCompType.kEdge:
+        return (ReadEdgeVertices(target_mesh, comp_ids) if use_cache else TKCM_MeshCache.readEdgeVertices(target_mesh, comp_ids),)
+    elif comp_type == TKCM_Util.MeshCompType.kFace:
+        return (comp_ids,) + tuple(ReadMeshFaceVertices(target_mesh) if use_cache else TKCM_MeshCache.readFaceVertices(target_mesh))
+    return ()
+
+# ReadComponentTopology()の情報と現在の頂点の座標からコンポーネントの中央位置と法線を算出する
+def ComponentPosAndNmlFromTopology(comp_type:TKCM_Util.MeshCompType, topology:tuple, target_mesh:om2.MFnMesh, space :om2.MSpace = om2.MSpace.kWorld, use_cache:bool = True) -> [np.ndarray, np.ndarray]:
+    read_points = ReadMeshPoints if use_cache else TKCM_MeshCache.readPoints
+    read_normals = ReadMeshNormals if use_cache else TKCM_MeshCache.readNormals
+    if comp_type == TKCM_Util.MeshCompType.kVertex:
+        return TKCM_ChainMath.vertexPosAndNml(topology[0], read_points(target_mesh, space), read_normals(target_mesh, space))
+    elif comp_type == TKCM_Util.MeshCompType.kEdge:
+        return TKCM_ChainMath.edgePosAndNml(topology[0], read_points(target_mesh, space), read_normals(target_mesh, space))
+    elif comp_type == TKCM_Util.MeshCompType.kFace:
+        return TKCM_ChainMath.facePosAndNml(topology[0], read_points(target_mesh, space), *topology[1:])
+    return [np.zeros((0, 3)), np.zeros((0, 3))]
+
+# メッシュのトポロジーを表すキー（頂点数・エッジ数・フェース数・フェース頂点数が同じなら同じトポロジーとみなす）
+def MeshTopologyKey(target_mesh:om2.MFnMesh) -> tuple:
+    return (target_mesh.numVertices, target_mesh.numEdges, target_mesh.numPolygons, target_mesh.numFaceVertices)
+
+# メッシュの読み込みはメッシュごとのキャッシュ(util.mesh_cache)を通す（キャッシュの配列は読み込み専用なので書き換えない）
+# メッシュの全頂点の座標を(V,3)の配列で取得する
+def ReadMeshPoints(target_mesh:om2.MFnMesh, space :om2.MSpace = om2.MSpace.kWorld) -> np.ndarray:
+    return TKCM_MeshCache.getMeshCache().getPoints(target_mesh, space)
+
+# メッシュの全頂点の法線を(V,3)の配列で取得する
+def ReadMeshVertexNormals(target_mesh:om2.MFnMesh, space :om2.MSpace = om2.MSpace.kWorld) -> np.ndarray:
+    return TKCM_MeshCache.getMeshCache().getVertexNormals(target_mesh, space)
+
+# メッシュの法線の配列(getNormals)を取得する（頂点・エッジモードはGetComponentPosAndNml()と同じく、この配列を頂点IDで参照する）
+def ReadMeshNormals(target_mesh:om2.MFnMesh, space :om2.MSpace = om2.MSpace.kWorld) -> np.ndarray:
+    return TKCM_MeshCache.getMeshCache().getNormals(target_mesh, space)
+
+# 指定したエッジの両端の頂点IDを(N,2)の配列で取得する（MFnMeshにはエッジの一括取得が無いため、まだ読んでいないエッジだけを1回ずつ取得する）
+def ReadEdgeVertices(target_mesh:om2.MFnMesh, edge_ids:np.ndarray) -> np.ndarray:
+    return TKCM_MeshCache.getMeshCache().getEdgeVertices(target_mesh, edge_ids)
+
+# フェースごとの頂点数・オフセット・頂点IDリスト(CSR)を取得する
+def ReadMeshFaceVertices(target_mesh:om2.MFnMesh) -> [np.ndarray, np.ndarray, np.ndarray]:
+    return TKCM_MeshCache.getMeshCache().getFaceVertices(target_mesh)
+
+# メッシュの全エッジ(E,2)と頂点の隣接リスト(CSR)を取得する（ディスクのキャッシュ(util.topology_cache)が有効なら、同じトポロジーのメッシュは別のセッションでも作り直さない）
+# 戻り値: [エッジ, indptr, indices]
+def ReadMeshAdjacency(target_mesh:om2.MFnMesh) -> [np.ndarray, np.ndarray, np.ndarray]:
+    return TKCM_MeshCache.getMeshCache().getAdjacency(target_mesh)
+
+# 頂点ごとのUVを(V,2)の配列で取得する（UVが無い、もしくはUVが割り当てられていないフェースがある場合はNone）
+def ReadVertexUVs(target_mesh:om2.MFnMesh, face_vertices:np.ndarray) -> np.ndarray:
+    if target_mesh.numUVs() == 0:
+        return None
+    uv_counts, uv_ids = target_mesh.getAssignedUVs()
+    if len(uv_ids) != len(face_vertices):
+        return None
+    us, vs = target_mesh.getUVs()
+    vtx_uv_ids = np.zeros(target_mesh.numVertices, dtype=np.int64)
+    vtx_uv_ids[face_vertices] = np.array(uv_ids, dtype=np.int64) # UVが分かれている頂点はどれか1つのUVを使う
+    return np.stack([np.array(us, dtype=np.float64), np.array(vs, dtype=np.float64)], axis=1)[vtx_uv_ids]
+
+# ヘアカードのメッシュからカードごとのチェインを抽出して、全メッシュ分を連結する
+# 戻り値: [位置, 法線, 各チェインの先頭位置(offsets)]
+def SampleHairCardChains(target_meshes:list, space :om2.MSpace = om2.MSpace.kWorld) -> [np.ndarray, np.ndarray, np.ndarray]:
+    pos_list, nml_list, length_list = [], [], []
+    for target_mesh in target_meshes:
+        face_vertices = ReadMeshFaceVertices(target_mesh)[2]
+        edges = ReadMeshAdjacency(target_mesh)[0]
+        uvs = ReadVertexUVs(target_mesh, face_vertices)
+        pos, nml, offsets = TKCM_ChainMath.cardChains(ReadMeshPoints(target_mesh, space), ReadMeshVertexNormals(target_mesh, space), edges, uvs)
+        pos_list.append(pos)
+        nml_list.append(nml)
+        length_list.append(np.diff(offsets))
+    return [np.concatenate(pos_list), np.concatenate(nml_list), TKCM_ChainMath.chainOffsets(np.concatenate(length_list))]
+
+# チューブのリングを辿って、各リングの重心とアップベクトル（重心から追跡した頂点への向き）を算出する
+# chains: 開始リングとして選択した頂点もしくはエッジ, track_id: 開始リングでアップベクトルの基準にする頂点ID（-1の場合は最小のID）
+# 戻り値: [重心の位置, アップベクトル, 各チェインの先頭位置(offsets)]
+def SampleTubeRings(chains:list, track_id:int = -1, reverse:bool = False, space :om2.MSpace = om2.MSpace.kWorld) -> [np.ndarray, np.ndarray, np.ndarray]:
+    pos_list, nml_list, length_list = [], [], []
+    for comp_type, comp_ids, target_mesh in chains:
+        comp_ids = np.array(comp_ids, dtype=np.int64)
+        if comp_type == TKCM_Util.MeshCompType.kEdge:
+            start_ring = ReadEdgeVertices(target_mesh, comp_ids).ravel()
+        elif comp_type == TKCM_Util.MeshCompType.kVertex:
+            start_ring = comp_ids
+        else:
+            om2.MGlobal.displayWarning("tube rings need vertices or edges: {}".format(MeshPathKey(target_mesh)))
             continue
-        tree_i, remainder = TKCM_Util.binarySearchTree(length_pack, e*i)
-        t = remainder / (length_pack[tree_i+1] - length_pack[tree_i])
-        p = TKCM_Util.lerp_MPoint(poi_pos_array[tree_i], poi_pos_array[tree_i+1], t)
-        n = TKCM_Util.lerp_MVector(poi_nml_array[tree_i], poi_nml_array[tree_i+1], t)
-        interval_pos_array.append(p)
-        interval_nml_array.append(n)
-    interval_pos_array.append(poi_pos_array[-1])
-    interval_nml_array.append(poi_nml_array[-1])
-
-    return [interval_pos_array, interval_nml_array]
-    
+        _, indptr, indices = ReadMeshAdjacency(target_mesh)
+        ring_vertices, ring_offsets, tracks = TKCM_ChainMath.tubeRings(indptr, indices, start_ring, track_id if track_id in start_ring else -1, reverse)
+        if len(tracks) < 2:
+            om2.MGlobal.displayWarning("no rings found next to the selected ring: {}".format(MeshPathKey(target_mesh)))
+            continue
+        pos, up = TKCM_ChainMath.ringCentroids(ReadMeshPoints(target_mesh, space), ring_vertices, ring_offsets, tracks)
+        pos_list.append(pos)
+        nml_list.append(up)
+        length_list.append([len(pos)])
+    if len(pos_list) == 0:
+        return [np.zeros((0, 3)), np.zeros((0, 3)), TKCM_ChainMath.chainOffsets([])]
+    return [np.concatenate(pos_list), np.concatenate(nml_list), TKCM_ChainMath.chainOffsets(np.concatenate(length_list))]
+
+def MakeTubeRingKeys(chains:list, track_id:int, reverse:bool) -> tuple:
+    return (("tubeRings", track_id, reverse),) + MakeChainKeys(chains)
+
+def ComputeHairCardPlan(target_meshes:list, options:dict) -> TKCM_ChainMath.JointChainPlan:
+    poi_pos, poi_nml, poi_offsets = SampleHairCardChains(target_meshes)
+    om2.MGlobal.displayInfo("hair cards: {}".format(len(poi_offsets) - 1))
+    plan_key = MakePlanKey(tuple(("hairCards", MeshPathKey(target_mesh)) for target_mesh in target_meshes), options)
+    return MakeJointChainPlan(plan_key, poi_pos, poi_nml, poi_offsets, options)
+
+# 一括処理と参照用の処理で同じコンポーネントを処理し、結果の差と処理時間を返す
+# 戻り値: [位置の最大誤差, 法線の最大誤差(1-dot), 参照用の処理時間(sec), 一括処理の処理時間(sec)]
+def CompareComponentSampling(comp_type:TKCM_Util.MeshCompType, component_id:om2.MIntArray, target_mesh:om2.MFnMesh, space :om2.MSpace = om2.MSpace.kWorld) -> [float, float, float, float]:
+    start = time.perf_counter()
+    ref_pos, ref_nml = GetComponentPosAndNml(comp_type, component_id, target_mesh, space)
+    ref_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pos, nml = GetComponentPosAndNmlArray(comp_type, component_id, target_mesh, space)
+    bulk_time = time.perf_counter() - start
+
+    ref_pos = np.array(ref_pos, dtype=np.float64)[:, :3]
+    ref_nml = TKCM_ChainMath.normalizeRows(np.array(ref_nml, dtype=np.float64))
+    nml = TKCM_ChainMath.normalizeRows(nml)
+    pos_error = float(np.abs(pos - ref_pos).max()) if len(pos) else 0.0
+    nml_error = float((1.0 - np.einsum('ij,ij->i', nml, ref_nml)).max()) if len(nml) else 0.0
+    om2.MGlobal.displayInfo("components: {}  pos error: {:.3g}  normal error: {:.3g}  reference: {:.4f} sec  bulk: {:.4f} sec".format(len(pos), pos_error, nml_error, ref_time, bulk_time))
+    return [pos_error, nml_error, ref_time, bulk_time]
+
+# コマンドのフラグからJointChainPlanの計算に使うオプションを取り出す（プレビューのオプションと同じキー名にする）
+def MakePlanOptions(flagValues:dict) -> dict:
+    return dict(
+        create_type=flagValues["-createType"],
+        create_count=flagValues["-createCount"],
+        axis_type=flagValues["-axisType"],
+        aim_neg=flagValues["-aimAxisNeg"],
+        up_neg=flagValues["-upAxisNeg"],
+        root=flagValues["-createRootjoint"],
+        tip=flagValues["-createTipJoint"],
+        curvature_weight=flagValues["-curvatureWeight"],
+        tolerance=flagValues["-tolerance"],
+        spacing=flagValues["-spacing"],
+        frame_type=flagValues["-frameType"],
+        normal_blend=flagValues["-normalBlend"])
+
+# チェインのメッシュの現在の形状を表すキーを作る（メッシュの変更を検知する世代番号とワールド行列。メインスレッドで呼ぶ）
+# 同じメッシュ・コンポーネントでも、形状が変わっていればサンプリングした結果やJointChainPlanは再利用しない
+def MakeGeometryKeys(chains:list) -> tuple:
+    geometry_keys = {}
+    for _, _, target_mesh in chains:
+        mesh_key = MeshPathKey(target_mesh)
+        if mesh_key not in geometry_keys:
+            geometry_keys[mesh_key] = (mesh_key, TKCM_MeshCache.getMeshCache().geometryGeneration(target_mesh), tuple(target_mesh.getPath().inclusiveMatrix()))
+    return tuple(geometry_keys.values())
+
+# チェインのメッシュとコンポーネントを表すキーを作る（メッシュのパスを取得するのでメインスレッドで呼ぶ）
+def MakeChainKeys(chains:list) -> tuple:
+    return tuple((MeshPathKey(target_mesh), comp_type.value, tuple(comp_ids)) for comp_type, comp_ids, target_mesh in chains)
+
+# JointChainPlanの結果を決める値（メッシュ・コンポーネント・オプション）をまとめたキーを作る
+def MakePlanKey(chain_keys:tuple, options:dict) -> tuple:
+    normal_blend = options["normal_blend"] if options["frame_type"] == TKCM_ChainMath.kFrameRotationMinimizing else 0.0
+    return (chain_keys,) + MakeResampleKey(options) + (options["axis_type"], options["aim_neg"], options["up_neg"], options["root"], options["tip"], options["frame_type"], normal_blend)
+
+# ジョイントを配置する位置の計算に影響するオプションだけをまとめたキーを作る（createTypeで使わないオプションは含めない）
+def MakeResampleKey(options:dict) -> tuple:
+    create_type = options["create_type"]
+    create_count = options["create_count"] if create_type in (1, 2) else 0
+    curvature_weight = options["curvature_weight"] if create_type == 2 else 0.0
+    tolerance = options["tolerance"] if create_type == 3 else 0.0
+    spacing = options["spacing"] if create_type == 4 else 0.0
+    return (create_type, create_count, curvature_weight, tolerance, spacing)
+
+# チェインのサンプリングからジョイントの位置と向きの算出までをまとめて行う
+def ComputeJointChainPlan(chains:list, options:dict, plan_key:tuple, reference_sampling:bool = False) -> TKCM_ChainMath.JointChainPlan:
+    poi_pos, poi_nml, poi_offsets = SampleChains(chains, reference_sampling)
+    return MakeJointChainPlan(plan_key, poi_pos, poi_nml, poi_offsets, options)
+
+def MakeJointChainPlan(plan_key:tuple, poi_pos:np.ndarray, poi_nml:np.ndarray, poi_offsets:np.ndarray, options:dict) -> TKCM_ChainMath.JointChainPlan:
+    poi_pos, poi_nml, poi_offsets, error = TKCM_ChainMath.resampleChains(poi_pos, poi_nml, poi_offsets, options["create_type"], options["create_count"], options["curvature_weight"], options["tolerance"], options["spacing"])
+    return TKCM_ChainMath.JointChainPlan(plan_key, poi_pos, poi_nml, poi_offsets, options["axis_type"], options["aim_neg"], options["up_neg"], options["root"], options["tip"], options["frame_type"], options["normal_blend"], error)
+
+# プレビューで最後に計算したJointChainPlan（コマンドはキーが一致する場合だけ再利用する）
+_preview_plan = None
+def SetPreviewPlan(plan:TKCM_ChainMath.JointChainPlan):
+    global _preview_plan
+    _preview_plan = plan
+
+def GetPreviewPlan(plan_key:tuple) -> TKCM_ChainMath.JointChainPlan:
+    plan = _preview_plan
+    return plan if plan is not None and plan.key == plan_key else None
+
+# ジョイントチェインを作成する処理をMDagModifierに積む（実行はしないので、呼び出し側でdoIt()/undoIt()を行う）
+# joint_pos: (N,3)のグローバル座標, joint_g_mat: (N,3,3)のグローバル回転行列（行が各軸）, joint_l_rad: (N,3)の親に対するローカル回転(Euler XYZ radian)
+# parent_ids: (N,)の親ジョイントのインデックス（-1はワールド直下）, 親は必ず子より前のインデックスにあること
+def BuildJointChain(dag_modifier:om2.MDagModifier, joint_pos:np.ndarray, joint_g_mat:np.ndarray, joint_l_rad:np.ndarray, parent_ids:np.ndarray, set_on_joint_orient:bool, joint_names:list = None) -> list:
+    joint_l_pos = TKCM_ChainMath.localTranslations(joint_pos, joint_g_mat, parent_ids)
+    return AddJointNodes(dag_modifier, joint_l_pos, joint_l_rad, parent_ids, set_on_joint_orient, joint_names, [])
+
+# ジョイントを作成する処理をMDagModifierに積む（parent_idsはjoint_objectsのインデックスで、作成したジョイントはjoint_objectsの末尾に追加する）
+def AddJointNodes(dag_modifier:om2.MDagModifier, joint_l_pos:np.ndarray, joint_l_rad:np.ndarray, parent_ids:np.ndarray, set_on_joint_orient:bool, joint_names:list, joint_objects:list) -> list:
+    rot_attrs = ("jointOrientX", "jointOrientY", "jointOrientZ") if set_on_joint_orient else ("rotateX", "rotateY", "rotateZ")
+    pos_list = joint_l_pos.tolist()
+    rot_list = joint_l_rad.tolist()
+    parent_list = parent_ids.tolist()
+    for i in range(len(pos_list)):
+        parent_obj = joint_objects[parent_list[i]] if parent_list[i] >= 0 else om2.MObject.kNullObj
+        joint_obj = dag_modifier.createNode("joint", parent_obj)
+        if joint_names:
+            dag_modifier.renameNode(joint_obj, joint_names[i])
+
+        joint_fn = om2.MFnDependencyNode(joint_obj)
+        for attr, val in zip(("translateX", "translateY", "translateZ"), pos_list[i]):
+            dag_modifier.newPlugValueDouble(joint_fn.findPlug(attr, False), val)
+        for attr, val in zip(rot_attrs, rot_list[i]):
+            dag_modifier.newPlugValueDouble(joint_fn.findPlug(attr, False), val)
+        joint_objects.append(joint_obj)
+    return joint_objects
+
+# ジョイントの名前をまとめて作成する（プレフィックスが空の場合はNoneを返してMayaの既定の名前に任せる）
+# offsets: 各チェインの先頭のジョイントの位置（チェインが複数ある場合は プレフィックス+チェイン番号_ジョイント番号 にする）
+def MakeJointNames(prefix:str, offsets:np.ndarray) -> list:
+    if len(prefix) == 0:
+        return None
+    counts = np.diff(offsets).tolist()
+    if len(counts) == 1:
+        return ["{}{}".format(prefix, i+1) for i in range(counts[0])]
+    return ["{}{}_{}".format(prefix, c+1, i+1) for c, count in enumerate(counts) for i in range(count)]
+
+# MakeJointNames()と同じ名前をチャンクのジョイントの分だけ作成する
+def MakeChunkJointNames(prefix:str, chain_count:int, chunk:TKCM_ChainMath.JointChunk) -> list:
+    if len(prefix) == 0:
+        return None
+    if chain_count == 1:
+        return ["{}{}".format(prefix, i+1) for i in chunk.chain_joint_ids.tolist()]
+    return ["{}{}_{}".format(prefix, c+1, i+1) for c, i in zip(chunk.chain_ids.tolist(), chunk.chain_joint_ids.tolist())]
+
+# 間隔を指定したジョイントチェインを一定数ごとに計算してMDagModifierに積む（一度に確保する配列の大きさはチャンクの大きさで決まる）
+# 戻り値: [作成したジョイントのMObjectのリスト, ルートジョイントのインデックス]
+def BuildSpacedJointChains(dag_modifier:om2.MDagModifier, poi_pos:np.ndarray, poi_nml:np.ndarray, poi_offsets:np.ndarray, options:dict, set_on_joint_orient:bool, prefix:str) -> [list, list]:
+    joint_objects = []
+    root_ids = []
+    chunks = TKCM_ChainMath.iterSpacedJointChunks(poi_pos, poi_nml, poi_offsets, options["spacing"], options["axis_type"], options["aim_neg"], options["up_neg"], options["root"], options["tip"], options["frame_type"], options["normal_blend"])
+    for chunk in chunks:
+        AddJointNodes(dag_modifier, chunk.local_pos, chunk.local_rad, chunk.parent_ids, set_on_joint_orient, MakeChunkJointNames(prefix, len(poi_offsets) - 1, chunk), joint_objects)
+        root_ids.extend(chunk.rootIds().tolist())
+    return [joint_objects, root_ids]
+
+# フレームごとにチェインのコンポーネントの位置と法線を取得して、全フレームのジョイントの位置と回転をまとめて算出する
+# 各フレームではメッシュの頂点の座標と法線だけを読み直し、トポロジーの情報とジョイントを配置する区間パラメータ（最初のフレームの形で求める）は全フレームで共有する
+# 戻り値: [各チェインの先頭のジョイントの位置, 親ジョイントのインデックス, 親の空間での位置(F,J,3), 親に対するローカル回転(F,J,3)]
+def ComputeBakedJointChains(chains:list, options:dict, frames:list) -> [np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    offsets = TKCM_ChainMath.chainOffsets([len(comp_ids) for _, comp_ids, _ in chains])
+    sources = [] # [コンポーネントのタイプ, トポロジーの情報, メッシュのキー, worldMeshのプラグ]
+    for comp_type, comp_ids, target_mesh in chains:
+        shape_path = target_mesh.getPath().extendToShape()
+        world_mesh_plug = om2.MFnDependencyNode(shape_path.node()).findPlug("worldMesh", False).elementByLogicalIndex(shape_path.instanceNumber())
+        sources.append((comp_type, ReadComponentTopology(comp_type, np.array(comp_ids, dtype=np.int64), target_mesh), shape_path.fullPathName(), world_mesh_plug))
+
+    pos = np.empty((len(frames), offsets[-1], 3))
+    nml = np.empty((len(frames), offsets[-1], 3))
+    for f, frame in enumerate(frames):
+        # 現在の時間は変えずに、指定したフレームのコンテキストでworldMeshを評価する
+        prev_context = om2.MDGContext(om2.MTime(frame, om2.MTime.uiUnit())).makeCurrent()
+        try:
+            frame_meshes = {}
+            for chain_id, (comp_type, topology, mesh_key, world_mesh_plug) in enumerate(sources):
+                if mesh_key not in frame_meshes:
+                    frame_meshes[mesh_key] = om2.MFnMesh(world_mesh_plug.asMObject())
+                chain_pos, chain_nml = ComponentPosAndNmlFromTopology(comp_type, topology, frame_meshes[mesh_key], om2.MSpace.kObject, False) # フレームごとのメッシュデータはキャッシュされない
+                pos[f, offsets[chain_id]:offsets[chain_id + 1]] = chain_pos
+                nml[f, offsets[chain_id]:offsets[chain_id + 1]] = chain_nml
+        finally:
+            prev_context.makeCurrent()
+
+    # 全フレームのチェインを1つの複数チェインの配列にして、向きと親に対する回転を一括で算出する
+    seg_ids, t, joint_offsets, _ = TKCM_ChainMath.resampleParameters(pos[0], offsets, options["create_type"], options["create_count"], options["curvature_weight"], options["tolerance"], options["spacing"])
+    frame_count, sample_count = pos.shape[:2]
+    frame_seg_ids = ( seg_ids[None, :] + ( np.arange(frame_count) * sample_count )[:, None] ).ravel()
+    frame_t = np.tile(t, frame_count)
+    frame_offsets = TKCM_ChainMath.chainOffsets(np.tile(np.diff(joint_offsets), frame_count))
+    plan = TKCM_ChainMath.JointChainPlan(None, TKCM_ChainMath.interpolateParameters(pos.reshape(-1, 3), frame_seg_ids, frame_t), TKCM_ChainMath.interpolateParameters(nml.reshape(-1, 3), frame_seg_ids, frame_t),
+                                         frame_offsets, options["axis_type"], options["aim_neg"], options["up_neg"], options["root"], options["tip"], options["frame_type"], options["normal_blend"])
+    joint_count = plan.jointCount() // frame_count
+    local_pos = TKCM_ChainMath.localTranslations(plan.joint_pos, plan.frames, plan.parent_ids).reshape(frame_count, joint_count, 3)
+    local_rad = np.unwrap(plan.local_rad.reshape(frame_count, joint_count, 3), axis=0) # フレーム間で回転値が±180度を跨いで飛ばないようにする
+    return [plan.joint_offsets[:len(offsets)], plan.parent_ids[:joint_count], local_pos, local_rad]
+
+# ジョイントの移動と回転の各チャンネルにアニメーションカーブを作成して、全フレームのキーを1回の呼び出しでまとめて追加する
+# カーブの接続はanim_modifierに積むので、コマンドのアンドゥでまとめて取り消せる
+def BakeJointChannels(anim_modifier:om2.MDGModifier, joint_objects:list, frames:list, local_pos:np.ndarray, local_rad:np.ndarray):
+    times = om2.MTimeArray()
+    for frame in frames:
+        times.append(om2.MTime(frame, om2.MTime.uiUnit()))
+    channels = (("translateX", local_pos, 0, om2a.MFnAnimCurve.kAnimCurveTL), ("translateY", local_pos, 1, om2a.MFnAnimCurve.kAnimCurveTL), ("translateZ", local_pos, 2, om2a.MFnAnimCurve.kAnimCurveTL),
+                ("rotateX", local_rad, 0, om2a.MFnAnimCurve.kAnimCurveTA), ("rotateY", local_rad, 1, om2a.MFnAnimCurve.kAnimCurveTA), ("rotateZ", local_rad, 2, om2a.MFnAnimCurve.kAnimCurveTA))
+    curve_fn = om2a.MFnAnimCurve()
+    for joint_id, joint_obj in enumerate(joint_objects):
+        joint_fn = om2.MFnDependencyNode(joint_obj)
+        for attr, values, axis, curve_type in channels:
+            curve_fn.create(joint_fn.findPlug(attr, False), curve_type, anim_modifier)
+            curve_fn.addKeys(times, om2.MDoubleArray(values[:, joint_id, axis].tolist()), om2a.MFnAnimCurve.kTangentLinear, om2a.MFnAnimCurve.kTangentLinear)
+
+##########################################################################################################################################################################################################################################################
+##########################################################################################################################################################################################################################################################
+##########################################################################################################################################################################################################################################################
+##########################################################################################################################################################################################################################################################
+##########################################################################################################################################################################################################################################################
+## ライブノード（メッシュの変形に追従するジョイントチェインのワールド行列を出力する）
+## 例：メッシュのworldMesh[0]をinMeshに接続して、outMatrix[i]を各ジョイントのoffsetParentMatrixに接続する
+
+class CJOMC_JointChainNode(om2.MPxNode):
+    kNodeName = 'CJOMC_JointChainNode'
+    kTypeId = om2.MTypeId( 0x00081163 )
+
+    aInMesh = None
+    aComponentType = None
+    aComponentIds = None
+    aCreateType = None
+    aCreateCount = None
+    aCurvatureWeight = None
+    aTolerance = None
+    aSpacing = None
+    aAxisType = None
+    aAimAxisNeg = None
+    aUpAxisNeg = None
+    aCreateRootJoint = None
+    aCreateTipJoint = None
+    aFrameType = None
+    aNormalBlend = None
+    aOutMatrix = None
+
+    def __init__(self):
+        om2.MPxNode.__init__(self)
+        # トポロジーに依存する情報のキャッシュ（ノードごとに持つので、複数のノードを並列に評価しても共有しない）
+        self.topology_cache = (None, None) # [キー, ReadComponentTopology()の戻り値]
+        self.rest_cache = (None, None)     # [キー, resampleParameters()の戻り値] 最初に評価した時のポイントで求めた区間パラメータ
+
+    @classmethod
+    def creator(cls):
+        return cls()
+
+    @classmethod
+    def initialize(cls):
+        typed_fn = om2.MFnTypedAttribute()
+        numeric_fn = om2.MFnNumericAttribute()
+        enum_fn = om2.MFnEnumAttribute()
+        matrix_fn = om2.MFnMatrixAttribute()
+
+        cls.aInMesh = typed_fn.create("inMesh", "im", om2.MFnData.kMesh)
+        typed_fn.storable = False
+        cls.aComponentIds = typed_fn.create("componentIds", "cid", om2.MFnData.kIntArray, om2.MFnIntArrayData().create())
+
+        cls.aComponentType = enum_fn.create("componentType", "cpt", TKCM_ChainMath.kCompVertex)
+        for name, value in (("vertex", TKCM_ChainMath.kCompVertex), ("edge", TKCM_ChainMath.kCompEdge), ("face", TKCM_ChainMath.kCompFace)):
+            enum_fn.addField(name, value)
+        cls.aCreateType = enum_fn.create("createType", "ct", 0)
+        for value, name in enumerate(("onComponentCenter", "evenlyInterval", "curvatureAdaptive", "simplify", "fixedSpacing")):
+            enum_fn.addField(name, value)
+        cls.aAxisType = enum_fn.create("axisType", "at", 3)
+        for value, name in enumerate(("ZY", "ZX", "XZ", "XY", "YX", "YZ")):
+            enum_fn.addField(name, value)
+        cls.aFrameType = enum_fn.create("frameType", "ft", TKCM_ChainMath.kFrameNormal)
+        enum_fn.addField("componentNormal", TKCM_ChainMath.kFrameNormal)
+        enum_fn.addField("rotationMinimizing", TKCM_ChainMath.kFrameRotationMinimizing)
+
+        cls.aCreateCount = numeric_fn.create("createCount", "cc", om2.MFnNumericData.kInt, 1)
+        numeric_fn.setMin(0)
+        cls.aCurvatureWeight = numeric_fn.create("curvatureWeight", "cw", om2.MFnNumericData.kDouble, 0.5)
+        numeric_fn.setMin(0.0)
+        numeric_fn.setMax(1.0)
+        cls.aTolerance = numeric_fn.create("tolerance", "tol", om2.MFnNumericData.kDouble, 0.1)
+        numeric_fn.setMin(0.0)
+        cls.aSpacing = numeric_fn.create("spacing", "sp", om2.MFnNumericData.kDouble, 1.0)
+        numeric_fn.setMin(1.0e-4)
+        cls.aNormalBlend = numeric_fn.create("normalBlend", "nb", om2.MFnNumericData.kDouble, 0.0)
+        numeric_fn.setMin(0.0)
+        numeric_fn.setMax(1.0)
+        cls.aAimAxisNeg = numeric_fn.create("aimAxisNeg", "aan", om2.MFnNumericData.kBoolean, False)
+        cls.aUpAxisNeg = numeric_fn.create("upAxisNeg", "uan", om2.MFnNumericData.kBoolean, False)
+        cls.aCreateRootJoint = numeric_fn.create("createRootjoint", "rj", om2.MFnNumericData.kBoolean, True)
+        cls.aCreateTipJoint = numeric_fn.create("createTipJoint", "tj", om2.MFnNumericData.kBoolean, True)
+
+        cls.aOutMatrix = matrix_fn.create("outMatrix", "om", om2.MFnMatrixAttribute.kDouble)
+        matrix_fn.array = True
+        matrix_fn.usesArrayDataBuilder = True
+        matrix_fn.writable = False
+        matrix_fn.storable = False
+
+        inputs = (cls.aInMesh, cls.aComponentType, cls.aComponentIds, cls.aCreateType, cls.aCreateCount, cls.aCurvatureWeight, cls.aTolerance, cls.aSpacing,
+                  cls.aAxisType, cls.aAimAxisNeg, cls.aUpAxisNeg, cls.aCreateRootJoint, cls.aCreateTipJoint, cls.aFrameType, cls.aNormalBlend)
+        for attr in inputs + (cls.aOutMatrix,):
+            cls.addAttribute(attr)
+        for attr in inputs:
+            cls.attributeAffects(attr, cls.aOutMatrix)
+
+    # virtual
+    def schedulingType(self):
+        # 計算はノード自身のキャッシュと入力だけを使うので、他のノードと並列に評価できる
+        return om2.MPxNode.kParallel
+
+    # virtual
+    def compute(self, plug, data):
+        if plug != self.aOutMatrix and ( plug.isElement == False or plug.array() != self.aOutMatrix ):
+            return None
+
+        options = self.read_options(data)
+        comp_type = TKCM_Util.MeshCompType(data.inputValue(self.aComponentType).asShort())
+        comp_ids = np.array(om2.MFnIntArrayData(data.inputValue(self.aComponentIds).data()).array(), dtype=np.int64)
+        mesh_obj = data.inputValue(self.aInMesh).asMesh()
+
+        matrices = np.zeros((0, 4, 4))
+        if mesh_obj.isNull() == False and len(comp_ids) >= 2:
+            target_mesh = om2.MFnMesh(mesh_obj)
+            # inMeshのデータはworldMeshなどの接続元の空間の座標を持っているので、そのままの座標を使う
+            poi_pos, poi_nml = self.sample(comp_type, comp_ids, target_mesh)
+            if poi_pos is not None:
+                matrices = self.evaluate(poi_pos, poi_nml, comp_type, comp_ids, target_mesh, options)
+
+        # 出力の要素数をジョイント数に合わせて作り直す
+        out_handle = data.outputArrayValue(self.aOutMatrix)
+        builder = om2.MArrayDataBuilder(data, self.aOutMatrix, len(matrices))
+        for i, matrix in enumerate(matrices.reshape(-1, 16).tolist()):
+            builder.addElement(i).setMMatrix(om2.MMatrix(matrix))
+        out_handle.set(builder)
+        out_handle.setAllClean()
+        data.setClean(plug)
+
+    def read_options(self, data) -> dict:
+        # コマンドのMakePlanOptions()と同じキーの辞書にする
+        return dict(
+            create_type=data.inputValue(self.aCreateType).asShort(),
+            create_count=data.inputValue(self.aCreateCount).asInt(),
+            axis_type=data.inputValue(self.aAxisType).asShort(),
+            aim_neg=data.inputValue(self.aAimAxisNeg).asBool(),
+            up_neg=data.inputValue(self.aUpAxisNeg).asBool(),
+            root=data.inputValue(self.aCreateRootJoint).asBool(),
+            tip=data.inputValue(self.aCreateTipJoint).asBool(),
+            curvature_weight=data.inputValue(self.aCurvatureWeight).asDouble(),
+            tolerance=data.inputValue(self.aTolerance).asDouble(),
+            spacing=data.inputValue(self.aSpacing).asDouble(),
+            frame_type=data.inputValue(self.aFrameType).asShort(),
+            normal_blend=data.inputValue(self.aNormalBlend).asDouble())
+
+    def sample(self, comp_type:TKCM_Util.MeshCompType, comp_ids:np.ndarray, target_mesh:om2.MFnMesh) -> [np.ndarray, np.ndarray]:
+        # トポロジーが前回と同じ場合はキャッシュした頂点IDの情報を使って、頂点の座標と法線だけを読み直す
+        # ノードは並列に評価されるので、共有のキャッシュ(util.mesh_cache)のロックを取らずにinMeshのデータから直接読む
+        topology_key = (comp_type, comp_ids.tobytes(), MeshTopologyKey(target_mesh))
+        if self.topology_cache[0] != topology_key:
+            limits = {TKCM_Util.MeshCompType.kVertex: target_mesh.numVertices, TKCM_Util.MeshCompType.kEdge: target_mesh.numEdges, TKCM_Util.MeshCompType.kFace: target_mesh.numPolygons}
+            if comp_type not in limits or comp_ids.min() < 0 or comp_ids.max() >= limits[comp_type]:
+                self.topology_cache = (None, None)
+                return [None, None]
+            self.topology_cache = (topology_key, ReadComponentTopology(comp_type, comp_ids, target_mesh, False))
+        return ComponentPosAndNmlFromTopology(comp_type, self.topology_cache[1], target_mesh, om2.MSpace.kObject, False)
+
+    def evaluate(self, poi_pos:np.ndarray, poi_nml:np.ndarray, comp_type:TKCM_Util.MeshCompType, comp_ids:np.ndarray, target_mesh:om2.MFnMesh, options:dict) -> np.ndarray:
+        # ジョイントを配置する区間パラメータは最初に評価した時（トポロジーかオプションが変わった時）の形で求めてキャッシュしておき、
+        # 以降のフレームでは同じパラメータで補間する（ジョイントがメッシュ上の同じ位置に留まる）
+        poi_offsets = TKCM_ChainMath.uniformOffsets(1, len(poi_pos))
+        rest_key = (self.topology_cache[0], MakeResampleKey(options))
+        if self.rest_cache[0] != rest_key:
+            self.rest_cache = (rest_key, TKCM_ChainMath.resampleParameters(poi_pos, poi_offsets, options["create_type"], options["create_count"], options["curvature_weight"], options["tolerance"], options["spacing"]))
+        seg_ids, t, offsets, error = self.rest_cache[1]
+        pos = TKCM_ChainMath.interpolateParameters(poi_pos, seg_ids, t)
+        nml = TKCM_ChainMath.interpolateParameters(poi_nml, seg_ids, t)
+        plan = TKCM_ChainMath.JointChainPlan(None, pos, nml, offsets, options["axis_type"], options["aim_neg"], options["up_neg"], options["root"], options["tip"], options["frame_type"], options["normal_blend"], error)
+
+        # 行ベクトル形式の4x4行列（回転の3行 + 位置の行）
+        matrices = np.zeros((plan.jointCount(), 4, 4))
+        matrices[:, :3, :3] = plan.frames
+        matrices[:, 3, :3] = plan.joint_pos
+        matrices[:, 3, 3] = 1.0
+        return matrices
+
 ##########################################################################################################################################################################################################################################################
 ##########################################################################################################################################################################################################################################################
 ##########################################################################################################################################################################################################################################################
@@ -249,6 +1025,116 @@ def RecomputeIntervalPosAndNml(div_count:int, poi_pos_array:om2.MPointArray(), p
 ##########################################################################################################################################################################################################################################################
 ## カスタムマニピュレータを介したデバッグドローイング
 
+# ジョイントの座標ラインを描くための頂点リストをまとめて作る（lineList用に始点と終点を交互に並べる）
+def MakeAxisLines(joint_pos:np.ndarray, aim:np.ndarray, up:np.ndarray, joint_size:float) -> [np.ndarray, np.ndarray]:
+    aim_head = joint_pos + aim * (joint_size * 0.5)
+    aim_lines = np.stack([joint_pos, joint_pos + aim * joint_size, aim_head, aim_head + ( joint_pos + up * (joint_size * 0.5) - aim_head ) * 0.85], axis=1).reshape(-1, 3)
+    up_lines = np.stack([joint_pos, joint_pos + up * joint_size], axis=1).reshape(-1, 3)
+    return [aim_lines, up_lines]
+
+# プレビューの計算をバックグラウンドで行うためのスレッド（古いジョブが溜まらないようにワーカーは1つだけにする）
+_preview_executor = None
+def GetPreviewExecutor() -> concurrent.futures.ThreadPoolExecutor:
+    global _preview_executor
+    if _preview_executor is None:
+        _preview_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="CJOMC_preview")
+    return _preview_executor
+
+# プレビュー用の計算を段階ごとにキャッシュする（サンプリング -> 再計算(等分割) -> 向き -> 描画用の頂点リスト）
+# 各段階は入力のキーが変わった時だけ再計算するので、オプションを変更した時は変更の影響を受ける段階以降だけが再計算される
+# サンプリングはメッシュを読むのでメインスレッドで行い、それ以降はNumPyの配列だけを扱うのでワーカースレッドでも実行できる
+class CJOMC_PreviewPipeline(object):
+    def __init__(self):
+        self.source = None # [コンポーネントのタイプ, コンポーネントID(選択順), MFnMesh]
+        self.source_keys = () # MakeChainKeys()で作ったsourceのキー（ワーカースレッドからメッシュにアクセスしないように登録時に作っておく）
+        self.tube_rings = None # チューブのリングの重心を使う場合は逆順にするか(bool)、使わない場合はNone
+        self.source_version = 0
+        self.stage_keys = {}
+        self.stage_results = {}
+        self.lock = threading.Lock()
+        self.job_id = 0 # 最新のジョブの番号（これと異なる番号のジョブは古いので破棄する）
+
+    # 処理対象のコンポーネントを登録する（メッシュの再サンプリングが必要になるのはこのタイミングだけ）
+    def set_source(self, comp_type:TKCM_Util.MeshCompType, comp_ids:om2.MIntArray, target_mesh:om2.MFnMesh, tube_rings:bool = None):
+        self.source = [comp_type, comp_ids, target_mesh]
+        self.tube_rings = tube_rings
+        self.source_keys = MakeChainKeys([self.source]) if tube_rings is None else MakeTubeRingKeys([self.source], -1, tube_rings)
+        self.source_version += 1
+
+    # キーが前回と異なる場合だけcompute()を実行して結果を保持する
+    # ロックは保持している結果の読み書きの間だけ取り、計算中は取らない（メインスレッドのsnapshot()がワーカースレッドの計算を待たないようにする）
+    # job_id: 計算が終わった時点で古くなっていたジョブの結果は保持しない（Noneの場合は常に保持する）
+    def stage(self, name:str, key:tuple, compute, job_id:int = None):
+        with self.lock:
+            if self.stage_keys.get(name) == key:
+                return self.stage_results[name]
+        result = compute()
+        with self.lock:
+            if job_id is None or self.is_stale(job_id) == False:
+                self.stage_results[name] = result
+                self.stage_keys[name] = key
+        return result
+
+    def new_job(self) -> int:
+        self.job_id += 1
+        return self.job_id
+
+    def is_stale(self, job_id:int) -> bool:
+        return job_id != self.job_id
+
+    # メッシュのデータを読み込んで変更不可の配列にしたもの（スナップショット）を返す（メインスレッド専用）
+    # 戻り値: [キー, [位置, 法線], JointChainPlanのキーに使うチェインと形状のキー]
+    def snapshot(self) -> list:
+        if self.source is None:
+            return None
+        geometry_keys = MakeGeometryKeys([self.source])
+        sample_key = (self.source_version,) + geometry_keys # オプションだけを変更した場合でも、メッシュが変更されていれば読み直す
+        return [sample_key, self.stage("sample", sample_key, self.compute_sample), self.source_keys + geometry_keys]
+
+    # スナップショットとオプションから描画用の頂点リストを算出する（途中で新しいジョブが来た場合はNoneを返す）
+    # 算出したJointChainPlanは、publish()で最新のジョブの結果であることを確認してからコマンドが再利用できるように登録する
+    # 戻り値: [コンポーネントの位置, Aim軸のライン, Up軸のライン, JointChainPlan(チェインにならない場合はNone)]
+    def compute(self, snapshot:list, options:dict, job_id:int) -> [np.ndarray, np.ndarray, np.ndarray, TKCM_ChainMath.JointChainPlan]:
+        sample_key, sample, chain_keys = snapshot
+        if len(sample[0]) < 2: # チェインにならない（チューブのリングが見つからなかった場合など）
+            return [sample[0], np.zeros((0, 3)), np.zeros((0, 3)), None]
+        resample_key = sample_key + MakeResampleKey(options)
+        plan_key = MakePlanKey(chain_keys, options)
+        draw_key = (sample_key, plan_key, options["draw_joint"])
+
+        resample = self.stage("resample", resample_key, lambda: self.compute_resample(sample, options), job_id)
+        if self.is_stale(job_id):
+            return None
+        plan = self.stage("plan", (sample_key, plan_key), lambda: self.compute_plan(resample, plan_key, options), job_id)
+        if self.is_stale(job_id):
+            return None
+        draw = self.stage("draw", draw_key, lambda: self.compute_draw(plan, options), job_id)
+        return [sample[0], draw[0], draw[1], plan]
+
+    def compute_sample(self) -> [np.ndarray, np.ndarray]:
+        # コンポーネントのタイプごとに位置と法線の情報を取得する（チューブの場合はリングの重心とアップベクトル）
+        if self.tube_rings is None:
+            poi_pos, poi_nml = GetComponentPosAndNmlArray(*self.source)
+        else:
+            poi_pos, poi_nml, _ = SampleTubeRings([self.source], -1, self.tube_rings)
+        poi_pos.flags.writeable = False
+        poi_nml.flags.writeable = False
+        return [poi_pos, poi_nml]
+
+    def compute_resample(self, sample:list, options:dict) -> [np.ndarray, np.ndarray, np.ndarray, float]:
+        # 等分割・曲がり具合に応じた分割・簡略化・間隔指定の場合は再計算
+        return TKCM_ChainMath.resampleChains(sample[0], sample[1], TKCM_ChainMath.uniformOffsets(1, len(sample[0])), options["create_type"], options["create_count"], options["curvature_weight"], options["tolerance"], options["spacing"])
+
+    def compute_plan(self, resample:list, plan_key:tuple, options:dict) -> TKCM_ChainMath.JointChainPlan:
+        # コマンドと同じ計算でジョイントの位置と向きを算出する
+        return TKCM_ChainMath.JointChainPlan(plan_key, resample[0], resample[1], resample[2], options["axis_type"], options["aim_neg"], options["up_neg"], options["root"], options["tip"], options["frame_type"], options["normal_blend"], resample[3])
+
+    def compute_draw(self, plan:TKCM_ChainMath.JointChainPlan, options:dict) -> [np.ndarray, np.ndarray]:
+        # ジョイントの座標ラインを描くための頂点リストを作る
+        if options["draw_joint"] == False:
+            return [np.zeros((0, 3)), np.zeros((0, 3))]
+        return MakeAxisLines(plan.joint_pos, plan.basis[:, 0], plan.basis[:, 1], plan.min_length * 0.25)
+
 # カスタムマニピュレータ
 class CJOMC_DummyManip (omUI.MPxManipulatorNode):
     kNodeName = 'CJOMC_DummyContextManip'
@@ -258,8 +1144,8 @@ class CJOMC_DummyManip (omUI.MPxManipulatorNode):
         omUI.MPxManipulatorNode.__init__(self)
 
         self.drawHandleName = -1
-        self.components_pos = om2.MPointArray()
-        self.axis_type = 3
+        # 描画するデータ [コンポーネントの位置, Aim軸のライン, Up軸のライン, axisType]（描画中に入れ替わっても混ざらないように1つのタプルで差し替える）
+        self.draw_data = (om2.MPointArray(), om2.MPointArray(), om2.MPointArray(), 3)
 
     @classmethod
     def creator(cls):
@@ -280,43 +1166,46 @@ class CJOMC_DummyManip (omUI.MPxManipulatorNode):
 
     # virtual
     def drawUI(self, draw_manager, frame_context):
+        poi_pos_array, aim_axis_array, up_axis_array, axis_type = self.draw_data
+
         # コンポーネントの順番を描画
         draw_manager.beginDrawable(omR.MUIDrawManager.kNonSelectable, self.drawHandleName)
         self.setHandleColor(draw_manager, self.drawHandleName, self.selectedColor())
         draw_manager.setFontSize(25)
-        draw_manager.text(om2.MPoint(self.poi_pos_array[i]), str(i), omR.MUIDrawManager.kLeft)
+        for i in range(len(poi_pos_array)):
+            draw_manager.text(poi_pos_array[i], str(i), omR.MUIDrawManager.kLeft)
         draw_manager.endDrawable()
 
         # コンポーネントを繋ぐ点線を描画
         draw_manager.beginDrawable(omR.MUIDrawManager.kNonSelectable, self.drawHandleName)
         self.setHandleColor(draw_manager, self.drawHandleName, self.selectedColor())
         draw_manager.setLineStyle(omR.MUIDrawManager.kShortDashed)
-        draw_manager.lineStrip(self.poi_pos_array, False)
+        draw_manager.lineStrip(poi_pos_array, False)
         draw_manager.endDrawable()
 
         # ジョイントの作成候補の座標を描く
         axis_colors = [self.xColor(), self.yColor()]
-        if self.axis_type==0:
+        if axis_type==0:
             axis_colors = [self.zColor(), self.yColor()]
-        elif self.axis_type==1:
+        elif axis_type==1:
             axis_colors = [self.zColor(), self.xColor()]
-        elif self.axis_type==2:
+        elif axis_type==2:
             axis_colors = [self.xColor(), self.zColor()]
-        elif self.axis_type==3:
+        elif axis_type==3:
             axis_colors = [self.xColor(), self.yColor()]
-        elif self.axis_type==4:
+        elif axis_type==4:
             axis_colors = [self.yColor(), self.xColor()]
-        elif self.axis_type==5:
+        elif axis_type==5:
             axis_colors = [self.yColor(), self.zColor()]
         draw_manager.beginDrawable(omR.MUIDrawManager.kNonSelectable, self.drawHandleName)
         self.setHandleColor(draw_manager, self.drawHandleName, axis_colors[0])
         draw_manager.setLineWidth(3)
-        draw_manager.lineList(self.aim_axis_array, False)
+        draw_manager.lineList(aim_axis_array, False)
         draw_manager.endDrawable()
         draw_manager.beginDrawable(omR.MUIDrawManager.kNonSelectable, self.drawHandleName)
         self.setHandleColor(draw_manager, self.drawHandleName, axis_colors[1])
         draw_manager.setLineWidth(3)
-        draw_manager.lineList(self.up_axis_array, False)
+        draw_manager.lineList(up_axis_array, False)
         draw_manager.endDrawable()
 
 # カスタムマニピュレータを登録するコンテキスト
@@ -325,7 +1214,7 @@ class CJOMC_DummyManipContext(omUI.MPxSelectionContext):
     def creator(cls):
         return cls()
 
-    def __init__(self, draw_joint:bool, create_type:int, create_count_:int, root:bool, tip:bool, axis_type:int, aim_neg:bool, up_neg:bool):
+    def __init__(self, options:dict):
         omUI.MPxSelectionContext.__init__(self)
         self.setTitleString('Plug-in create_joints_on_mesh_components dummy manipulator')
 
@@ -333,67 +1222,136 @@ class CJOMC_DummyManipContext(omUI.MPxSelectionContext):
         self.manipulator_class_ptr = None
         self.call_back_id = -1
         self.pass_flag_draw = False
-        self.pass_draw_joint = draw_joint
-        self.pass_axis_type = axis_type
+        self.options = dict(options)
+        self.pipeline = CJOMC_PreviewPipeline()
 
         ##############################################################################################################################################
         ## マニピュレータの新規作成時に描画を決定するために、描画に必要なデータをこのタイミングで算出しておく
         ## update_manipulators()が常にコールされるのでマニピュレータの描画が新規作成されるため
-        # 処理対象とするメッシュのデータを取得する
+        # 処理対象とするメッシュのデータを取得する（メッシュの読み込みはコンテキストの作成時だけ行い、オプションの変更時はキャッシュを使う）
         self.sel_list = om2.MGlobal.getActiveSelectionList();
-        valid, sel_comp_ids, sel_mesh = ParseSelectionList(self.sel_list)
-        # コンポーネントのタイプごとに位置と法線の情報を取得する
-        sel_comp_type = TKCM_Util.selectedComponentType(self.sel_list, 0);
-        self.pass_poi_pos_array, joint_nml_array = GetComponentPosAndNml(sel_comp_type, sel_comp_ids, sel_mesh)
-        joint_pos_array=om2.MPointArray()
-        joint_pos_array.copy(self.pass_poi_pos_array)
-        # 頂点間の距離を算出して最短の値を保持する
-        min_length=float('inf')
-        for i in range(len(joint_pos_array)-1):
-            length = TKCM_Util.getDistanceAtoB(joint_pos_array[i], joint_pos_array[i+1]);
-            min_length = min_length if min_length < length else length
-        # 等分割の場合は再計算
-        if create_type == 1: # evenly intervalタイプの場合
-            joint_pos_array, joint_nml_array = RecomputeIntervalPosAndNml(create_count_, joint_pos_array, joint_nml_array)
-            min_length = TKCM_Util.getDistanceAtoB(joint_pos_array[0], joint_pos_array[1]);
-        
-        # 回転値を算出するためのデータ（DirectionとUpvector）をコンポーネント間の位置情報から算出する(配列の要素末尾は1つ前の値のコピーを入れておく)
-        joint_dir_array = GetChainPoiDirection(joint_nml_array, joint_pos_array);
-        # ジョイントの座標ラインを描くための頂点リストを作る
+        valid, sel_comp_ids, sel_mesh = ParseSelectionList(self.sel_list, self.options["adjacency_order"] == False and self.options["tube_rings"] == False)
+        self.raw_source = [TKCM_Util.selectedComponentType(self.sel_list, 0), sel_comp_ids, sel_mesh] if valid else None # 並べ替える前のコンポーネント
+        self.source_order = None # raw_sourceを並べた時のオプション
+        self.update_source()
+        self.pass_poi_pos_array = om2.MPointArray()
         self.pass_aim_axis_array = om2.MPointArray()
         self.pass_up_axis_array = om2.MPointArray()
-        joint_size = min_length * 0.25
-        aim_size = joint_size * -1 if aim_neg else joint_size
-        up_size = joint_size * -1 if up_neg else joint_size
-        other_size = joint_size * 0.5
-        if draw_joint:
-            for i in range(len(joint_dir_array)):
-                if i==0 and root==False:
-                    continue
-                if i==len(joint_dir_array)-1 and tip==False:
-                    continue
-                self.pass_aim_axis_array.append(joint_pos_array[i])
-                self.pass_aim_axis_array.append(joint_pos_array[i] + (joint_dir_array[i] * aim_size ) )
-
-                self.pass_up_axis_array.append(joint_pos_array[i])
-                up = (joint_dir_array[i]^(joint_nml_array[i]))^(joint_dir_array[i])
-                self.pass_up_axis_array.append(joint_pos_array[i] + (up * up_size) )
-
-                self.pass_aim_axis_array.append(joint_pos_array[i] + (joint_dir_array[i] * aim_size * 0.5 ) )
-                self.pass_aim_axis_array.append(TKCM_Util.lerp_MVector(self.pass_aim_axis_array[-1], joint_pos_array[i] + (up * up_size * 0.5), 0.85 ))
+        self.pass_axis_type = self.options["axis_type"]
+        self.poi_pos_source = None
+        self.axis_lines_source = None
+        self.data_version = 0 # 描画するデータを更新した回数
+        self.manip_data_version = -1 # マニピュレータに渡したデータのdata_version
+        self.manip_update_pending = False
+        self.update_draw_data()
         ##############################################################################################################################################
 
+    # オプションを変更して、影響を受ける計算だけをやり直して描画を更新する（コンテキストの作り直しや再選択は行わない）
+    def set_options(self, options:dict):
+        self.options.update(options)
+        self.update_source()
+        self.update_draw_data()
+
+    # 並び順のオプションが変わった場合だけ、登録したコンポーネントを並べ直してパイプラインに渡す
+    def update_source(self):
+        source_order = (self.options["adjacency_order"], self.options["reverse_order"], self.options["tube_rings"])
+        if self.raw_source is None or source_order == self.source_order:
+            return
+        self.source_order = source_order
+        comp_type, comp_ids, target_mesh = self.raw_source
+        if self.options["tube_rings"]:
+            self.pipeline.set_source(comp_type, comp_ids, target_mesh, self.options["reverse_order"])
+            return
+        if self.options["adjacency_order"]:
+            status, comp_ids = OrderComponentIds(comp_type, comp_ids, target_mesh, -1, self.options["reverse_order"])
+            if status not in (TKCM_ChainMath.kPathOpen, TKCM_ChainMath.kPathClosed):
+                om2.MGlobal.displayError("{}: {}".format(kPathMessages[status], MeshPathKey(target_mesh)))
+                self.pipeline.source = None
+                return
+        self.pipeline.set_source(comp_type, comp_ids, target_mesh)
+
+    # メッシュのスナップショットをメインスレッドで取得し、残りの計算を行う（async_computeがONの場合はワーカースレッドで計算する）
+    def update_draw_data(self):
+        self.pass_axis_type = self.options["axis_type"]
+        snapshot = self.pipeline.snapshot()
+        job_id = self.pipeline.new_job() # 計算中の古いジョブはこの時点で破棄対象になる
+        if snapshot is None:
+            self.publish(job_id, [np.zeros((0, 3)), np.zeros((0, 3)), np.zeros((0, 3)), None])
+            return
+        options = dict(self.options)
+        if options["async_compute"]:
+            GetPreviewExecutor().submit(self.run_preview_job, job_id, snapshot, options)
+        else:
+            self.publish(job_id, self.pipeline.compute(snapshot, options, job_id))
+
+    # ワーカースレッドで実行する処理（Maya APIは使わずに、結果はメインスレッドに渡して反映する）
+    def run_preview_job(self, job_id:int, snapshot:list, options:dict):
+        if self.pipeline.is_stale(job_id):
+            return
+        try:
+            buffers = self.pipeline.compute(snapshot, options, job_id)
+        except Exception as e:
+            maya.utils.executeDeferred(om2.MGlobal.displayError, "preview: {}".format(e))
+            return
+        if buffers is not None:
+            maya.utils.executeDeferred(self.publish, job_id, buffers)
+
+    # 計算結果をMPointArrayに変換してマニピュレータに渡す（メインスレッド専用）
+    # 後から来たジョブより遅れて終わった古いジョブの結果は、描画にもコマンドが再利用するJointChainPlanにも使わない
+    def publish(self, job_id:int, buffers:list):
+        if buffers is None or self.pipeline.is_stale(job_id):
+            return
+        poi_pos, aim_lines, up_lines, plan = buffers
+        SetPreviewPlan(plan)
+        if poi_pos is not self.poi_pos_source: # コンポーネントの位置はサンプリングし直した時だけ変換する
+            self.pass_poi_pos_array = TKCM_Util.toMPointArray(poi_pos)
+            self.poi_pos_source = poi_pos
+        if aim_lines is not self.axis_lines_source: # 軸のラインは描画用の段階が再計算された時だけ変換する
+            self.pass_aim_axis_array = TKCM_Util.toMPointArray(aim_lines)
+            self.pass_up_axis_array = TKCM_Util.toMPointArray(up_lines)
+            self.axis_lines_source = aim_lines
+        self.data_version += 1
+        if self.manipulator_class_ptr is not None:
+            self.pass_draw_data(self.manipulator_class_ptr)
+            omUI.M3dView.active3dView().refresh(True, False)
+
+    # 予め取得しておいたデバッグドローイング用の座標データをマニピュレータに渡す
+    def pass_draw_data(self, manipulator):
+        manipulator.draw_data = (self.pass_poi_pos_array, self.pass_aim_axis_array, self.pass_up_axis_array, self.pass_axis_type)
+        self.manip_data_version = self.data_version
+
     def toolOnSetup(self, event):
         self.setHelpString('dummy manipulator')
         CJOMC_DummyManipContext.update_manipulators(self)
-        self.call_back_id = om2.MModelMessage.addCallback( om2.MModelMessage.kActiveListModified, CJOMC_DummyManipContext.update_manipulators, self)
+        self.call_back_id = om2.MModelMessage.addCallback( om2.MModelMessage.kActiveListModified, CJOMC_DummyManipContext.on_active_list_modified, self)
 
     def toolOffCleanup(self):
         om2.MModelMessage.removeCallback(self.call_back_id)
         self.call_back_id = -1
+        self.pipeline.new_job() # 計算中のジョブを破棄する
+        SetPreviewPlan(None) # ツールを抜けた後にメッシュが編集される可能性があるので、プレビューの結果は再利用させない
+        self.manipulator_class_ptr = None
 
         omUI.MPxSelectionContext.toolOffCleanup(self)
 
+    # 選択が変更された時のコールバック（描画するデータは選択に依存しないので、連続した選択変更はアイドル時の1回の確認にまとめる）
+    @staticmethod
+    def on_active_list_modified(ctx):
+        if ctx.manip_update_pending:
+            return
+        ctx.manip_update_pending = True
+        maya.utils.executeDeferred(ctx.refresh_manipulator)
+
+    # マニピュレータは作り直さずに使い続け、描画するデータが変わっていた場合だけ渡し直す
+    def refresh_manipulator(self):
+        self.manip_update_pending = False
+        if self.call_back_id == -1: # ツールが終了している
+            return
+        if self.manipulator_class_ptr is None:
+            CJOMC_DummyManipContext.update_manipulators(self)
+        elif self.manip_data_version != self.data_version:
+            self.pass_draw_data(self.manipulator_class_ptr)
+
     @staticmethod
     def update_manipulators(ctx):
         ctx.deleteManipulators()
@@ -409,16 +1367,33 @@ class CJOMC_DummyManipContext(omUI.MPxSelectionContext):
 
             # Save state
             ctx.manipulator_class_ptr = manipulator
-            # 予め取得しておいたデバッグドローイング用の座標データをマニピュレータに渡す
-            ctx.manipulator_class_ptr.poi_pos_array = ctx.pass_poi_pos_array
-            ctx.manipulator_class_ptr.aim_axis_array = ctx.pass_aim_axis_array
-            ctx.manipulator_class_ptr.up_axis_array = ctx.pass_up_axis_array
-            ctx.manipulator_class_ptr.axis_type = ctx.pass_axis_type
+            ctx.pass_draw_data(manipulator)
 
 # コンテキスト登録コマンド
 class CJOMC_DummyManipContextCmd (omUI.MPxContextCommand):
     kPluginCmdName = "CreateJointsOnMeshComponentsDraw"
 
+    # [オプションのキー, フラグのロングネーム, 型, 既定値]
+    kFlagSpecs = (
+        ("draw_joint", "joint_draw", om2.MSyntax.kBoolean, True),
+        ("create_type", "create_type", om2.MSyntax.kLong, 0),
+        ("create_count", "create_count", om2.MSyntax.kLong, 1),
+        ("root", "create_root", om2.MSyntax.kBoolean, True),
+        ("tip", "create_tip", om2.MSyntax.kBoolean, True),
+        ("axis_type", "axis_type", om2.MSyntax.kLong, 3),
+        ("aim_neg", "aim_neg", om2.MSyntax.kBoolean, True),
+        ("up_neg", "up_neg", om2.MSyntax.kBoolean, True),
+        ("async_compute", "async_compute", om2.MSyntax.kBoolean, False),
+        ("adjacency_order", "adjacency_order", om2.MSyntax.kBoolean, False),
+        ("reverse_order", "reverse_order", om2.MSyntax.kBoolean, False),
+        ("tube_rings", "tube_rings", om2.MSyntax.kBoolean, False),
+        ("curvature_weight", "curvature_weight", om2.MSyntax.kDouble, 0.5),
+        ("tolerance", "tolerance", om2.MSyntax.kDouble, 0.1),
+        ("spacing", "spacing", om2.MSyntax.kDouble, 1.0),
+        ("frame_type", "frame_type", om2.MSyntax.kLong, 0),
+        ("normal_blend", "normal_blend", om2.MSyntax.kDouble, 0.0),
+    )
+
     def __init__(self):
         omUI.MPxContextCommand.__init__(self)
         self.context_ptr = None
@@ -435,30 +1410,48 @@ class CJOMC_DummyManipContextCmd (omUI.MPxContextCommand):
         theSyntax.addFlag("ct", "create_type", om2.MSyntax.kLong)
         theSyntax.addFlag("cc", "create_count", om2.MSyntax.kLong)
         theSyntax.addFlag("cr", "create_root", om2.MSyntax.kBoolean)
-        theSyntax.addFlag("ct", "create_tip", om2.MSyntax.kBoolean)
+        theSyntax.addFlag("tp", "create_tip", om2.MSyntax.kBoolean)
         theSyntax.addFlag("at", "axis_type", om2.MSyntax.kLong)
         theSyntax.addFlag("an", "aim_neg", om2.MSyntax.kBoolean)
         theSyntax.addFlag("un", "up_neg", om2.MSyntax.kBoolean)
+        theSyntax.addFlag("ac", "async_compute", om2.MSyntax.kBoolean)
+        theSyntax.addFlag("ao", "adjacency_order", om2.MSyntax.kBoolean)
+        theSyntax.addFlag("ro", "reverse_order", om2.MSyntax.kBoolean)
+        theSyntax.addFlag("tr", "tube_rings", om2.MSyntax.kBoolean)
+        theSyntax.addFlag("cw", "curvature_weight", om2.MSyntax.kDouble)
+        theSyntax.addFlag("tl", "tolerance", om2.MSyntax.kDouble)
+        theSyntax.addFlag("sp", "spacing", om2.MSyntax.kDouble)
+        theSyntax.addFlag("ft", "frame_type", om2.MSyntax.kLong)
+        theSyntax.addFlag("nb", "normal_blend", om2.MSyntax.kDouble)
     
     def makeObj(self):
-        theParser = self.parser()
-        joint_draw_ = theParser.flagArgumentBool("joint_draw", 0) if theParser.isFlagSet("joint_draw") else True
-        create_type_ = theParser.flagArgumentInt("create_type", 0) if theParser.isFlagSet("create_type") else 0
-        create_count_ = theParser.flagArgumentInt("create_count", 0) if theParser.isFlagSet("create_count") else 1
-        root_ = theParser.flagArgumentBool("create_root", 0) if theParser.isFlagSet("create_root") else True
-        tip_ = theParser.flagArgumentBool("create_tip", 0) if theParser.isFlagSet("create_tip") else True
-        axis_type_ = theParser.flagArgumentInt("axis_type", 0) if theParser.isFlagSet("axis_type") else 3
-        aim_neg_ = theParser.flagArgumentBool("aim_neg", 0) if theParser.isFlagSet("aim_neg") else True
-        up_neg_ = theParser.flagArgumentBool("up_neg", 0) if theParser.isFlagSet("up_neg") else True
-        self.context_ptr = CJOMC_DummyManipContext(joint_draw_, create_type_, create_count_, root_, tip_, axis_type_, aim_neg_, up_neg_) 
+        self.context_ptr = CJOMC_DummyManipContext(self.parse_flags(True))
         return self.context_ptr
 
     def doEditFlags(self):
         """
-        makeObj()の後に実行する処理
+        makeObj()の後に実行する処理（-editで指定されたオプションだけをコンテキストに渡す）
         """
+        if self.context_ptr is not None:
+            self.context_ptr.set_options(self.parse_flags(False))
         return
 
+    # フラグの値を辞書で返す（use_default=Trueの場合は指定されていないフラグに既定値を入れる）
+    def parse_flags(self, use_default:bool) -> dict:
+        theParser = self.parser()
+        result = {}
+        for key, flag, arg_type, default in self.kFlagSpecs:
+            if theParser.isFlagSet(flag):
+                if arg_type == om2.MSyntax.kBoolean:
+                    result[key] = theParser.flagArgumentBool(flag, 0)
+                elif arg_type == om2.MSyntax.kDouble:
+                    result[key] = theParser.flagArgumentDouble(flag, 0)
+                else:
+                    result[key] = theParser.flagArgumentInt(flag, 0)
+            elif use_default:
+                result[key] = default
+        return result
+
 ##########################################################################################################################################################################################################################################################
 ##########################################################################################################################################################################################################################################################
 ##########################################################################################################################################################################################################################################################
@@ -467,11 +1460,21 @@ class CJOMC_DummyManipContextCmd (omUI.MPxContextCommand):
 def initializePlugin(mobject):
     pluginFn = om2.MFnPlugin(mobject);
     pluginFn.registerCommand(cmd_create_joints_on_mesh_components.kPluginCmdName, cmd_create_joints_on_mesh_components.cmdCreator, cmd_create_joints_on_mesh_components.syntaxCreator);
+    pluginFn.registerCommand(cmd_create_joints_on_mesh_components_purge_cache.kPluginCmdName, cmd_create_joints_on_mesh_components_purge_cache.cmdCreator, cmd_create_joints_on_mesh_components_purge_cache.syntaxCreator);
     pluginFn.registerContextCommand( CJOMC_DummyManipContextCmd.kPluginCmdName, CJOMC_DummyManipContextCmd.creator)
     pluginFn.registerNode( CJOMC_DummyManip.kNodeName, CJOMC_DummyManip.kTypeId, CJOMC_DummyManip.creator, CJOMC_DummyManip.initialize, om2.MPxNode.kManipulatorNode)
+    pluginFn.registerNode( CJOMC_JointChainNode.kNodeName, CJOMC_JointChainNode.kTypeId, CJOMC_JointChainNode.creator, CJOMC_JointChainNode.initialize, om2.MPxNode.kDependNode)
 
 def uninitializePlugin(mobject):
     pluginFn = om2.MFnPlugin(mobject);
     pluginFn.deregisterCommand(cmd_create_joints_on_mesh_components.kPluginCmdName);
+    pluginFn.deregisterCommand(cmd_create_joints_on_mesh_components_purge_cache.kPluginCmdName);
     pluginFn.deregisterContextCommand(CJOMC_DummyManipContextCmd.kPluginCmdName)
-    pluginFn.deregisterNode(CJOMC_DummyManip.kTypeId)
\ No newline at end of file
+    pluginFn.deregisterNode(CJOMC_DummyManip.kTypeId)
+    pluginFn.deregisterNode(CJOMC_JointChainNode.kTypeId)
+    TKCM_MeshCache.getMeshCache().clear() # メッシュに登録したコールバックを削除する
+
+    global _preview_executor
+    if _preview_executor is not None:
+        _preview_executor.shutdown(wait=False)
+        _preview_executor = None
\ No newline at end of file
@@ -0,0 +1,268 @@
+###################################################################################################################################
+###################################################################################################################################
+# モジュール
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import traceback
+import subprocess
+import concurrent.futures
+import numpy as np
+
+# スクリプトとして実行された場合でも自前のモジュールを読み込めるようにする
+kScriptsDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if kScriptsDir not in sys.path:
+    sys.path.insert(0, kScriptsDir)
+
+# 自前のモジュール
+import util.chain_math as TKCM_ChainMath
+###################################################################################################################################
+###################################################################################################################################
+## createJointsOnMeshComponentsをGUI無しで実行するバッチ処理
+## 使い方: mayapy scripts/tools/create_joints_on_mesh_components_batch.py jobs.json --workers 4 --report report.json
+## - ジョブごとに別のプロセス(mayapy)で実行するので、1つのジョブが失敗・クラッシュ・タイムアウトしても他のジョブは続ける
+## - シーンのジョブはファイルサイズが大きい順に割り当てる（重いジョブが最後に残って待つ時間を減らす）
+## - "arrays"を指定したジョブはシーンを使わずに、位置・法線の配列からジョイントの位置と向きだけを算出する（Mayaは不要）
+## - --stand-in を指定すると maya.cmds などの代わり(tools.maya_stand_in)を使って、Mayaが無い環境でもジョブの流れを確認できる
+##
+## ジョブの書式(JSON):
+## {
+##     "plugin": "プラグインのパス（省略した場合はこのリポジトリのplug-ins）",
+##     "defaults": {全ジョブのコマンドのフラグの既定値},
+##     "jobs": [
+##         {"name": "hero", "scene": "hero.ma", "output": "hero_joints.ma",
+##          "runs": [{"chain": ["pSphere1.e[180] pSphere1.e[181] pSphere1.e[182]"], "createType": 1, "createCount": 10},
+##                   {"mesh": "cards", "hairCards": true, "createCount": 8}]},
+##         {"name": "plan", "arrays": "chains.npz", "output": "plan.npz", "options": {"createType": 4, "spacing": 0.5}}
+##     ]
+## }
+## "runs"の各要素はコマンドのフラグ（ロングネーム）で、defaults → ジョブの"options" → 各要素の順に上書きする
+## "arrays"はpoints(N,3)・normals(N,3)・offsets(チェイン数+1)を持つ.npzのパス、もしくは同じキーを持つ辞書
+
+kDefaultPlugin = os.path.join(os.path.dirname(kScriptsDir), "plug-ins", "create_joints_on_mesh_components.py")
+
+# 配列のジョブで使うフラグと既定値（createJointsOnMeshComponentsの既定値と同じ）
+kPlanDefaults = dict(createType=0, createCount=0, axisType=3, aimAxisNeg=False, upAxisNeg=False, createRootjoint=True, createTipJoint=True,
+                     curvatureWeight=0.5, tolerance=0.1, spacing=1.0, frameType=0, normalBlend=0.0)
+
+###################################################################################################################################
+## 配列のジョブ（シーンを使わずにジョイントの位置と向きを算出する）
+
+def compute_plan(points: np.ndarray, normals: np.ndarray, offsets: np.ndarray, options: dict) -> TKCM_ChainMath.JointChainPlan:
+    option = dict(kPlanDefaults)
+    option.update({key: value for key, value in options.items() if key in kPlanDefaults})
+    if option["createType"] == 4 and option["spacing"] <= 0.0:
+        raise ValueError("spacing must be greater than 0")
+    if option["createCount"] < 0:
+        raise ValueError("createCount must be 0 or greater")
+    points, normals, offsets = np.asarray(points, dtype=np.float64), np.asarray(normals, dtype=np.float64), np.asarray(offsets, dtype=np.int64)
+    validate_chains(points, normals, offsets)
+    pos, nml, offsets, error = TKCM_ChainMath.resampleChains(points, normals, offsets,
+                                                             option["createType"], option["createCount"], option["curvatureWeight"], option["tolerance"], option["spacing"])
+    plan_key = tuple(sorted(option.items()))
+    return TKCM_ChainMath.JointChainPlan(plan_key, pos, nml, offsets, option["axisType"], option["aimAxisNeg"], option["upAxisNeg"],
+                                         option["createRootjoint"], option["createTipJoint"], option["frameType"], option["normalBlend"], error)
+
+def validate_chains(points: np.ndarray, normals: np.ndarray, offsets: np.ndarray):
+    # 配列の形とoffsetsが正しく、全てのチェインが2点以上あることを確認する（1点のチェインは前のチェインの端点に重なった結果になるのでエラーにする）
+    if points.ndim != 2 or points.shape[1] != 3 or normals.shape != points.shape:
+        raise ValueError("points and normals must be (N,3) arrays of the same shape")
+    if offsets.ndim != 1 or len(offsets) < 2 or offsets[0] != 0 or offsets[-1] != len(points) or ( np.diff(offsets) < 0 ).any():
+        raise ValueError("offsets must start at 0, end at {} and not decrease".format(len(points)))
+    short = np.flatnonzero(np.diff(offsets) < 2)
+    if len(short) > 0:
+        raise ValueError("chains need at least 2 points: chain {}".format(", ".join(str(i) for i in short[:10])))
+
+def load_arrays(arrays) -> [np.ndarray, np.ndarray, np.ndarray]:
+    if isinstance(arrays, str):
+        with np.load(arrays, allow_pickle=False) as data:
+            return [data["points"], data["normals"], data["offsets"]]
+    return [np.asarray(arrays["points"], dtype=np.float64), np.asarray(arrays["normals"], dtype=np.float64), np.asarray(arrays["offsets"], dtype=np.int64)]
+
+def run_array_job(job: dict, defaults: dict) -> dict:
+    options = dict(defaults)
+    options.update(job.get("options", {}))
+    points, normals, offsets = load_arrays(job["arrays"])
+    start = time.perf_counter()
+    plan = compute_plan(points, normals, offsets, options)
+    seconds = time.perf_counter() - start
+    if job.get("output"):
+        np.savez(job["output"], joint_pos=plan.joint_pos, frames=plan.frames, local_rad=plan.local_rad, parent_ids=plan.parent_ids, joint_offsets=plan.joint_offsets)
+    return {"joints": plan.jointCount(), "chains": len(plan.joint_offsets) - 1, "placement_error": plan.placement_error, "plan_sec": seconds, "output": job.get("output")}
+
+###################################################################################################################################
+## シーンのジョブ
+
+_maya_initialized = False
+
+def initialize_maya(plugin: str):
+    # mayapyのスタンドアロンを初期化してプラグインを読み込む（プロセスごとに1回）
+    global _maya_initialized
+    if _maya_initialized:
+        return
+    import maya.standalone
+    maya.standalone.initialize(name="python")
+    import maya.cmds as cmds
+    cmds.loadPlugin(plugin, quiet=True)
+    _maya_initialized = True
+
+def run_scene_job(job: dict, defaults: dict, plugin: str) -> dict:
+    initialize_maya(plugin)
+    import maya.cmds as cmds
+
+    start = time.perf_counter()
+    cmds.file(job["scene"], open=True, force=True, prompt=False)
+    open_sec = time.perf_counter() - start
+
+    runs = []
+    for run in job.get("runs", []):
+        flags = dict(defaults)
+        flags.update(job.get("options", {}))
+        flags.update(run)
+        run_start = time.perf_counter()
+        result = cmds.createJointsOnMeshComponents(**flags)
+        runs.append({"result": result, "sec": time.perf_counter() - run_start})
+
+    save_sec = 0.0
+    if job.get("output"):
+        save_start = time.perf_counter()
+        cmds.file(rename=job["output"])
+        cmds.file(save=True, force=True, type="mayaBinary" if job["output"].lower().endswith(".mb") else "mayaAscii")
+        save_sec = time.perf_counter() - save_start
+    return {"runs": runs, "open_sec": open_sec, "save_sec": save_sec, "output": job.get("output")}
+
+def run_job(job: dict, defaults: dict, plugin: str) -> dict:
+    # 1つのジョブを現在のプロセスで実行する（例外は結果に記録して返す）
+    start = time.perf_counter()
+    try:
+        if "arrays" in job:
+            result = run_array_job(job, defaults)
+        else:
+            result = run_scene_job(job, defaults, plugin)
+        status, error = "ok", None
+    except Exception:
+        result, status, error = None, "failed", traceback.format_exc()
+    return {"name": job_name(job), "status": status, "sec": time.perf_counter() - start, "result": result, "error": error}
+
+def job_name(job: dict) -> str:
+    return job.get("name") or os.path.basename(job.get("scene", "")) or "arrays"
+
+###################################################################################################################################
+## ワーカープロセス
+
+def run_worker(job_path: str, result_path: str, stand_in: bool):
+    # 親プロセスから渡されたジョブを実行して、結果をJSONで書き出す
+    if stand_in:
+        import tools.maya_stand_in as TKCM_MayaStandIn
+        TKCM_MayaStandIn.install(force=True)
+    with open(job_path, "r") as f:
+        payload = json.load(f)
+    result = run_job(payload["job"], payload["defaults"], payload["plugin"])
+    with open(result_path, "w") as f:
+        json.dump(result, f, default=str)
+    if _maya_initialized and stand_in == False:
+        import maya.standalone
+        maya.standalone.uninitialize()
+
+def run_subprocess(job: dict, defaults: dict, plugin: str, python: str, timeout: float, stand_in: bool, temp_dir: str, index: int) -> dict:
+    # ジョブを別のプロセスで実行する（クラッシュやタイムアウトしても呼び出し側には結果として返す）
+    job_path = os.path.join(temp_dir, "job_{}.json".format(index))
+    result_path = os.path.join(temp_dir, "result_{}.json".format(index))
+    with open(job_path, "w") as f:
+        json.dump({"job": job, "defaults": defaults, "plugin": plugin}, f)
+    command = [python, os.path.abspath(__file__), "--worker", job_path, result_path] + (["--stand-in"] if stand_in else [])
+
+    start = time.perf_counter()
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout if timeout > 0.0 else None)
+        log = process.stdout.decode(errors="replace")
+        return_code = process.returncode
+    except subprocess.TimeoutExpired as e:
+        log = ( e.stdout or b"" ).decode(errors="replace")
+        return {"name": job_name(job), "status": "timeout", "sec": time.perf_counter() - start, "result": None, "error": "timed out after {} sec".format(timeout), "log": log[-4000:]}
+    wall_sec = time.perf_counter() - start
+
+    if os.path.isfile(result_path):
+        with open(result_path, "r") as f:
+            result = json.load(f)
+    else: # 結果を書く前にプロセスが終了した（クラッシュなど）
+        result = {"name": job_name(job), "status": "failed", "sec": wall_sec, "result": None, "error": "worker exited with code {}".format(return_code)}
+    result["wall_sec"] = wall_sec
+    result["log"] = log[-4000:]
+    return result
+
+###################################################################################################################################
+## スケジューラー
+
+def schedule_order(jobs: list) -> list:
+    # シーンのファイルサイズが大きいジョブから順に実行する（配列のジョブとサイズが分からないジョブは最後）
+    def size(job: dict) -> int:
+        scene = job.get("scene")
+        return os.path.getsize(scene) if scene and os.path.isfile(scene) else -1
+    return sorted(range(len(jobs)), key=lambda i: size(jobs[i]), reverse=True)
+
+def run_jobs(spec: dict, workers: int = 1, timeout: float = 0.0, python: str = sys.executable, stand_in: bool = False, in_process: bool = False) -> list:
+    # ジョブの書式(spec)の全ジョブを実行して、ジョブの順番どおりの結果のリストを返す
+    # in_process: ワーカープロセスを使わずに現在のプロセスで順に実行する（デバッグ用。失敗は記録されるがクラッシュからは守られない）
+    jobs = spec.get("jobs", [])
+    defaults = spec.get("defaults", {})
+    plugin = spec.get("plugin", kDefaultPlugin)
+    results = [None] * len(jobs)
+    if in_process:
+        if stand_in:
+            import tools.maya_stand_in as TKCM_MayaStandIn
+            TKCM_MayaStandIn.install(force=True)
+        for i in schedule_order(jobs):
+            results[i] = run_job(jobs[i], defaults, plugin)
+            report_job(results[i])
+        return results
+
+    with tempfile.TemporaryDirectory(prefix="cjomc_batch_") as temp_dir:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor: # スレッドはワーカープロセスの終了を待つだけ
+            futures = {executor.submit(run_subprocess, jobs[i], defaults, plugin, python, timeout, stand_in, temp_dir, i): i for i in schedule_order(jobs)}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+                report_job(results[futures[future]])
+    return results
+
+def report_job(result: dict):
+    print("[{status}] {name}  {sec:.3f} sec".format(**result))
+    if result["error"]:
+        print(result["error"].rstrip())
+
+###################################################################################################################################
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="run createJointsOnMeshComponents jobs without the GUI")
+    parser.add_argument("spec", nargs="?", help="job spec (json)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--timeout", type=float, default=0.0, help="seconds per job (0 = no limit)")
+    parser.add_argument("--python", default=sys.executable, help="interpreter for the workers (mayapy)")
+    parser.add_argument("--report", help="write the results to this json file")
+    parser.add_argument("--stand-in", action="store_true", help="use tools.maya_stand_in instead of Maya")
+    parser.add_argument("--in-process", action="store_true", help="run the jobs in this process one by one")
+    parser.add_argument("--worker", nargs=2, metavar=("JOB", "RESULT"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(args.worker[0], args.worker[1], args.stand_in)
+        return 0
+    if args.spec is None:
+        parser.error("the job spec is required")
+
+    with open(args.spec, "r") as f:
+        spec = json.load(f)
+    start = time.perf_counter()
+    results = run_jobs(spec, args.workers, args.timeout, args.python, args.stand_in, args.in_process)
+    failed = [result for result in results if result["status"] != "ok"]
+    print("jobs: {}  failed: {}  total: {:.3f} sec".format(len(results), len(failed), time.perf_counter() - start))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+    return 1 if len(failed) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
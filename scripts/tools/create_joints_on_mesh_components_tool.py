@@ -103,6 +103,13 @@ class SubWindow(QtWidgets.QWidget):
         self.axis_type=3
         self.aim_neg=False
         self.up_neg=False
+        self.preview_while_dragging=False
+        self.background_preview=False
+        self.adjacency_order=False
+        self.reverse_order=False
+        self.tube_rings=False
+        self.frame_type=0
+        self.normal_blend=0.0
 
         self.init_ui()
         self.setWindowFlags(QtCore.Qt.Popup)
@@ -133,28 +140,106 @@ class SubWindow(QtWidgets.QWidget):
         self.joint_up_neg.setChecked(self.up_neg)
         self.joint_up_neg.clicked.connect(self.fn_joint_up_neg)
 
+        # - プルダウンメニュー - 小数入力ウィジェット
+        self.frame_type_menu = QtWidgets.QComboBox()
+        self.frame_type_menu.addItems(["Up = Component Normal", "Up = Rotation Minimizing"])
+        self.frame_type_menu.setCurrentIndex(self.frame_type)
+        self.frame_type_menu.currentIndexChanged.connect(self.fn_frame_type)
+        self.normal_blend_label = QtWidgets.QLabel("normal blend")
+        self.normal_blend_box = QtWidgets.QDoubleSpinBox()
+        self.normal_blend_box.setRange(0.0, 1.0)
+        self.normal_blend_box.setSingleStep(0.05)
+        self.normal_blend_box.setValue(self.normal_blend)
+        self.normal_blend_box.setKeyboardTracking(False)
+        self.normal_blend_box.valueChanged.connect(self.fn_normal_blend)
+        self.normal_blend_label.setEnabled(self.frame_type==1)
+        self.normal_blend_box.setEnabled(self.frame_type==1)
+        normal_blend_layout = QtWidgets.QHBoxLayout()
+        normal_blend_layout.addWidget(self.normal_blend_label)
+        normal_blend_layout.addWidget(self.normal_blend_box)
+
+        # - ボタン
+        self.preview_drag = QtWidgets.QCheckBox("preview while dragging", self)
+        self.preview_drag.setChecked(self.preview_while_dragging)
+        self.preview_drag.clicked.connect(self.fn_preview_drag)
+        self.preview_background = QtWidgets.QCheckBox("compute preview in background", self)
+        self.preview_background.setChecked(self.background_preview)
+        self.preview_background.clicked.connect(self.fn_preview_background)
+
+        # - ボタン - ボタン
+        self.order_adjacency = QtWidgets.QCheckBox("order by adjacency (ignore selection order)", self)
+        self.order_adjacency.setChecked(self.adjacency_order)
+        self.order_adjacency.clicked.connect(self.fn_order_adjacency)
+        self.order_reverse = QtWidgets.QCheckBox("reverse chain direction", self)
+        self.order_reverse.setChecked(self.reverse_order)
+        self.order_reverse.setEnabled(self.adjacency_order)
+        self.order_reverse.clicked.connect(self.fn_order_reverse)
+        self.tube_ring = QtWidgets.QCheckBox("tube ring centroids (select one ring)", self)
+        self.tube_ring.setChecked(self.tube_rings)
+        self.tube_ring.clicked.connect(self.fn_tube_ring)
+
         layout = QtWidgets.QVBoxLayout(self)
         layout.addWidget(label)
         layout.addWidget(self.joint_orient)
         layout.addWidget(self.joint_axis)
         layout.addWidget(self.joint_aim_neg)
         layout.addWidget(self.joint_up_neg)
+        layout.addWidget(self.frame_type_menu)
+        layout.addLayout(normal_blend_layout)
+        layout.addWidget(self.preview_drag)
+        layout.addWidget(self.preview_background)
+        layout.addWidget(self.order_adjacency)
+        layout.addWidget(self.order_reverse)
+        layout.addWidget(self.tube_ring)
     
     def fn_joint_orient(self, index):
         self.joint_orient_0_=index
 
     def fn_joint_axis(self, index):
         self.axis_type=index
-        self.parent_window.debug_draw(True)
+        self.parent_window.request_debug_draw()
 
     def fn_joint_aim_neg(self, index):
         self.aim_neg=index
-        self.parent_window.debug_draw(True)
+        self.parent_window.request_debug_draw()
     
     def fn_joint_up_neg(self, index):
         self.up_neg=index
-        self.parent_window.debug_draw(True)
+        self.parent_window.request_debug_draw()
+
+    def fn_frame_type(self, index):
+        self.frame_type=index
+        self.normal_blend_label.setEnabled(index==1)
+        self.normal_blend_box.setEnabled(index==1)
+        self.parent_window.request_debug_draw()
+
+    def fn_normal_blend(self, value):
+        self.normal_blend=value
+        self.parent_window.request_debug_draw()
+
+    def fn_preview_drag(self, index):
+        self.preview_while_dragging=index
+
+    def fn_preview_background(self, index):
+        self.background_preview=index
+        self.parent_window.request_debug_draw()
         
+    def fn_order_adjacency(self, index):
+        self.adjacency_order=index
+        self.order_reverse.setEnabled(self.adjacency_order or self.tube_rings)
+        self.parent_window.ctx_name = None # コンポーネントの読み取り方が変わるのでコンテキストを作り直す
+        self.parent_window.request_debug_draw()
+
+    def fn_tube_ring(self, index):
+        self.tube_rings=index
+        self.order_reverse.setEnabled(self.adjacency_order or self.tube_rings)
+        self.parent_window.ctx_name = None # コンポーネントの読み取り方が変わるのでコンテキストを作り直す
+        self.parent_window.request_debug_draw()
+
+    def fn_order_reverse(self, index):
+        self.reverse_order=index
+        self.parent_window.request_debug_draw()
+
     def closeEvent(self, event):
         # サブウィンドウが閉じられたときにメインウィンドウを有効化する
         self.parent_window.setEnabled(True)
@@ -172,13 +257,29 @@ class createJointsOnCompTool(TKCM_UI.MayaMainWindowBase):
         self.dir_path = os.path.dirname(__file__)
         self.sub_window = SubWindow(main_window=self)
         self.select_comp_type = TKCM_Util.MeshCompType.kNon
+        self.select_comp_list = None # 登録したコンポーネント（選択順のMSelectionList、隣接関係で並べる場合は順不同）
+        self.select_mesh_handle = None
 
         self.root_=True
         self.tip_=True
         self.count_=1
         self.type_=0
+        self.curvature_weight_=0.5
+        self.tolerance_=0.1
+        self.spacing_=1.0
+        self.ctx_name = None # プレビュー用に登録したコンテキストの名前
+
+        # オプションの連続した変更をまとめて1回のプレビュー更新にするためのタイマー
+        # 最後の変更から preview_idle_msec 待って更新する（"preview while dragging"がONの場合は変更が続いていても preview_max_wait_msec ごとに更新する）
+        self.preview_idle_msec = 80
+        self.preview_max_wait_msec = 250
+        self.preview_timer = QtCore.QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.timeout.connect(self.flush_debug_draw)
+        self.preview_burst_timer = QtCore.QElapsedTimer()
     
     def closeEvent(self, event):
+        self.preview_timer.stop()
         self.delete_this_context()
         event.accept()
 
@@ -221,7 +322,7 @@ class createJointsOnCompTool(TKCM_UI.MayaMainWindowBase):
         combo_menu_layout = QtWidgets.QHBoxLayout()
         custom_group.layout_.addLayout(combo_menu_layout)
         self.combo_box = QtWidgets.QComboBox()
-        self.combo_box.addItems(["On Component Center", "Evenly Interval"])
+        self.combo_box.addItems(["On Component Center", "Evenly Interval", "Curvature Adaptive", "Simplify (Tolerance)", "Fixed Spacing"])
         self.combo_box.currentIndexChanged.connect(self.toggle_comboBox)  # 選択が変わったときに関数を実行する
         
         combo_menu_layout.addWidget(self.combo_box)
@@ -242,13 +343,53 @@ class createJointsOnCompTool(TKCM_UI.MayaMainWindowBase):
         self.tip_checkbox.stateChanged.connect(self.fn_tip_checkbox)
         self.spin_box_label = QtWidgets.QLabel("division number")
         self.spin_box = QtWidgets.QSpinBox()
-        self.spin_box.setRange(1, 100)
+        self.spin_box.setRange(1, 1000000)
+        self.spin_box.setKeyboardTracking(False) # 数値の入力中は確定するまで更新しない
         self.spin_box.valueChanged.connect(self.fn_spin_box)
 
         checkbox_spinbox_layout.addWidget(self.root_checkbox)
         checkbox_spinbox_layout.addWidget(self.spin_box_label)
         checkbox_spinbox_layout.addWidget(self.spin_box)
         checkbox_spinbox_layout.addWidget(self.tip_checkbox, alignment=QtCore.Qt.AlignRight)
+
+        # - 小数入力ウィジェット
+        curvature_layout = QtWidgets.QHBoxLayout()
+        custom_group.layout_.addLayout(curvature_layout)
+        self.curvature_label = QtWidgets.QLabel("curvature weight")
+        self.curvature_box = QtWidgets.QDoubleSpinBox()
+        self.curvature_box.setRange(0.0, 1.0)
+        self.curvature_box.setSingleStep(0.05)
+        self.curvature_box.setValue(self.curvature_weight_)
+        self.curvature_box.setKeyboardTracking(False)
+        self.curvature_box.valueChanged.connect(self.fn_curvature_box)
+        curvature_layout.addWidget(self.curvature_label)
+        curvature_layout.addWidget(self.curvature_box)
+
+        tolerance_layout = QtWidgets.QHBoxLayout()
+        custom_group.layout_.addLayout(tolerance_layout)
+        self.tolerance_label = QtWidgets.QLabel("tolerance")
+        self.tolerance_box = QtWidgets.QDoubleSpinBox()
+        self.tolerance_box.setRange(0.0, 1000.0)
+        self.tolerance_box.setDecimals(4)
+        self.tolerance_box.setSingleStep(0.01)
+        self.tolerance_box.setValue(self.tolerance_)
+        self.tolerance_box.setKeyboardTracking(False)
+        self.tolerance_box.valueChanged.connect(self.fn_tolerance_box)
+        tolerance_layout.addWidget(self.tolerance_label)
+        tolerance_layout.addWidget(self.tolerance_box)
+
+        spacing_layout = QtWidgets.QHBoxLayout()
+        custom_group.layout_.addLayout(spacing_layout)
+        self.spacing_label = QtWidgets.QLabel("spacing")
+        self.spacing_box = QtWidgets.QDoubleSpinBox()
+        self.spacing_box.setRange(0.0001, 1000000.0)
+        self.spacing_box.setDecimals(4)
+        self.spacing_box.setSingleStep(0.1)
+        self.spacing_box.setValue(self.spacing_)
+        self.spacing_box.setKeyboardTracking(False)
+        self.spacing_box.valueChanged.connect(self.fn_spacing_box)
+        spacing_layout.addWidget(self.spacing_label)
+        spacing_layout.addWidget(self.spacing_box)
         
         ##################################################################################################
         # 次の段 - ボタン
@@ -266,13 +407,19 @@ class createJointsOnCompTool(TKCM_UI.MayaMainWindowBase):
     ###################################################################################################################################
     def toggle_comboBox(self, index):
         self.type_=index
-        if index == 0:  # "On Component Center" の場合
-            self.spin_box_label.setEnabled(False)
-            self.spin_box.setEnabled(False)
-        elif index == 1:  # "Evenly Interval" の場合
-            self.spin_box_label.setEnabled(True)
-            self.spin_box.setEnabled(True)
-        self.debug_draw(True)
+        self.update_type_widgets()
+        self.request_debug_draw()
+
+    # createTypeに応じて使用するウィジェットだけを有効にする
+    def update_type_widgets(self):
+        self.spin_box_label.setEnabled(self.type_ in (1, 2)) # "Evenly Interval", "Curvature Adaptive" の場合
+        self.spin_box.setEnabled(self.type_ in (1, 2))
+        self.curvature_label.setEnabled(self.type_ == 2) # "Curvature Adaptive" の場合
+        self.curvature_box.setEnabled(self.type_ == 2)
+        self.tolerance_label.setEnabled(self.type_ == 3) # "Simplify (Tolerance)" の場合
+        self.tolerance_box.setEnabled(self.type_ == 3)
+        self.spacing_label.setEnabled(self.type_ == 4) # "Fixed Spacing" の場合
+        self.spacing_box.setEnabled(self.type_ == 4)
     
     def show_sub_window(self):
         # メインウィンドウを無効化してサブウィンドウを表示する
@@ -285,19 +432,32 @@ class createJointsOnCompTool(TKCM_UI.MayaMainWindowBase):
 
     def fn_root_checkbox(self, index):
         self.root_=index
-        self.debug_draw(True)
+        self.request_debug_draw()
 
     def fn_tip_checkbox(self, index):
         self.tip_=index
-        self.debug_draw(True)
+        self.request_debug_draw()
     
     def fn_spin_box(self, index):
         self.count_=index
-        self.debug_draw(True)
+        self.request_debug_draw()
+
+    def fn_curvature_box(self, value):
+        self.curvature_weight_=value
+        self.request_debug_draw()
+
+    def fn_tolerance_box(self, value):
+        self.tolerance_=value
+        self.request_debug_draw()
+
+    def fn_spacing_box(self, value):
+        self.spacing_=value
+        self.request_debug_draw()
 
     def set_neutral(self):
         self.select_comp_type = TKCM_Util.MeshCompType.kNon
         self.select_comp_list = None
+        self.select_mesh_handle = None
         self.reselect_button.setEnabled(False)
         self.combo_box.setCurrentIndex(self.type_)  # 初期状態を設定
         self.combo_box.setEnabled(False)
@@ -309,7 +469,14 @@ class createJointsOnCompTool(TKCM_UI.MayaMainWindowBase):
         self.spin_box_label.setEnabled(False)
         self.spin_box.setEnabled(False)
         self.spin_box.setValue(self.count_)
+        self.curvature_label.setEnabled(False)
+        self.curvature_box.setEnabled(False)
+        self.tolerance_label.setEnabled(False)
+        self.tolerance_box.setEnabled(False)
+        self.spacing_label.setEnabled(False)
+        self.spacing_box.setEnabled(False)
         self.lounch_button.setEnabled(False)
+        self.preview_timer.stop()
         self.delete_this_context()
 
     ###################################################################################################################################
@@ -321,11 +488,16 @@ class createJointsOnCompTool(TKCM_UI.MayaMainWindowBase):
         elif len(selectMesh) != 1:
             cmds.confirmDialog(title="error", message="Multiple meshes are not supported.")
             return
-        self.select_comp_list = cmds.ls(orderedSelection=True, long=True)
-        if len(self.select_comp_list) < 2:
+        # 選択順のリストをそのまま保持しておき、再選択の際は1回の呼び出しで復元する（隣接関係で並べる場合は選択順は不要）
+        ordered = self.sub_window.adjacency_order == False and self.sub_window.tube_rings == False
+        sel_list = om2.MGlobal.getActiveSelectionList()
+        if len(TKCM_Util.getSelectedComponentIds(sel_list, 0, ordered)) < 2:
             cmds.confirmDialog(title="error", message="Requires selection of two or more components.")
             return
-        self.select_comp_type = TKCM_Util.selectedComponentType(om2.MGlobal.getActiveSelectionList(), 0)
+        self.select_comp_list = om2.MSelectionList(om2.MGlobal.getActiveSelectionList(True) if ordered else sel_list)
+        self.select_mesh_handle = om2.MObjectHandle(sel_list.getDependNode(0))
+        self.select_comp_type = TKCM_Util.selectedComponentType(sel_list, 0)
+        self.ctx_name = None # 登録したコンポーネントが変わったのでコンテキストを作り直す
 
         self.reselect_button.setEnabled(True)
         self.combo_box.setEnabled(True)
@@ -333,16 +505,15 @@ class createJointsOnCompTool(TKCM_UI.MayaMainWindowBase):
         self.tip_checkbox.setEnabled(True)
         self.lounch_button.setEnabled(True)
         self.joint_option_button.setEnabled(True)
-        self.spin_box_label.setEnabled(self.type_==1)
-        self.spin_box.setEnabled(self.type_==1)
+        self.update_type_widgets()
 
-        self.debug_draw(True)
+        self.flush_debug_draw()
 
     def reselect_mesh_components(self):
         try:
-            cmds.select(cl=True)
-            for comp_path in self.select_comp_list:
-                cmds.select(comp_path, tgl=True)
+            if self.select_mesh_handle is None or self.select_mesh_handle.isValid() == False:
+                raise RuntimeError("registered mesh not found")
+            om2.MGlobal.setActiveSelectionList(self.select_comp_list, om2.MGlobal.kReplaceList)
             
         except :
             cmds.confirmDialog(title="error", message="Components registered with the tool not found in this scene.")
@@ -357,14 +528,23 @@ class createJointsOnCompTool(TKCM_UI.MayaMainWindowBase):
                 createTipJoint=self.tip_,\
                 createType=self.type_,\
                 createCount=self.count_,\
+                curvatureWeight=self.curvature_weight_,\
+                tolerance=self.tolerance_,\
+                spacing=self.spacing_,\
                 axisType = self.sub_window.axis_type,\
                 aimAxisNeg = self.sub_window.aim_neg,\
-                upAxisNeg = self.sub_window.up_neg)
+                upAxisNeg = self.sub_window.up_neg,\
+                orderByAdjacency = self.sub_window.adjacency_order,\
+                reverseOrder = self.sub_window.reverse_order,\
+                tubeRings = self.sub_window.tube_rings,\
+                frameType = self.sub_window.frame_type,\
+                normalBlend = self.sub_window.normal_blend)
         except :
             cmds.confirmDialog(title="error", message="Components registered with the tool not found in this scene.")
             self.set_neutral()
     
     def delete_this_context(self):
+        self.ctx_name = None
         # 同種のコンテキストが既に登録済みの場合は削除する
         for ctx in cmds.lsUI(contexts=True):
             if ctx.startswith('CreateJointsOnMeshComponentsDraw'):
@@ -379,23 +559,53 @@ class createJointsOnCompTool(TKCM_UI.MayaMainWindowBase):
         elif self.select_comp_type == TKCM_Util.MeshCompType.kFace:
             cmds.SelectFacetMask();
     
+    def request_debug_draw(self):
+        # プレビューの更新を予約する（更新時には最新のオプションを使うので、予約中に値が変わっても最後の状態が表示される）
+        if self.preview_timer.isActive() == False:
+            self.preview_burst_timer.start()
+        elif self.sub_window.preview_while_dragging and self.preview_burst_timer.elapsed() >= self.preview_max_wait_msec:
+            self.flush_debug_draw()
+            self.preview_burst_timer.start()
+        self.preview_timer.start(self.preview_idle_msec)
+
+    def flush_debug_draw(self):
+        self.preview_timer.stop()
+        self.debug_draw(True)
+
     def debug_draw(self, joint_draw_:bool):
         if self.select_comp_type == TKCM_Util.MeshCompType.kNon:
             return
         
-        self.delete_this_context()
-        self.reselect_mesh_components()
-        # コンテキストを登録する
-        ctx = cmds.CreateJointsOnMeshComponentsDraw(\
+        options = dict(
             joint_draw=joint_draw_, \
             create_type=self.type_, \
             create_count=self.count_, \
+            curvature_weight=self.curvature_weight_, \
+            tolerance=self.tolerance_, \
+            spacing=self.spacing_, \
             create_root=self.root_, \
             create_tip=self.tip_,
             axis_type=self.sub_window.axis_type,\
             aim_neg=self.sub_window.aim_neg,\
-            up_neg=self.sub_window.up_neg)
+            up_neg=self.sub_window.up_neg,\
+            async_compute=self.sub_window.background_preview,\
+            adjacency_order=self.sub_window.adjacency_order,\
+            reverse_order=self.sub_window.reverse_order,\
+            tube_rings=self.sub_window.tube_rings,\
+            frame_type=self.sub_window.frame_type,\
+            normal_blend=self.sub_window.normal_blend)
+
+        # プレビュー中のコンテキストがあればオプションだけを更新する（メッシュの読み込みや再選択は行わずに、変更の影響を受ける計算だけをやり直す）
+        if self.ctx_name is not None and cmds.contextInfo(self.ctx_name, exists=True) and cmds.currentCtx() == self.ctx_name:
+            cmds.CreateJointsOnMeshComponentsDraw(self.ctx_name, edit=True, **options)
+            return
+
+        self.delete_this_context()
+        self.reselect_mesh_components()
+        # コンテキストを登録する
+        ctx = cmds.CreateJointsOnMeshComponentsDraw(**options)
         cmds.setToolTo(ctx)
+        self.ctx_name = ctx
         
 
 ###################################################################################################################################
@@ -0,0 +1,78 @@
+###################################################################################################################################
+###################################################################################################################################
+# モジュール
+import os
+import sys
+import types
+
+###################################################################################################################################
+###################################################################################################################################
+## Mayaが無い環境でバッチ処理を試すためのmaya.cmds/OpenMayaの代わり
+## install()でsys.modulesに登録すると、以降の import maya.cmds などはこのモジュールの代わりのオブジェクトになる
+## - cmdsの関数は呼び出しをcallsに記録するだけ（ファイルを開く場合だけ、存在しないファイルはMayaと同じようにRuntimeErrorにする）
+## - createJointsOnMeshComponentsはqueryPlanの場合は空のリスト、それ以外はルートジョイント名のリストを返す
+
+calls = [] # [(関数名, 引数, キーワード引数), ...]
+
+class StandInCmds(types.ModuleType):
+    def __getattr__(self, name: str):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        def command(*args, **kwargs):
+            calls.append((name, args, kwargs))
+            return None
+        return command
+
+    def file(self, *args, **kwargs):
+        calls.append(("file", args, kwargs))
+        if kwargs.get("open", kwargs.get("o", False)) and ( len(args) == 0 or os.path.isfile(args[0]) == False ):
+            raise RuntimeError("File not found: {}".format(args[0] if args else ""))
+        return args[0] if args else ""
+
+    def loadPlugin(self, *args, **kwargs):
+        calls.append(("loadPlugin", args, kwargs))
+        return [os.path.splitext(os.path.basename(args[0]))[0]] if args else []
+
+    def createJointsOnMeshComponents(self, *args, **kwargs):
+        calls.append(("createJointsOnMeshComponents", args, kwargs))
+        if kwargs.get("queryPlan", False):
+            return []
+        return ["joint{}".format(i + 1) for i in range(max(len(kwargs.get("chain", [])), 1))]
+
+class StandInMGlobal(object):
+    @staticmethod
+    def displayInfo(message: str):
+        print("# Info: {}".format(message))
+
+    @staticmethod
+    def displayWarning(message: str):
+        print("# Warning: {}".format(message))
+
+    @staticmethod
+    def displayError(message: str):
+        print("# Error: {}".format(message))
+
+def install(force: bool = False) -> bool:
+    # 代わりのモジュールを登録する（本物のMayaがimportできる場合はforce=Trueでなければ何もしない）
+    # 戻り値: 代わりのモジュールを登録したか
+    if force == False:
+        try:
+            import maya.cmds
+            return False
+        except ImportError:
+            pass
+
+    maya = types.ModuleType("maya")
+    standalone = types.ModuleType("maya.standalone")
+    standalone.initialize = lambda *args, **kwargs: calls.append(("standalone.initialize", args, kwargs))
+    standalone.uninitialize = lambda *args, **kwargs: calls.append(("standalone.uninitialize", args, kwargs))
+    utils = types.ModuleType("maya.utils")
+    utils.executeDeferred = lambda func, *args, **kwargs: func(*args, **kwargs)
+    api = types.ModuleType("maya.api")
+    om2 = types.ModuleType("maya.api.OpenMaya")
+    om2.MGlobal = StandInMGlobal
+    cmds = StandInCmds("maya.cmds")
+
+    maya.standalone, maya.utils, maya.api, maya.cmds, api.OpenMaya = standalone, utils, api, cmds, om2
+    sys.modules.update({"maya": maya, "maya.standalone": standalone, "maya.utils": utils, "maya.api": api, "maya.api.OpenMaya": om2, "maya.cmds": cmds})
+    return True
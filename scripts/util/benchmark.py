@@ -0,0 +1,77 @@
+###################################################################################################################################
+###################################################################################################################################
+# モジュール
+import time
+
+# Mayaモジュール
+import maya.cmds as cmds
+import maya.api.OpenMaya as om2
+
+# 自前のモジュール
+import util.util as TKCM_Util
+import importlib
+importlib.reload( TKCM_Util )
+###################################################################################################################################
+###################################################################################################################################
+## 処理時間の比較用の関数
+## Mayaのスクリプトエディタから実行する  例：import util.benchmark as bench; bench.benchmarkOrderedComponentIds()
+
+def measure(func, repeat: int) -> [float, object]:
+    # funcをrepeat回実行して最短の処理時間(sec)と最後の戻り値を返す
+    best = float('inf');
+    result = None;
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter();
+        result = func();
+        best = min(best, time.perf_counter() - start);
+    return [best, result];
+
+def benchmarkOrderedComponentIds(repeat: int = 3) -> dict:
+    # 現在の選択（選択順）を対象にして、文字列を解析する従来の方法と選択リストから直接取得する方法を比較する
+    sel_list = om2.MGlobal.getActiveSelectionList();
+    if sel_list.length() == 0:
+        om2.MGlobal.displayError("select mesh components first");
+        return {};
+
+    string_time, string_ids = measure(lambda: TKCM_Util.getOrderedComponentIdsFromString(sel_list, 0), repeat);
+    direct_time, direct_ids = measure(lambda: TKCM_Util.getSelectedComponentIds(sel_list, 0, True), repeat);
+
+    result = {
+        "count": len(direct_ids),
+        "match": list(string_ids) == list(direct_ids),
+        "string_sec": string_time,
+        "direct_sec": direct_time,
+    };
+    om2.MGlobal.displayInfo("ordered ids: {count}  match: {match}  string: {string_sec:.4f} sec  direct: {direct_sec:.4f} sec".format(**result));
+    return result;
+
+def benchmarkReselect(repeat: int = 3) -> dict:
+    # 現在の選択（選択順）を対象にして、コンポーネントを1つずつトグル選択する従来の方法と選択リストを1回で復元する方法を比較する
+    comp_paths = cmds.ls(orderedSelection=True, long=True);
+    ordered_sel_list = om2.MGlobal.getActiveSelectionList(True);
+    if len(comp_paths) == 0:
+        om2.MGlobal.displayError("select mesh components first");
+        return {};
+
+    def toggle_each():
+        cmds.select(cl=True);
+        for comp_path in comp_paths:
+            cmds.select(comp_path, tgl=True);
+        return cmds.ls(orderedSelection=True, long=True);
+
+    def replace_once():
+        om2.MGlobal.setActiveSelectionList(ordered_sel_list, om2.MGlobal.kReplaceList);
+        return cmds.ls(orderedSelection=True, long=True);
+
+    toggle_time, toggle_result = measure(toggle_each, repeat);
+    replace_time, replace_result = measure(replace_once, repeat);
+
+    result = {
+        "count": len(comp_paths),
+        "match": toggle_result == replace_result,
+        "toggle_sec": toggle_time,
+        "replace_sec": replace_time,
+        "saved_sec": toggle_time - replace_time,
+    };
+    om2.MGlobal.displayInfo("reselect items: {count}  match: {match}  toggle: {toggle_sec:.4f} sec  single call: {replace_sec:.4f} sec  saved: {saved_sec:.4f} sec".format(**result));
+    return result;
@@ -0,0 +1,793 @@
+###################################################################################################################################
+###################################################################################################################################
+# モジュール
+import numpy as np
+###################################################################################################################################
+###################################################################################################################################
+## ジョイントチェインの算出に使用する配列演算（NumPy）
+## Mayaに依存しない関数のみを置く（コンポーネントタイプはutil.MeshCompTypeの値を整数で受け取る）
+
+kCompVertex = 1
+kCompEdge = 2
+kCompFace = 3
+
+def normalizeRows(vectors: np.ndarray) -> np.ndarray:
+    # (N,3)のベクトルを行ごとに正規化する（長さ0の行は0のまま）
+    length = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, length, out=np.zeros_like(vectors), where=length > 0.0)
+
+def faceOffsets(face_counts: np.ndarray) -> np.ndarray:
+    # フェースごとの頂点数からface_verticesへのオフセット(CSR)を作成する（要素数はフェース数+1）
+    offsets = np.zeros(len(face_counts) + 1, dtype=np.int64)
+    np.cumsum(face_counts, out=offsets[1:])
+    return offsets
+
+def expandFaceVertexSlots(face_ids: np.ndarray, face_counts: np.ndarray, face_offsets: np.ndarray) -> [np.ndarray, np.ndarray, np.ndarray]:
+    # 指定したフェースのface_vertices上の位置を一括で展開する
+    # 戻り値: [face_vertices上の位置, 次の頂点の位置（フェース内で一周する）, 各フェースの先頭位置(展開後の配列上)]
+    counts = face_counts[face_ids]
+    starts = np.cumsum(counts) - counts
+    local = np.arange(counts.sum()) - np.repeat(starts, counts)
+    base = np.repeat(face_offsets[face_ids], counts)
+    slots = base + local
+    next_slots = base + (local + 1) % np.repeat(counts, counts)
+    return [slots, next_slots, starts]
+
+# 頂点・エッジモードの法線(normals)は、プラグインのGetComponentPosAndNml()と同じくメッシュの法線の配列を頂点IDで参照する
+def vertexPosAndNml(vtx_ids: np.ndarray, points: np.ndarray, normals: np.ndarray) -> [np.ndarray, np.ndarray]:
+    return [points[vtx_ids], normals[vtx_ids]]
+
+def edgePosAndNml(edge_vtx: np.ndarray, points: np.ndarray, normals: np.ndarray) -> [np.ndarray, np.ndarray]:
+    # edge_vtxは選択順に並んだ(N,2)のエッジ両端の頂点ID
+    pos = ( points[edge_vtx[:, 0]] + points[edge_vtx[:, 1]] ) * 0.5
+    nml = ( normals[edge_vtx[:, 0]] + normals[edge_vtx[:, 1]] ) * 0.5 # エッジの両端の頂点法線の中央位置
+    return [pos, nml]
+
+def facePosAndNml(face_ids: np.ndarray, points: np.ndarray, face_counts: np.ndarray, face_offsets: np.ndarray, face_vertices: np.ndarray) -> [np.ndarray, np.ndarray]:
+    slots, next_slots, starts = expandFaceVertexSlots(face_ids, face_counts, face_offsets)
+    counts = face_counts[face_ids]
+    p = points[face_vertices[slots]]
+    pos = np.add.reduceat(p, starts, axis=0) / counts[:, None]
+    # Newell法で法線を算出する（桁落ちを抑えるためにフェースの中央位置を原点にしてから外積を取る）
+    center = np.repeat(pos, counts, axis=0)
+    cross = np.cross(p - center, points[face_vertices[next_slots]] - center)
+    nml = normalizeRows( np.add.reduceat(cross, starts, axis=0) )
+    return [pos, nml]
+
+###################################################################################################################################
+## 選択順を使わずに隣接関係からチェインの順番を求める
+## 隣接関係はCSR(indptr, indices)で持ち、ノードiの隣接ノードは indices[indptr[i]:indptr[i+1]]
+
+# walkPath()/orderComponents()の結果
+kPathOpen = 0         # 端点が2つある1本の経路
+kPathClosed = 1       # ループ
+kPathBranching = 2    # 3つ以上に分岐している
+kPathDisconnected = 3 # 繋がっていない部分がある
+kPathInvalidStart = 4 # 開始位置がチェインの端点（ループの場合はチェインの要素）ではない
+
+def faceEdgeKeys(face_ids: np.ndarray, face_counts: np.ndarray, face_offsets: np.ndarray, face_vertices: np.ndarray) -> [np.ndarray, np.ndarray]:
+    # 指定したフェースの各辺を(頂点IDの小さい方, 大きい方)のペアで返す
+    # 戻り値: [(S,2)の頂点IDのペア, 各辺が属するフェースのface_ids上のインデックス]
+    slots, next_slots, _ = expandFaceVertexSlots(face_ids, face_counts, face_offsets)
+    pairs = np.sort(np.stack([face_vertices[slots], face_vertices[next_slots]], axis=1), axis=1)
+    owners = np.repeat(np.arange(len(face_ids)), face_counts[face_ids])
+    return [pairs, owners]
+
+def meshEdgesFromFaces(face_counts: np.ndarray, face_offsets: np.ndarray, face_vertices: np.ndarray) -> np.ndarray:
+    # フェースの頂点リストからメッシュの全エッジを(E,2)の頂点IDのペアで返す（エッジIDの順番とは一致しない）
+    pairs, _ = faceEdgeKeys(np.arange(len(face_counts)), face_counts, face_offsets, face_vertices)
+    if len(pairs) == 0:
+        return pairs
+    stride = int(face_vertices.max()) + 1 # ペアを1つの整数にしてから重複を除く（行単位のuniqueより速い）
+    keys = np.unique(pairs[:, 0] * stride + pairs[:, 1])
+    return np.stack([keys // stride, keys % stride], axis=1)
+
+def adjacencyCSR(pairs: np.ndarray, node_count: int) -> [np.ndarray, np.ndarray]:
+    # 無向グラフの辺(ノードのペア)からCSRの隣接リストを作る
+    src = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    dst = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=node_count), out=indptr[1:])
+    return [indptr, dst[np.argsort(src, kind='stable')]]
+
+def sharedKeyPairs(keys: np.ndarray, owners: np.ndarray) -> [np.ndarray, bool]:
+    # 同じキー（頂点IDや辺）を持つ要素同士をペアにする（キーを3つ以上の要素が共有している場合は分岐とみなす）
+    # 戻り値: [(P,2)の要素のペア, 分岐があるか]
+    order = np.argsort(keys, kind='stable')
+    _, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+    if (counts > 2).any():
+        return [np.zeros((0, 2), dtype=np.int64), True]
+    shared = starts[counts == 2]
+    pairs = np.sort(np.stack([owners[order][shared], owners[order][shared + 1]], axis=1), axis=1)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    return [np.unique(pairs, axis=0), False]
+
+def walkPath(indptr: np.ndarray, indices: np.ndarray, start: int = -1, reverse: bool = False) -> [np.ndarray, int]:
+    # 隣接リストを端点から順に辿って、全ノードを1本の経路として並べる（各ノードを1回ずつ訪れるだけなので線形時間）
+    # start: 開始するノード（-1の場合は1つ目の端点、ループの場合は0）, reverse: 並びを逆にする（ループの場合は開始ノードはそのまま）
+    # 戻り値: [ノードの並び, kPath*]
+    node_count = len(indptr) - 1
+    degree = np.diff(indptr)
+    if node_count == 0:
+        return [np.zeros(0, dtype=np.int64), kPathDisconnected]
+    if (degree > 2).any():
+        return [np.zeros(0, dtype=np.int64), kPathBranching]
+    ends = np.flatnonzero(degree < 2)
+    closed = len(ends) == 0
+    if closed == False and len(ends) != 2:
+        return [np.zeros(0, dtype=np.int64), kPathDisconnected]
+    if start < 0:
+        start = 0 if closed else int(ends[0])
+    elif start >= node_count or ( closed == False and start not in ends ):
+        return [np.zeros(0, dtype=np.int64), kPathInvalidStart]
+
+    # 各ノードの隣接ノードを(N,2)に詰めておく（端点の2つ目は-1）
+    neighbors = np.full((node_count, 2), -1, dtype=np.int64)
+    neighbors[np.repeat(np.arange(node_count), degree), np.arange(len(indices)) - np.repeat(indptr[:-1], degree)] = indices
+    neighbors = neighbors.tolist()
+
+    order = [start]
+    prev, cur = -1, start
+    for _ in range(node_count - 1):
+        a, b = neighbors[cur]
+        prev, cur = cur, (a if a != prev else b)
+        if cur < 0 or cur == start:
+            break
+        order.append(cur)
+    if len(order) != node_count:
+        return [np.zeros(0, dtype=np.int64), kPathDisconnected]
+
+    order = np.array(order, dtype=np.int64)
+    if reverse:
+        order = np.concatenate([order[:1], order[:0:-1]]) if closed else order[::-1]
+    return [order, kPathClosed if closed else kPathOpen]
+
+def orderComponents(comp_type: int, comp_ids: np.ndarray, face_counts: np.ndarray, face_offsets: np.ndarray, face_vertices: np.ndarray, edge_vtx: np.ndarray = None, start_id: int = -1, reverse: bool = False, mesh_edges: np.ndarray = None) -> [np.ndarray, int]:
+    # 順不同のコンポーネントIDを隣接関係に沿って並べる
+    # vertex: メッシュのエッジで繋がっている頂点同士, edge: 頂点を共有するエッジ同士(edge_vtxはcomp_idsと同じ順の両端の頂点ID), face: エッジを共有するフェース同士
+    # mesh_edges: meshEdgesFromFaces()の結果（キャッシュ済みの場合に渡すと作り直さない）
+    # 戻り値: [並べたコンポーネントID, kPath*]
+    ids, first = np.unique(np.asarray(comp_ids, dtype=np.int64), return_index=True)
+    if comp_type == kCompVertex:
+        edges = meshEdgesFromFaces(face_counts, face_offsets, face_vertices) if mesh_edges is None else mesh_edges
+        local = np.clip(np.searchsorted(ids, edges), 0, len(ids) - 1)
+        pairs = local[( ids[local] == edges ).all(axis=1)]
+    elif comp_type == kCompEdge:
+        pairs, branching = sharedKeyPairs(edge_vtx[first].ravel(), np.repeat(np.arange(len(ids)), 2))
+        if branching:
+            return [np.zeros(0, dtype=np.int64), kPathBranching]
+    elif comp_type == kCompFace:
+        edge_pairs, owners = faceEdgeKeys(ids, face_counts, face_offsets, face_vertices)
+        pairs, branching = sharedKeyPairs(edge_pairs[:, 0] * ( int(face_vertices.max()) + 1 ) + edge_pairs[:, 1], owners)
+        if branching:
+            return [np.zeros(0, dtype=np.int64), kPathBranching]
+    else:
+        return [np.zeros(0, dtype=np.int64), kPathDisconnected]
+
+    start = -1
+    if start_id >= 0:
+        start = int(np.searchsorted(ids, start_id))
+        if start >= len(ids) or ids[start] != start_id:
+            return [np.zeros(0, dtype=np.int64), kPathInvalidStart]
+    indptr, indices = adjacencyCSR(pairs, len(ids))
+    order, status = walkPath(indptr, indices, start, reverse)
+    return [ids[order], status]
+
+###################################################################################################################################
+## チューブ状のメッシュのリング（輪になった頂点列）を順に辿る
+
+def gatherNeighbors(indptr: np.ndarray, indices: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    # 複数のノードの隣接ノードをまとめて返す（重複を含む）
+    counts = indptr[nodes + 1] - indptr[nodes]
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return indices[np.repeat(indptr[nodes], counts) + local]
+
+def walkRings(indptr: np.ndarray, indices: np.ndarray, ring: np.ndarray, visited: np.ndarray, track: int) -> [list, list]:
+    # 1つ前のリングに隣接していて未訪問の頂点を次のリングとして、頂点数が変わる（端のキャップなど）か無くなるまで辿る
+    # track: 追跡する頂点（リングごとに隣接する1頂点を選んで、アップベクトルの基準を揃える）
+    # 戻り値: [リングの頂点IDのリスト, 追跡した頂点IDのリスト]
+    rings, tracks = [], []
+    while True:
+        candidates = gatherNeighbors(indptr, indices, ring)
+        next_ring = np.unique(candidates[visited[candidates] == False])
+        if len(next_ring) == 0 or len(next_ring) != len(ring):
+            break
+        track_candidates = np.intersect1d(indices[indptr[track]:indptr[track + 1]], next_ring)
+        if len(track_candidates) == 0:
+            break
+        visited[next_ring] = True
+        ring, track = next_ring, int(track_candidates[0])
+        rings.append(ring)
+        tracks.append(track)
+    return [rings, tracks]
+
+def tubeRings(indptr: np.ndarray, indices: np.ndarray, start_ring: np.ndarray, track: int = -1, reverse: bool = False) -> [np.ndarray, np.ndarray, np.ndarray]:
+    # 開始リングから両方向にリングを辿り、チューブの端から端までのリングを並べる
+    # indptr, indices: 頂点の隣接リスト(CSR), start_ring: 開始リングの頂点ID, track: 開始リングで追跡する頂点（-1の場合は最小のID）
+    # 戻り値: [全リングの頂点ID(連結), 各リングの先頭位置(offsets), 各リングの追跡した頂点ID]
+    start_ring = np.unique(start_ring)
+    track = int(start_ring[0]) if track < 0 else track
+    visited = np.zeros(len(indptr) - 1, dtype=bool)
+    visited[start_ring] = True
+
+    # 開始リングの隣の頂点を、頂点同士の繋がりで両側の2つのリングに分ける
+    side = np.unique(gatherNeighbors(indptr, indices, start_ring))
+    side = side[visited[side] == False]
+    side_mask = np.zeros(len(visited), dtype=bool)
+    side_mask[side] = True
+    side_edges = np.stack([np.repeat(side, indptr[side + 1] - indptr[side]), gatherNeighbors(indptr, indices, side)], axis=1)
+    side_edges = side_edges[side_mask[side_edges[:, 1]]]
+    local_edges = np.searchsorted(side, side_edges)
+    side_labels, side_count = connectedComponents(local_edges, len(side))
+    if side_count > 2:
+        side_count = 0 # チューブのリングではない（分岐している）
+
+    halves = []
+    for label in range(side_count):
+        ring = side[side_labels == label]
+        track_candidates = np.intersect1d(indices[indptr[track]:indptr[track + 1]], ring)
+        if len(ring) != len(start_ring) or len(track_candidates) == 0:
+            halves.append([[], []])
+            continue
+        visited[ring] = True
+        rings, tracks = walkRings(indptr, indices, ring, visited, int(track_candidates[0]))
+        halves.append([[ring] + rings, [int(track_candidates[0])] + tracks])
+    while len(halves) < 2:
+        halves.append([[], []])
+    if len(halves[1][0]) == 0: # 開始リングがチューブの端の場合は開始リングをルートにする
+        halves = halves[::-1]
+
+    # 片側を逆順にして 片側 -> 開始リング -> もう片側 の順に並べる
+    rings = halves[0][0][::-1] + [start_ring] + halves[1][0]
+    tracks = halves[0][1][::-1] + [track] + halves[1][1]
+    if reverse:
+        rings, tracks = rings[::-1], tracks[::-1]
+    return [np.concatenate(rings), chainOffsets([len(ring) for ring in rings]), np.array(tracks, dtype=np.int64)]
+
+def ringCentroids(points: np.ndarray, ring_vertices: np.ndarray, ring_offsets: np.ndarray, tracks: np.ndarray) -> [np.ndarray, np.ndarray]:
+    # リングの重心と、重心から追跡した頂点への向き（アップベクトル）を返す
+    labels = np.repeat(np.arange(len(ring_offsets) - 1), np.diff(ring_offsets))
+    centroids = groupMeans(points[ring_vertices], labels, len(ring_offsets) - 1)
+    return [centroids, normalizeRows(points[tracks] - centroids)]
+
+###################################################################################################################################
+## ヘアカード（繋がっていない短冊状のポリゴンの集まり）からチェインを抽出する
+
+def connectedComponents(pairs: np.ndarray, node_count: int) -> [np.ndarray, int]:
+    # 辺で繋がったノードに同じラベルを付ける（最小のラベルを辺に沿って伝播させ、ポインタジャンプで一気に根まで縮める）
+    # 戻り値: [0から始まる連番のラベル(node_count,), ラベルの数]
+    labels = np.arange(node_count)
+    a, b = pairs[:, 0], pairs[:, 1]
+    while True:
+        edge_labels = np.minimum(labels[a], labels[b])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, a, edge_labels)
+        np.minimum.at(new_labels, b, edge_labels)
+        np.minimum.at(new_labels, labels, new_labels) # 古いラベル（根）にも伝える
+        while True:
+            jumped = new_labels[new_labels]
+            if np.array_equal(jumped, new_labels):
+                break
+            new_labels = jumped
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    unique_labels, labels = np.unique(labels, return_inverse=True)
+    return [labels, len(unique_labels)]
+
+def groupMeans(values: np.ndarray, labels: np.ndarray, count: int) -> np.ndarray:
+    # ラベルごとの平均を返す（valuesは(N,)または(N,K)）
+    weights = np.bincount(labels, minlength=count).astype(np.float64)
+    if values.ndim == 1:
+        return np.bincount(labels, values, minlength=count) / np.maximum(weights, 1.0)
+    sums = np.stack([np.bincount(labels, values[:, k], minlength=count) for k in range(values.shape[1])], axis=1)
+    return sums / np.maximum(weights, 1.0)[:, None]
+
+def principalAxes(points: np.ndarray, labels: np.ndarray, count: int) -> [np.ndarray, np.ndarray]:
+    # ラベルごとに点群の主軸（分散が最大の向き）を一括で求める 戻り値: [重心(C,3), 主軸(C,3)]
+    centroids = groupMeans(points, labels, count)
+    d = points - centroids[labels]
+    outer = ( d[:, :, None] * d[:, None, :] ).reshape(-1, 9)
+    covariance = groupMeans(outer, labels, count).reshape(-1, 3, 3)
+    _, vectors = np.linalg.eigh(covariance) # 固有値の昇順なので最後の列が主軸
+    return [centroids, vectors[:, :, 2]]
+
+def cardChains(points: np.ndarray, normals: np.ndarray, edges: np.ndarray, uvs: np.ndarray = None, rung_tolerance: float = 0.5) -> [np.ndarray, np.ndarray, np.ndarray]:
+    # 各カードの幅方向のエッジ（横木）で繋がった頂点を1つの段にまとめ、段の中心を長さ方向に並べたものをカードのチェインとする
+    # uvs: (V,2)の頂点ごとのUV（Noneの場合は主軸を長さ方向にする）
+    #      UVがある場合はVを長さ方向としてVが小さい方をルートにし、無い場合はメッシュ全体の中心に近い方の端をルートにする
+    # rung_tolerance: 長さ方向の成分がエッジの長さのこの割合より小さいエッジを横木とみなす
+    # 戻り値: [段の中心の位置, 段の法線, 各カードの先頭位置(offsets)]
+    card_labels, card_count = connectedComponents(edges, len(points))
+    if uvs is not None:
+        param = uvs[:, 1]
+        delta = uvs[edges[:, 1]] - uvs[edges[:, 0]]
+    else:
+        centroids, axes = principalAxes(points, card_labels, card_count)
+        param = np.einsum('ij,ij->i', points - centroids[card_labels], axes[card_labels])
+        delta = points[edges[:, 1]] - points[edges[:, 0]]
+    along = np.abs(param[edges[:, 1]] - param[edges[:, 0]])
+    rung = along < rung_tolerance * np.linalg.norm(delta, axis=1)
+
+    # 横木で繋がった頂点を段にまとめる
+    row_labels, row_count = connectedComponents(edges[rung], len(points))
+    row_card = np.zeros(row_count, dtype=np.int64)
+    row_card[row_labels] = card_labels
+    row_param = groupMeans(param, row_labels, row_count)
+    row_pos = groupMeans(points, row_labels, row_count)
+    row_nml = normalizeRows(groupMeans(normals, row_labels, row_count))
+
+    # カードごとに段を長さ方向に並べる
+    order = np.lexsort((row_param, row_card))
+    offsets = chainOffsets(np.bincount(row_card, minlength=card_count))
+    if uvs is None:
+        # 両端の段のうち、メッシュ全体の中心から遠い方がティップになるように並びを反転させる
+        first, last = order[offsets[:-1]], order[offsets[1:] - 1]
+        center = points.mean(axis=0)
+        flip = np.linalg.norm(row_pos[first] - center, axis=1) > np.linalg.norm(row_pos[last] - center, axis=1)
+        order = np.lexsort((row_param * np.where(flip, -1.0, 1.0)[row_card], row_card))
+
+    # 段が1つしかないカードはチェインにならないので除外する
+    counts = np.diff(offsets)
+    valid = ( counts >= 2 )[row_card[order]]
+    order = order[valid]
+    return [row_pos[order], row_nml[order], chainOffsets(counts[counts >= 2])]
+
+###################################################################################################################################
+## 複数チェインの扱い
+## 複数のチェインは各チェインのポイントを連結した配列と、各チェインの先頭位置の配列(offsets, 要素数はチェイン数+1)で表す
+## offsetsを省略した関数は配列全体を1本のチェインとして扱う
+
+def chainOffsets(lengths) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+def uniformOffsets(chain_count: int, length: int) -> np.ndarray:
+    # 全てのチェインが同じポイント数の場合のoffsets
+    return np.arange(chain_count + 1, dtype=np.int64) * length
+
+def chainJointIds(offsets: np.ndarray, root: bool, tip: bool) -> [np.ndarray, np.ndarray, np.ndarray]:
+    # ルート/ティップを除外した後に残るポイントのインデックスと、ジョイントの親（1つ前のジョイント、チェインの先頭は-1）を返す
+    # 戻り値: [ポイントのインデックス, 親ジョイントのインデックス, 除外後のoffsets]
+    starts = offsets[:-1] + (0 if root else 1)
+    counts = np.maximum(offsets[1:] - (0 if tip else 1) - starts, 0)
+    keep_offsets = chainOffsets(counts)
+    keep_ids = np.arange(keep_offsets[-1]) + np.repeat(starts - keep_offsets[:-1], counts)
+    parent_ids = np.arange(keep_offsets[-1]) - 1
+    parent_ids[keep_offsets[:-1][counts > 0]] = -1
+    return [keep_ids, parent_ids, keep_offsets]
+
+###################################################################################################################################
+## 距離に基づく再サンプリング
+
+def segmentLengths(pos: np.ndarray, offsets: np.ndarray = None) -> np.ndarray:
+    # ポイント間の距離（N-1要素、複数チェインの場合はチェインをまたぐ区間の距離を0にする）
+    seg = np.linalg.norm(np.diff(pos, axis=0), axis=1)
+    if offsets is not None:
+        seg[offsets[1:-1] - 1] = 0.0
+    return seg
+
+def cumulativeSegments(seg: np.ndarray) -> np.ndarray:
+    # 区間ごとの量の累積値を返す（[0]=0.0、float64で加算するので長いチェインでも誤差が溜まらない）
+    cum = np.zeros(len(seg) + 1)
+    np.cumsum(seg, out=cum[1:])
+    return cum
+
+def cumulativeLength(pos: np.ndarray, offsets: np.ndarray = None) -> np.ndarray:
+    # ポイント間の距離の累積値を返す（[0]=0.0で末尾が全長）
+    # 複数チェインの場合はチェインをまたぐ区間の距離を0にして、全チェインで1本の累積値にする
+    return cumulativeSegments(segmentLengths(pos, offsets))
+
+def lengthParameters(cum: np.ndarray, targets: np.ndarray, lo: np.ndarray = 0, hi: np.ndarray = None) -> [np.ndarray, np.ndarray]:
+    # 累積距離の配列上で目標の距離が含まれる区間のインデックスと区間内の割合(0-1)を一括で検索する
+    # lo, hiは目標ごとの区間インデックスの範囲（複数チェインの場合にチェインの外の区間を選ばないようにする）
+    seg_ids = np.clip(np.searchsorted(cum, targets, side='right') - 1, lo, len(cum) - 2 if hi is None else hi)
+    seg_len = cum[seg_ids + 1] - cum[seg_ids]
+    t = np.divide(targets - cum[seg_ids], seg_len, out=np.zeros(len(targets)), where=seg_len > 0.0)
+    return [seg_ids, t]
+
+def chainLengthParameters(cum: np.ndarray, offsets: np.ndarray, fractions: np.ndarray) -> [np.ndarray, np.ndarray]:
+    # 各チェインの全長に対する割合(C,K)の位置の区間パラメータを全チェインまとめて検索する
+    starts = cum[offsets[:-1]]
+    ends = cum[offsets[1:] - 1]
+    targets = starts[:, None] + ( ends - starts )[:, None] * fractions
+    count = targets.shape[1]
+    return lengthParameters(cum, targets.ravel(), np.repeat(offsets[:-1], count), np.repeat(offsets[1:] - 2, count))
+
+def interpolateRows(values: np.ndarray, seg_ids: np.ndarray, t: np.ndarray) -> np.ndarray:
+    # 区間のインデックスと割合で(N,3)の配列を線形補間する
+    return values[seg_ids] + ( values[seg_ids + 1] - values[seg_ids] ) * t[:, None]
+
+def evenlyIntervalParameters(pos: np.ndarray, div_count: int, offsets: np.ndarray = None) -> [np.ndarray, np.ndarray]:
+    # チェインの全長をdiv_count+1等分した位置（始点と終点を含むdiv_count+2点）の区間パラメータを返す
+    offsets = uniformOffsets(1, len(pos)) if offsets is None else offsets
+    fractions = np.linspace(0.0, 1.0, div_count + 2)[None, :]
+    return chainLengthParameters(cumulativeLength(pos, offsets), offsets, fractions)
+
+def resampleEvenly(pos: np.ndarray, nml: np.ndarray, div_count: int, offsets: np.ndarray = None) -> [np.ndarray, np.ndarray]:
+    # 複数チェインの場合、結果のoffsetsは uniformOffsets(チェイン数, div_count+2)
+    seg_ids, t = evenlyIntervalParameters(pos, div_count, offsets)
+    return [interpolateRows(pos, seg_ids, t), interpolateRows(nml, seg_ids, t)]
+
+def turningAngles(pos: np.ndarray, offsets: np.ndarray = None) -> np.ndarray:
+    # 各ポイントでの進行方向の曲がり角(radian)を一括で求める（離散曲率、チェインの両端は0）
+    offsets = uniformOffsets(1, len(pos)) if offsets is None else offsets
+    seg_dir = normalizeRows(np.diff(pos, axis=0))
+    angles = np.zeros(len(pos))
+    angles[1:-1] = np.arccos(np.clip(np.einsum('ij,ij->i', seg_dir[:-1], seg_dir[1:]), -1.0, 1.0))
+    angles[offsets[:-1]] = 0.0
+    angles[offsets[1:] - 1] = 0.0
+    return angles
+
+def curvatureParameters(pos: np.ndarray, div_count: int, offsets: np.ndarray = None, curvature_weight: float = 0.5) -> [np.ndarray, np.ndarray]:
+    # 距離と曲がり角を混ぜた量（重み付きの弧長）を各チェインで等分割した位置（始点と終点を含むdiv_count+2点）の区間パラメータを返す
+    # 区間の量 = (1-weight) * 区間の長さ/チェインの全長 + weight * 区間の両端の曲がり角の平均/チェインの曲がり角の合計
+    # 曲がっていないチェインは距離だけで等分割する
+    offsets = uniformOffsets(1, len(pos)) if offsets is None else offsets
+    chain_ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))[:-1]
+    seg_len = segmentLengths(pos, offsets)
+    angles = turningAngles(pos, offsets)
+    seg_turn = ( angles[:-1] + angles[1:] ) * 0.5
+    seg_turn[offsets[1:-1] - 1] = 0.0
+    total_len = np.bincount(chain_ids, seg_len, minlength=len(offsets) - 1)
+    total_turn = np.bincount(chain_ids, seg_turn, minlength=len(offsets) - 1)
+    weight = np.where(total_turn > 1.0e-12, curvature_weight, 0.0)[chain_ids]
+    seg = ( 1.0 - weight ) * np.divide(seg_len, total_len[chain_ids], out=np.zeros(len(seg_len)), where=total_len[chain_ids] > 0.0) \
+        + weight * np.divide(seg_turn, total_turn[chain_ids], out=np.zeros(len(seg_turn)), where=total_turn[chain_ids] > 0.0)
+    seg[offsets[1:-1] - 1] = 0.0
+    fractions = np.linspace(0.0, 1.0, div_count + 2)[None, :]
+    return chainLengthParameters(cumulativeSegments(seg), offsets, fractions)
+
+def resampleByCurvature(pos: np.ndarray, nml: np.ndarray, div_count: int, offsets: np.ndarray = None, curvature_weight: float = 0.5) -> [np.ndarray, np.ndarray]:
+    # 曲がっている部分にジョイントを多く割り当てる（複数チェインの場合、結果のoffsetsは uniformOffsets(チェイン数, div_count+2)）
+    seg_ids, t = curvatureParameters(pos, div_count, offsets, curvature_weight)
+    return [interpolateRows(pos, seg_ids, t), interpolateRows(nml, seg_ids, t)]
+
+def pointSegmentDistances(points: np.ndarray, seg_start: np.ndarray, seg_end: np.ndarray) -> np.ndarray:
+    # 各点と対応する線分との距離を一括で求める
+    ab = seg_end - seg_start
+    ab_len2 = np.einsum('ij,ij->i', ab, ab)
+    t = np.divide(np.einsum('ij,ij->i', points - seg_start, ab), ab_len2, out=np.zeros(len(points)), where=ab_len2 > 0.0)
+    return np.linalg.norm(points - ( seg_start + ab * np.clip(t, 0.0, 1.0)[:, None] ), axis=1)
+
+def simplifyChains(pos: np.ndarray, offsets: np.ndarray, tolerance: float) -> [np.ndarray, float]:
+    # Douglas-Peucker法で、元のラインからの距離がtolerance以内に収まる最小限のポイントを残す
+    # 分割待ちの区間を全チェイン分まとめて処理し、1回の反復で全区間の距離の計算と分割を行う（反復回数は分割の深さ）
+    # 戻り値: [残すポイントのマスク, 残さなかったポイントと簡略化したラインとの最大距離]
+    keep = np.zeros(len(pos), dtype=bool)
+    valid = np.diff(offsets) > 0
+    keep[offsets[:-1][valid]] = True
+    keep[offsets[1:][valid] - 1] = True
+    starts, ends = offsets[:-1][valid], offsets[1:][valid] - 1
+    max_error = 0.0
+    while True:
+        pending = ends - starts >= 2
+        starts, ends = starts[pending], ends[pending]
+        if len(starts) == 0:
+            break
+        counts = ends - starts - 1
+        range_offsets = chainOffsets(counts)
+        owner = np.repeat(np.arange(len(starts)), counts)
+        interior = np.arange(range_offsets[-1]) - range_offsets[owner] + starts[owner] + 1
+        dist = pointSegmentDistances(pos[interior], pos[starts[owner]], pos[ends[owner]])
+        range_max = np.maximum.reduceat(dist, range_offsets[:-1])
+        # 最大距離の点（同じ距離が複数ある場合は最初の点）
+        range_arg = np.minimum.reduceat(np.where(dist == range_max[owner], interior, len(pos)), range_offsets[:-1])
+        split = range_max > tolerance
+        if ( split == False ).any():
+            max_error = max(max_error, float(range_max[split == False].max()))
+        mids = range_arg[split]
+        keep[mids] = True
+        starts, ends = np.concatenate([starts[split], mids]), np.concatenate([mids, ends[split]])
+    return [keep, max_error]
+
+def spacingCounts(cum: np.ndarray, offsets: np.ndarray, spacing: float) -> np.ndarray:
+    # 各チェインの始点から間隔spacingで配置するポイント数（終点を含む。長さ0のチェインは0）
+    length = cum[offsets[1:] - 1] - cum[offsets[:-1]]
+    steps = np.floor(length / spacing + 1.0e-9) # 始点から間隔ちょうどで置けるポイント数（始点を除く）
+    counts = steps + 1 + ( length - steps * spacing > spacing * 1.0e-6 ) # 終点までの残りが間隔より短い場合も終点に1点置く
+    return np.where(length > 0.0, counts, 0).astype(np.int64)
+
+def spacedParameters(cum: np.ndarray, offsets: np.ndarray, sample_offsets: np.ndarray, spacing: float, sample_ids: np.ndarray) -> [np.ndarray, np.ndarray]:
+    # spacingCounts()で数えたポイントのうち、sample_ids（全チェイン通しの番号）のポイントの区間パラメータだけを求める
+    chain_ids = np.searchsorted(sample_offsets, sample_ids, side='right') - 1
+    start = cum[offsets[chain_ids]]
+    length = cum[offsets[chain_ids + 1] - 1] - start
+    targets = start + np.minimum(( sample_ids - sample_offsets[chain_ids] ) * spacing, length)
+    return lengthParameters(cum, targets, offsets[chain_ids], offsets[chain_ids + 1] - 2)
+
+def spacingParameters(pos: np.ndarray, spacing: float, offsets: np.ndarray = None) -> [np.ndarray, np.ndarray, np.ndarray]:
+    # 各チェインの始点から間隔spacingごとのポイントの区間パラメータ（チェインごとにポイント数が異なるのでoffsetsも返す）
+    offsets = uniformOffsets(1, len(pos)) if offsets is None else offsets
+    cum = cumulativeLength(pos, offsets)
+    sample_offsets = chainOffsets(spacingCounts(cum, offsets, spacing))
+    seg_ids, t = spacedParameters(cum, offsets, sample_offsets, spacing, np.arange(sample_offsets[-1]))
+    return [seg_ids, t, sample_offsets]
+
+def resampleBySpacing(pos: np.ndarray, nml: np.ndarray, spacing: float, offsets: np.ndarray = None) -> [np.ndarray, np.ndarray, np.ndarray]:
+    # 各チェインの始点から間隔spacingごとにポイントを配置する
+    # ポイント数が非常に多くなる場合はiterSpacedJointChunks()で一定数ごとに算出する
+    seg_ids, t, sample_offsets = spacingParameters(pos, spacing, offsets)
+    return [interpolateRows(pos, seg_ids, t), interpolateRows(nml, seg_ids, t), sample_offsets]
+
+###################################################################################################################################
+## ジョイントの向きの一括計算
+
+# アップベクトルの求め方
+kFrameNormal = 0             # 各コンポーネントの法線
+kFrameRotationMinimizing = 1 # チェインの先頭の法線から捩じれが最小になるように運ぶ
+
+# axisType(0=ZY, 1=ZX, 2=XZ, 3=XY, 4=YX, 5=YZ)ごとに、X,Y,Z軸へ割り当てる基底ベクトル（0=aim, 1=up, 2=up^aim）とその符号
+kAxisPermutation = np.array([[2, 1, 0], [1, 2, 0], [0, 2, 1], [0, 1, 2], [1, 0, 2], [2, 0, 1]])
+kAxisSign = np.array([[1.0, 1.0, 1.0], [1.0, -1.0, 1.0], [1.0, 1.0, 1.0], [1.0, 1.0, -1.0], [1.0, 1.0, 1.0], [-1.0, 1.0, 1.0]])
+
+def chainDirections(pos: np.ndarray, offsets: np.ndarray = None) -> np.ndarray:
+    # 各ポイントから次のポイントへの向きを返す（チェインの末尾は1つ前の値のコピー）
+    offsets = uniformOffsets(1, len(pos)) if offsets is None else offsets
+    dir = np.empty_like(pos)
+    dir[:-1] = normalizeRows(np.diff(pos, axis=0))
+    last = offsets[1:] - 1
+    dir[last] = dir[last - 1]
+    return dir
+
+def fixParallelNormals(dir: np.ndarray, nml: np.ndarray, offsets: np.ndarray = None, tolerance: float = 1.0e-10) -> np.ndarray:
+    # ディレクションと法線が平行な場合は回転値の計算が出来ないため、次の法線（チェインの末尾は前の法線）との平均に置き換える
+    nml_n = normalizeRows(nml)
+    parallel = 1.0 - np.abs(np.einsum('ij,ij->i', dir, nml_n)) < tolerance
+    if not parallel.any():
+        return nml
+    offsets = uniformOffsets(1, len(nml)) if offsets is None else offsets
+    neighbor_ids = np.arange(1, len(nml) + 1)
+    last = offsets[1:] - 1
+    neighbor_ids[last] = last - 1
+    result = nml.copy()
+    result[parallel] = normalizeRows(nml[parallel] + nml[neighbor_ids[parallel]])
+    return result
+
+def segmentedPrefixProducts(mats: np.ndarray, segment_starts: np.ndarray) -> np.ndarray:
+    # 行列の累積積 P[i] = mats[i] @ mats[i-1] @ ... @ mats[s] (sはiが含まれる区間の先頭) を区間ごとにまとめて求める
+    # 1つ前との積 -> 2つ前との積 -> 4つ前との積 と倍々に広げるので、配列全体に対する行列積をlog2(N)回行うだけで済む
+    prod = mats.copy()
+    closed = segment_starts.astype(bool).copy() # 区間の先頭まで積を取り終えたか
+    step = 1
+    while step < len(prod) and closed.all() == False:
+        update = np.flatnonzero(closed[step:] == False) + step
+        next_prod = prod.copy()
+        next_prod[update] = np.matmul(prod[update], prod[update - step])
+        next_closed = closed.copy()
+        next_closed[update] = closed[update - step]
+        prod, closed = next_prod, next_closed
+        step *= 2
+    return prod
+
+def rotationMinimizingUp(pos: np.ndarray, dir: np.ndarray, nml: np.ndarray, offsets: np.ndarray = None, normal_blend: float = 0.0) -> np.ndarray:
+    # ダブルリフレクション法で捩じれの少ないアップベクトルを求める（各チェインの最初のアップベクトルは先頭の法線から作る）
+    # normal_blend: 求めたアップベクトルをコンポーネントの法線に近づける割合(0-1)
+    return blendUp(transportedUp(pos, dir, nml, offsets), nml, normal_blend)
+
+def transportedUp(pos: np.ndarray, dir: np.ndarray, nml: np.ndarray, offsets: np.ndarray = None) -> np.ndarray:
+    # 各チェインの先頭の法線を捩じれが最小になるように末尾まで運んだアップベクトル（法線に近づける前の値）
+    # 1区間ごとの2回の鏡映はアップベクトルに依存しない行列になるので、その累積積を一括で求めてから最初のアップベクトルに掛ける
+    offsets = uniformOffsets(1, len(pos)) if offsets is None else offsets
+    eye = np.broadcast_to(np.eye(3), (len(pos), 3, 3))
+
+    # i-1 -> i の鏡映（チェインの先頭は単位行列）
+    v1 = np.zeros_like(pos)
+    v1[1:] = np.diff(pos, axis=0)
+    c1 = np.einsum('ij,ij->i', v1, v1)
+    t_prev = np.zeros_like(dir)
+    t_prev[1:] = dir[:-1]
+    t_reflected = t_prev - ( 2.0 * np.divide(np.einsum('ij,ij->i', v1, t_prev), c1, out=np.zeros(len(c1)), where=c1 > 1.0e-20) )[:, None] * v1
+    v2 = dir - t_reflected
+    c2 = np.einsum('ij,ij->i', v2, v2)
+    r1 = eye - 2.0 * np.divide(v1[:, :, None] * v1[:, None, :], c1[:, None, None], out=np.zeros((len(c1), 3, 3)), where=c1[:, None, None] > 1.0e-20)
+    r2 = eye - 2.0 * np.divide(v2[:, :, None] * v2[:, None, :], c2[:, None, None], out=np.zeros((len(c2), 3, 3)), where=c2[:, None, None] > 1.0e-20)
+    transfer = np.matmul(r2, r1)
+    segment_starts = np.zeros(len(pos), dtype=bool)
+    segment_starts[offsets[:-1][np.diff(offsets) > 0]] = True
+    transfer[segment_starts] = np.eye(3)
+
+    # 各チェインの最初のアップベクトル（先頭の法線を向きに垂直にする。平行な場合は向きと最も直交に近い軸を使う）
+    starts = offsets[:-1][np.diff(offsets) > 0]
+    t0 = dir[starts]
+    seed = nml[starts] - np.einsum('ij,ij->i', nml[starts], t0)[:, None] * t0
+    degenerate = np.linalg.norm(seed, axis=1) < 1.0e-8
+    if degenerate.any():
+        axis = np.eye(3)[np.argmin(np.abs(t0[degenerate]), axis=1)]
+        seed[degenerate] = np.cross(t0[degenerate], axis)
+    seed = normalizeRows(seed)
+
+    up = np.einsum('nij,nj->ni', segmentedPrefixProducts(transfer, segment_starts), np.repeat(seed, np.diff(offsets)[np.diff(offsets) > 0], axis=0))
+    return normalizeRows(up)
+
+def blendUp(up: np.ndarray, nml: np.ndarray, normal_blend: float) -> np.ndarray:
+    # アップベクトルをコンポーネントの法線にnormal_blendの割合(0-1)だけ近づける
+    if normal_blend > 0.0:
+        blended = up + ( normalizeRows(nml) - up ) * normal_blend
+        up = np.where(( np.linalg.norm(blended, axis=1) > 1.0e-6 )[:, None], blended, up)
+    return normalizeRows(up)
+
+def aimUpBasis(dir: np.ndarray, up: np.ndarray, aim_neg: bool, up_neg: bool) -> np.ndarray:
+    # ディレクションとアップベクトルから正規直交の基底を作る 戻り値: (N,3,3) [:,0]=aim, [:,1]=up, [:,2]=up^aim
+    v0 = normalizeRows(dir) * (-1.0 if aim_neg else 1.0)
+    v1 = normalizeRows(np.cross(np.cross(v0, normalizeRows(up)), v0)) * (-1.0 if up_neg else 1.0)
+    v2 = normalizeRows(np.cross(v1, v0))
+    return np.stack([v0, v1, v2], axis=1)
+
+def framesFromBasis(basis: np.ndarray, axis_type: int) -> np.ndarray:
+    # 基底をaxisTypeに応じて並べ替えて回転行列（行がX,Y,Z軸）にする
+    return basis[:, kAxisPermutation[axis_type]] * kAxisSign[axis_type][None, :, None]
+
+def localRotations(frames: np.ndarray, parent_ids: np.ndarray) -> np.ndarray:
+    # 親のグローバル回転に対するローカル回転を返す（parent_ids=-1はワールド直下）
+    parent_frames = np.broadcast_to(np.eye(3), frames.shape).copy()
+    has_parent = parent_ids >= 0
+    parent_frames[has_parent] = frames[parent_ids[has_parent]]
+    return np.matmul(frames, np.transpose(parent_frames, (0, 2, 1)))
+
+def localTranslations(pos: np.ndarray, frames: np.ndarray, parent_ids: np.ndarray) -> np.ndarray:
+    # 親ジョイントの空間での位置を一括で算出する（ワールド直下のジョイントはグローバル座標のまま）
+    local_pos = pos.copy()
+    has_parent = parent_ids >= 0
+    parent_of = parent_ids[has_parent]
+    local_pos[has_parent] = np.einsum('nij,nj->ni', frames[parent_of], pos[has_parent] - pos[parent_of])
+    return local_pos
+
+def eulerXYZFromMatrices(mats: np.ndarray) -> np.ndarray:
+    # 回転行列（Mayaと同じ行ベクトル形式）を回転順序XYZのEuler(radian)に変換する
+    cy = np.hypot(mats[:, 0, 0], mats[:, 0, 1])
+    gimbal = cy < 1.0e-9
+    rx = np.where(gimbal, np.arctan2(-mats[:, 2, 1], mats[:, 1, 1]), np.arctan2(mats[:, 1, 2], mats[:, 2, 2]))
+    ry = np.arctan2(-mats[:, 0, 2], cy)
+    rz = np.where(gimbal, 0.0, np.arctan2(mats[:, 0, 1], mats[:, 0, 0]))
+    return np.stack([rx, ry, rz], axis=1)
+
+def orientChain(dir: np.ndarray, up: np.ndarray, axis_type: int, aim_neg: bool, up_neg: bool, parent_ids: np.ndarray) -> [np.ndarray, np.ndarray]:
+    # 全ジョイントのグローバル回転行列と、親に対するローカル回転(Euler XYZ radian)をまとめて算出する
+    frames = framesFromBasis(aimUpBasis(dir, up, aim_neg, up_neg), axis_type)
+    return [frames, eulerXYZFromMatrices(localRotations(frames, parent_ids))]
+
+###################################################################################################################################
+## ジョイントチェインの計算結果（プレビューとコマンドで共有する）
+
+def resampleChains(pos: np.ndarray, nml: np.ndarray, offsets: np.ndarray, create_type: int, create_count: int, curvature_weight: float = 0.5, tolerance: float = 0.1, spacing: float = 1.0) -> [np.ndarray, np.ndarray, np.ndarray, float]:
+    # createTypeに応じてジョイントを配置する位置と法線を算出する（0=コンポーネントの中央, 1=等分割, 2=曲がり具合に応じた分割, 3=許容誤差内での簡略化, 4=間隔を指定）
+    # 戻り値: [位置, 法線, 再計算後のoffsets, 元のラインとの最大距離（簡略化した場合のみ、それ以外は0.0）]
+    seg_ids, t, offsets, error = resampleParameters(pos, offsets, create_type, create_count, curvature_weight, tolerance, spacing)
+    return [interpolateParameters(pos, seg_ids, t), interpolateParameters(nml, seg_ids, t), offsets, error]
+
+def resampleParameters(pos: np.ndarray, offsets: np.ndarray, create_type: int, create_count: int, curvature_weight: float = 0.5, tolerance: float = 0.1, spacing: float = 1.0) -> [np.ndarray, np.ndarray, np.ndarray, float]:
+    # resampleChains()のジョイントを配置する位置を区間パラメータで返す（同じトポロジーの別のフレームの位置と法線にもそのまま使える）
+    # 戻り値: [区間のインデックス, 区間内の割合, 再計算後のoffsets, 元のラインとの最大距離]
+    seg_ids, t, error = np.arange(len(pos)), np.zeros(len(pos)), 0.0
+    if create_type == 1:
+        seg_ids, t = evenlyIntervalParameters(pos, create_count, offsets)
+        offsets = uniformOffsets(len(offsets) - 1, create_count + 2)
+    elif create_type == 2:
+        seg_ids, t = curvatureParameters(pos, create_count, offsets, curvature_weight)
+        offsets = uniformOffsets(len(offsets) - 1, create_count + 2)
+    elif create_type == 3:
+        keep, error = simplifyChains(pos, offsets, tolerance)
+        chain_ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        seg_ids, t = seg_ids[keep], t[keep] # 残したポイントは元のコンポーネントの法線をそのまま使う
+        offsets = chainOffsets(np.bincount(chain_ids[keep], minlength=len(offsets) - 1))
+    elif create_type == 4 and spacing > 0.0:
+        seg_ids, t, offsets = spacingParameters(pos, spacing, offsets)
+    return [seg_ids, t, offsets, error]
+
+def interpolateParameters(values: np.ndarray, seg_ids: np.ndarray, t: np.ndarray) -> np.ndarray:
+    # interpolateRows()と同じだが、末尾のポイント（割合0）をそのまま指定できる
+    next_ids = np.minimum(seg_ids + 1, len(values) - 1)
+    return values[seg_ids] + ( values[next_ids] - values[seg_ids] ) * t[:, None]
+
+class JointChainPlan(object):
+    # 全チェインの全ジョイントの位置と向きをまとめた配列（作成後は変更不可にして、スレッド間でもそのまま共有できるようにする）
+    # key: 計算に使ったメッシュ・コンポーネント・オプションを表すタプル（同じキーなら同じ結果になる）
+    __slots__ = ("key", "joint_offsets", "parent_ids", "joint_pos", "basis", "frames", "local_rad", "min_length", "placement_error")
+
+    def __init__(self, key: tuple, pos: np.ndarray, nml: np.ndarray, offsets: np.ndarray, axis_type: int, aim_neg: bool, up_neg: bool, root: bool, tip: bool, frame_type: int = kFrameNormal, normal_blend: float = 0.0, placement_error: float = 0.0):
+        # pos, nml, offsets, placement_error: resampleChains()で算出したジョイントを配置するポイントと元のラインとの最大距離
+        # frame_type: アップベクトルの求め方（kFrameNormal=コンポーネントの法線, kFrameRotationMinimizing=捩じれの少ないフレーム）
+        dir = chainDirections(pos, offsets)
+        if frame_type == kFrameRotationMinimizing:
+            nml = rotationMinimizingUp(pos, dir, nml, offsets, normal_blend)
+        else:
+            nml = fixParallelNormals(dir, nml, offsets)
+        keep_ids, parent_ids, joint_offsets = chainJointIds(offsets, root, tip)
+
+        seg = np.linalg.norm(np.diff(pos, axis=0), axis=1)
+        seg[offsets[1:-1] - 1] = np.inf # チェインをまたぐ区間は除外する
+
+        self.key = key
+        self.joint_offsets = joint_offsets
+        self.parent_ids = parent_ids
+        self.joint_pos = np.ascontiguousarray(pos[keep_ids], dtype=np.float64)
+        self.basis = np.ascontiguousarray(aimUpBasis(dir[keep_ids], nml[keep_ids], aim_neg, up_neg), dtype=np.float64)
+        self.frames = np.ascontiguousarray(framesFromBasis(self.basis, axis_type), dtype=np.float64)
+        self.local_rad = np.ascontiguousarray(eulerXYZFromMatrices(localRotations(self.frames, parent_ids)), dtype=np.float64)
+        self.min_length = float(seg.min()) if len(seg) else 0.0
+        self.placement_error = placement_error
+        for array in (self.joint_offsets, self.parent_ids, self.joint_pos, self.basis, self.frames, self.local_rad):
+            array.flags.writeable = False
+
+    def jointCount(self) -> int:
+        return len(self.joint_pos)
+
+    def rootIds(self) -> np.ndarray:
+        # ジョイントが1つ以上あるチェインの先頭のジョイントのインデックス
+        return self.joint_offsets[:-1][np.diff(self.joint_offsets) > 0]
+
+    def toFlatArray(self) -> np.ndarray:
+        # ジョイントごとに[ワールド座標XYZ, 親に対するローカル回転XYZ(degree)]の6要素を並べた配列
+        return np.hstack([self.joint_pos, np.degrees(self.local_rad)]).ravel()
+
+###################################################################################################################################
+## 間隔を指定した場合のジョイントを一定数ごとに算出する（ジョイント数が非常に多い場合でも、一度に確保する配列の大きさを一定にする）
+
+kSpacingChunkSize = 4096
+
+class JointChunk(object):
+    # iterSpacedJointChunks()が返す一定数のジョイントの位置と向き（ジョイントの番号は全チェイン通しの番号）
+    __slots__ = ("joint_ids", "chain_ids", "chain_joint_ids", "parent_ids", "joint_pos", "local_pos", "frames", "local_rad")
+
+    def __init__(self, joint_ids: np.ndarray, chain_ids: np.ndarray, chain_joint_ids: np.ndarray, parent_ids: np.ndarray, joint_pos: np.ndarray, local_pos: np.ndarray, frames: np.ndarray, local_rad: np.ndarray):
+        self.joint_ids = joint_ids
+        self.chain_ids = chain_ids
+        self.chain_joint_ids = chain_joint_ids # チェイン内でのジョイントの番号
+        self.parent_ids = parent_ids # 親ジョイントの番号（チェインの先頭は-1、1つ前のチャンクのジョイントの場合もある）
+        self.joint_pos = joint_pos
+        self.local_pos = local_pos # 親ジョイントの空間での位置（ワールド直下のジョイントはグローバル座標のまま）
+        self.frames = frames
+        self.local_rad = local_rad
+
+    def rootIds(self) -> np.ndarray:
+        return self.joint_ids[self.parent_ids < 0]
+
+def iterSpacedJointChunks(pos: np.ndarray, nml: np.ndarray, offsets: np.ndarray, spacing: float, axis_type: int, aim_neg: bool, up_neg: bool, root: bool, tip: bool, frame_type: int = kFrameNormal, normal_blend: float = 0.0, chunk_size: int = kSpacingChunkSize):
+    # resampleChains(create_type=4)からJointChainPlanを作るのと同じ結果を、chunk_size個のポイントごとに算出してJointChunkを返す
+    # 各チャンクは前後1つずつのポイントを加えて計算するので、向きと親に対する回転はチャンクの境目でも一括で計算した場合と変わらない
+    # 捩じれの少ないフレームの場合は、前のチャンクの最後のアップベクトルを次のチャンクの最初のポイントまで運ぶ
+    cum = cumulativeLength(pos, offsets)
+    counts = spacingCounts(cum, offsets, spacing)
+    sample_offsets = chainOffsets(counts)
+    first_keep = 0 if root else 1
+    joint_offsets = chainOffsets(np.maximum(counts - first_keep - ( 0 if tip else 1 ), 0))
+    sample_count = int(sample_offsets[-1])
+    carried_up = None
+    for begin in range(0, sample_count, max(chunk_size, 1)):
+        end = min(begin + chunk_size, sample_count)
+        # 前後1つずつのポイントは同じチェインの場合だけ加える
+        lo = begin - 1 if begin > 0 and begin not in sample_offsets else begin
+        hi = end + 1 if end < sample_count and end not in sample_offsets else end
+        sample_ids = np.arange(lo, hi)
+        seg_ids, t = spacedParameters(cum, offsets, sample_offsets, spacing, sample_ids)
+        s_pos = interpolateRows(pos, seg_ids, t)
+        s_nml = interpolateRows(nml, seg_ids, t)
+        local_offsets = np.unique(np.concatenate([np.clip(sample_offsets, lo, hi), [lo, hi]])) - lo
+        dir = chainDirections(s_pos, local_offsets)
+        if frame_type == kFrameRotationMinimizing:
+            seed_nml = s_nml.copy()
+            if lo < begin: # 前のチャンクから運んだアップベクトルをそのまま先頭のアップベクトルにする
+                seed_nml[0] = carried_up
+            up = transportedUp(s_pos, dir, seed_nml, local_offsets)
+            carried_up = up[end - 1 - lo]
+            up = blendUp(up, s_nml, normal_blend)
+        else:
+            up = fixParallelNormals(dir, s_nml, local_offsets)
+        frames = framesFromBasis(aimUpBasis(dir, up, aim_neg, up_neg), axis_type)
+
+        # チャンク内のポイントのうちルート/ティップとして除外しないものをジョイントにする
+        chain_ids = np.searchsorted(sample_offsets, sample_ids, side='right') - 1
+        k = sample_ids - sample_offsets[chain_ids]
+        keep = ( sample_ids >= begin ) & ( sample_ids < end ) & ( k >= first_keep ) & ( k <= counts[chain_ids] - ( 1 if tip else 2 ) )
+        keep_ids = np.flatnonzero(keep)
+        joint_ids = joint_offsets[chain_ids[keep_ids]] + k[keep_ids] - first_keep
+        has_parent = k[keep_ids] > first_keep
+        parent_ids = np.where(has_parent, joint_ids - 1, -1)
+        parent_frames = np.broadcast_to(np.eye(3), (len(keep_ids), 3, 3)).copy()
+        parent_frames[has_parent] = frames[keep_ids[has_parent] - 1]
+        local_pos = s_pos[keep_ids].copy()
+        local_pos[has_parent] = np.einsum('nij,nj->ni', parent_frames[has_parent], s_pos[keep_ids[has_parent]] - s_pos[keep_ids[has_parent] - 1])
+        local_rad = eulerXYZFromMatrices(np.matmul(frames[keep_ids], np.transpose(parent_frames, (0, 2, 1))))
+        yield JointChunk(joint_ids, chain_ids[keep_ids], k[keep_ids] - first_keep, parent_ids, s_pos[keep_ids], local_pos, frames[keep_ids], local_rad)
@@ -0,0 +1,350 @@
+###################################################################################################################################
+###################################################################################################################################
+# モジュール
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Mayaモジュール
+import maya.utils
+import maya.api.OpenMaya as om2
+
+# 自前のモジュール
+import util.chain_math as TKCM_ChainMath
+import util.topology_cache as TKCM_TopologyCache
+###################################################################################################################################
+###################################################################################################################################
+## メッシュから読み込んだ配列のキャッシュ
+## キーはメッシュのシェイプノードのハンドルと、トポロジーのハッシュ(util.topology_cache.topologyHash)
+## - 取得のたびに頂点数・エッジ数・フェース数・フェース頂点数だけを比べ、ハッシュはフェースの配列を読んだ時に1回だけ計算してエントリーに持たせる
+## - 頂点の座標と法線はオブジェクト空間で保持して、ワールド空間は取得時にシェイプのワールド行列を掛ける（トランスフォームを動かしてもキャッシュは有効のまま）
+## - ノードがダーティになった場合は頂点の座標と法線だけを破棄し、トポロジーが変わった場合は全て破棄する
+## - 全メッシュの配列の合計サイズが上限を超えた場合は、最後に使ってから時間が経ったメッシュから破棄する(LRU)
+## - DAGパスが無いメッシュ（ノードのinMeshなどのメッシュデータ）はキャッシュせずにそのまま読み込む
+## - メッシュの全エッジと頂点の隣接リストはディスクのキャッシュ(util.topology_cache)が有効ならそこからマップする
+## - コールバックはメインスレッドで登録・削除する（バックグラウンドのスレッドで作ったエントリーは登録が済むまで頂点の座標と法線をキャッシュしない）
+## - ロックは検索と登録の間だけ取り、メッシュからの読み込み・隣接リストの作成はロックの外で行う（同じ配列を同時に読んだ場合は先に登録された方を使う）
+
+kDefaultMaxBytes = 256 * 1024 * 1024
+
+# 頂点の座標と法線（ノードがダーティになったら破棄する）
+kPointKeys = ("points", "normals", "mesh_normals")
+
+class MeshCacheEntry(object):
+    __slots__ = ("key", "handle", "topology_counts", "topology_hash", "generation", "arrays", "callback_ids", "watching")
+
+    def __init__(self, key: int, handle: om2.MObjectHandle, topology_counts: tuple, generation: int):
+        self.key = key;
+        self.handle = handle;
+        self.topology_counts = topology_counts; # 取得のたびに比べる要素数（トポロジーの変更の簡易的な確認）
+        self.topology_hash = None; # フェースの配列のハッシュ（getTopologyHash()で初めて使う時に計算する）
+        self.generation = generation; # メッシュが変更されるたびに新しい値にする（geometryGeneration()）
+        self.arrays = {};       # [配列の種類] = 読み込み専用のnumpy配列、もしくはそのタプル
+        self.callback_ids = []; # 破棄する時に削除するコールバック
+        self.watching = False;  # コールバックの登録が済んでいるか
+
+    def nbytes(self) -> int:
+        return sum(arrayBytes(value) for value in self.arrays.values());
+
+def arrayBytes(value) -> int:
+    if isinstance(value, tuple):
+        return sum(v.nbytes for v in value);
+    return value.nbytes;
+
+def readOnly(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False;
+    return array;
+
+def topologyCounts(mesh_fn: om2.MFnMesh) -> tuple:
+    return (mesh_fn.numVertices, mesh_fn.numEdges, mesh_fn.numPolygons, mesh_fn.numFaceVertices);
+
+###################################################################################################################################
+
+class MeshCache(object):
+    def __init__(self, max_bytes: int = kDefaultMaxBytes):
+        self.max_bytes = max_bytes;
+        self.entries = OrderedDict(); # [ハンドルのハッシュ] = MeshCacheEntry（末尾ほど最近使ったメッシュ）
+        self.lock = threading.RLock(); # プレビューの計算はバックグラウンドのスレッドから読み、コールバックはメインスレッドから破棄する
+        self.hits = 0;
+        self.misses = 0;
+        self.generation = 0; # 全メッシュで共通の通し番号（同じ値が別のメッシュや変更前の状態に使われることは無い）
+
+    #######################################################################################
+    ## 配列の取得
+
+    def getPoints(self, mesh_fn: om2.MFnMesh, space: om2.MSpace = om2.MSpace.kWorld) -> np.ndarray:
+        points = self.fetch(mesh_fn, "points", lambda: readPoints(mesh_fn, om2.MSpace.kObject));
+        if points is None:
+            return readPoints(mesh_fn, space);
+        matrix = self.worldMatrix(mesh_fn, space);
+        if matrix is None:
+            return points;
+        return points @ matrix[:3, :3] + matrix[3, :3];
+
+    def getVertexNormals(self, mesh_fn: om2.MFnMesh, space: om2.MSpace = om2.MSpace.kWorld) -> np.ndarray:
+        normals = self.fetch(mesh_fn, "normals", lambda: np.array(mesh_fn.getVertexNormals(False, om2.MSpace.kObject), dtype=np.float64));
+        if normals is None:
+            return np.array(mesh_fn.getVertexNormals(False, space), dtype=np.float64);
+        return self.transformNormals(mesh_fn, normals, space);
+
+    def getNormals(self, mesh_fn: om2.MFnMesh, space: om2.MSpace = om2.MSpace.kWorld) -> np.ndarray:
+        # メッシュの法線の配列（MFnMesh.getNormals()と同じく法線IDの順）
+        normals = self.fetch(mesh_fn, "mesh_normals", lambda: readNormals(mesh_fn, om2.MSpace.kObject));
+        if normals is None:
+            return readNormals(mesh_fn, space);
+        return self.transformNormals(mesh_fn, normals, space);
+
+    def transformNormals(self, mesh_fn: om2.MFnMesh, normals: np.ndarray, space: om2.MSpace) -> np.ndarray:
+        matrix = self.worldMatrix(mesh_fn, space);
+        if matrix is None:
+            return normals;
+        # 法線は逆転置行列で変換する（スケールが不均一な場合でも面に垂直なままにする）
+        world = normals @ np.linalg.inv(matrix[:3, :3]).T;
+        length = np.linalg.norm(world, axis=1, keepdims=True);
+        return np.divide(world, length, out=np.zeros_like(world), where=length > 0.0);
+
+    def getEdgeVertices(self, mesh_fn: om2.MFnMesh, edge_ids: np.ndarray) -> np.ndarray:
+        # MFnMeshにはエッジの一括取得が無いため、全エッジ分の配列を用意しておき、まだ読んでいないエッジだけを1回ずつ取得して埋める
+        edge_ids = np.asarray(edge_ids, dtype=np.int64);
+        with self.lock:
+            entry = self.entry(mesh_fn);
+            if entry is not None:
+                edge_vtx = entry.arrays.get("edge_vertices");
+                if edge_vtx is None:
+                    edge_vtx = np.full((mesh_fn.numEdges, 2), -1, dtype=np.int64);
+                missing = np.unique(edge_ids[edge_vtx[edge_ids, 0] < 0]);
+                if len(missing) == 0:
+                    self.hits += 1;
+                    return edge_vtx[edge_ids];
+                self.misses += 1;
+        if entry is None:
+            return readEdgeVertices(mesh_fn, edge_ids);
+
+        read = readEdgeVertices(mesh_fn, missing);
+        with self.lock:
+            # 読み込んでいる間に他のスレッドが登録した分も残す（エントリーが破棄されていた場合は登録しない）
+            current = self.isCurrent(entry);
+            latest = entry.arrays.get("edge_vertices") if current else None;
+            edge_vtx = ( edge_vtx if latest is None else latest ).copy();
+            edge_vtx[missing] = read;
+            if current:
+                self.store(entry, "edge_vertices", readOnly(edge_vtx));
+            return edge_vtx[edge_ids];
+
+    def getFaceVertices(self, mesh_fn: om2.MFnMesh) -> [np.ndarray, np.ndarray, np.ndarray]:
+        # フェースごとの頂点数・オフセット・頂点IDリスト(CSR)
+        face_csr = self.fetch(mesh_fn, "face_vertices", lambda: readFaceVertices(mesh_fn));
+        if face_csr is None:
+            return list(readFaceVertices(mesh_fn));
+        return list(face_csr);
+
+    def getAdjacency(self, mesh_fn: om2.MFnMesh) -> [np.ndarray, np.ndarray, np.ndarray]:
+        # メッシュの全エッジ(E,2)と頂点の隣接リスト(CSR)。メモリに無ければディスクのキャッシュを確認し、それも無ければ作成する
+        face_counts, _, face_vertices = self.getFaceVertices(mesh_fn);
+        def read():
+            key = self.getTopologyHash(mesh_fn) if TKCM_TopologyCache.getCacheDir() is not None else None; # ディスクのキャッシュのキー
+            return tuple(TKCM_TopologyCache.meshAdjacency(face_counts, face_vertices, mesh_fn.numVertices, key)[1:]);
+        adjacency = self.fetch(mesh_fn, "adjacency", read);
+        if adjacency is None:
+            return list(read());
+        return list(adjacency);
+
+    def getTopologyHash(self, mesh_fn: om2.MFnMesh) -> str:
+        # フェースの配列のハッシュ（エントリーごとに1回だけ計算する。トポロジーが変わるとエントリーごと破棄される）
+        face_counts, _, face_vertices = self.getFaceVertices(mesh_fn);
+        with self.lock:
+            entry = self.entry(mesh_fn);
+            if entry is not None and entry.topology_hash is not None:
+                return entry.topology_hash;
+        digest = TKCM_TopologyCache.topologyHash(face_counts, face_vertices);
+        with self.lock:
+            if entry is not None and self.isCurrent(entry) and entry.topology_hash is None:
+                entry.topology_hash = digest;
+        return digest;
+
+    def geometryGeneration(self, mesh_fn: om2.MFnMesh) -> int:
+        # メッシュの形状の世代番号（頂点の移動・変形・トポロジーの変更で変わる）。結果を再利用してよいかの判定に使う
+        # 変更を検知できないメッシュ（DAGパスが無い、コールバックの登録前）は呼ぶたびに新しい値を返す = 再利用させない
+        with self.lock:
+            entry = self.entry(mesh_fn);
+            if entry is None or entry.watching == False:
+                return self.nextGeneration();
+            return entry.generation;
+
+    def nextGeneration(self) -> int:
+        self.generation += 1;
+        return self.generation;
+
+    #######################################################################################
+    ## キャッシュの管理
+
+    def fetch(self, mesh_fn: om2.MFnMesh, name: str, read):
+        # キャッシュ済みの配列を返す（無ければread()で読み込んで登録する）。キャッシュの対象外のメッシュの場合はNone
+        # read()はロックの外で呼ぶので、大きなメッシュを読んでいる間も他のメッシュ・他の配列の取得は待たない
+        with self.lock:
+            entry = self.entry(mesh_fn);
+            if entry is None:
+                return None;
+            if name in kPointKeys and entry.watching == False: # ダーティを検知できないので読み込むだけにする
+                return None;
+            value = entry.arrays.get(name);
+            if value is not None:
+                self.hits += 1;
+                return value;
+            self.misses += 1;
+            generation = entry.generation;
+
+        value = read();
+        value = tuple(readOnly(v) for v in value) if isinstance(value, tuple) else readOnly(value);
+        with self.lock:
+            if self.isCurrent(entry) == False: # 読み込んでいる間にトポロジーの変更などで破棄された
+                return value;
+            if name in kPointKeys and entry.generation != generation: # 読み込んでいる間に変形された（読んだ値が古い可能性がある）
+                return value;
+            stored = entry.arrays.get(name);
+            if stored is not None: # 他のスレッドが先に登録した
+                return stored;
+            self.store(entry, name, value);
+            return value;
+
+    def isCurrent(self, entry: MeshCacheEntry) -> bool:
+        # エントリーがまだ破棄されていないか
+        return self.entries.get(entry.key) is entry;
+
+    def entry(self, mesh_fn: om2.MFnMesh) -> MeshCacheEntry:
+        # メッシュのエントリーを返して最近使ったことにする（トポロジーが変わっていた場合は作り直す）
+        try:
+            shape_path = mesh_fn.getPath();
+        except RuntimeError: # DAGパスが無いメッシュデータ
+            return None;
+        handle = om2.MObjectHandle(shape_path.node());
+        key = handle.hashCode();
+        topology_counts = topologyCounts(mesh_fn);
+        entry = self.entries.get(key);
+        if entry is not None and ( entry.handle.isValid() == False or entry.handle.object() != handle.object() or entry.topology_counts != topology_counts ):
+            self.remove(key);
+            entry = None;
+        if entry is None:
+            entry = MeshCacheEntry(key, handle, topology_counts, self.nextGeneration());
+            self.entries[key] = entry;
+            if threading.current_thread() is threading.main_thread():
+                self.watch(key, entry);
+            else:
+                maya.utils.executeDeferred(self.watch, key, entry);
+        self.entries.move_to_end(key);
+        return entry;
+
+    def store(self, entry: MeshCacheEntry, name: str, value):
+        entry.arrays[name] = value;
+        self.evict(keep=entry);
+
+    def evict(self, keep: MeshCacheEntry = None):
+        # 合計サイズが上限に収まるまで、最後に使ってから時間が経ったメッシュから破棄する（使用中のメッシュは残す）
+        total = sum(entry.nbytes() for entry in self.entries.values());
+        for key in list(self.entries.keys()):
+            if total <= self.max_bytes:
+                break;
+            entry = self.entries[key];
+            if entry is keep:
+                continue;
+            total -= entry.nbytes();
+            self.remove(key);
+
+    def remove(self, key: int):
+        # コールバックの削除はメインスレッドで行う（プレビューのスレッドからの破棄は削除をメインスレッドに回す）
+        entry = self.entries.pop(key, None);
+        if entry is None or len(entry.callback_ids) == 0:
+            return;
+        callback_ids, entry.callback_ids = entry.callback_ids, [];
+        if threading.current_thread() is threading.main_thread():
+            om2.MMessage.removeCallbacks(callback_ids);
+        else:
+            maya.utils.executeDeferred(om2.MMessage.removeCallbacks, callback_ids);
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries.keys()):
+                self.remove(key);
+
+    def discard(self, name: str):
+        # 全メッシュから指定した種類の配列だけを破棄する（ディスクのキャッシュを削除する前にマップを外す）
+        with self.lock:
+            for entry in self.entries.values():
+                entry.arrays.pop(name, None);
+
+    def setMaxBytes(self, max_bytes: int):
+        with self.lock:
+            self.max_bytes = max_bytes;
+            self.evict();
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"meshes": len(self.entries), "bytes": sum(entry.nbytes() for entry in self.entries.values()), "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses};
+
+    #######################################################################################
+    ## コールバック
+
+    def watch(self, key: int, entry: MeshCacheEntry):
+        # メインスレッドでコールバックを登録する（登録までに破棄されたエントリーは何もしない）
+        with self.lock:
+            if self.entries.get(key) is not entry or entry.watching or entry.handle.isValid() == False:
+                return;
+            shape_obj = entry.handle.object();
+            entry.callback_ids = [
+                om2.MNodeMessage.addNodeDirtyCallback(shape_obj, self.onNodeDirty, key),
+                om2.MPolyMessage.addPolyTopologyChangedCallback(shape_obj, self.onTopologyChanged, key),
+                om2.MNodeMessage.addNodeAboutToDeleteCallback(shape_obj, self.onAboutToDelete, key),
+            ];
+            entry.watching = True;
+
+    def onNodeDirty(self, node: om2.MObject, key: int):
+        # 変形・頂点の移動：頂点の座標と法線だけを破棄する（トポロジーの配列は残す）
+        with self.lock:
+            entry = self.entries.get(key);
+            if entry is not None:
+                entry.generation = self.nextGeneration();
+                for name in kPointKeys:
+                    entry.arrays.pop(name, None);
+
+    def onTopologyChanged(self, node: om2.MObject, key: int):
+        # トポロジーの変更：全ての配列を破棄する
+        with self.lock:
+            self.remove(key);
+
+    def onAboutToDelete(self, node: om2.MObject, dg_modifier: om2.MDGModifier, key: int):
+        with self.lock:
+            self.remove(key);
+
+    #######################################################################################
+
+    def worldMatrix(self, mesh_fn: om2.MFnMesh, space: om2.MSpace) -> np.ndarray:
+        # ワールド空間の場合はシェイプのワールド行列を(4,4)の配列で返す（オブジェクト空間の場合はNone）
+        if space != om2.MSpace.kWorld:
+            return None;
+        return np.array(mesh_fn.getPath().inclusiveMatrix(), dtype=np.float64).reshape(4, 4);
+
+###################################################################################################################################
+## メッシュから直接読み込む関数（キャッシュを通さない）
+
+def readPoints(mesh_fn: om2.MFnMesh, space: om2.MSpace = om2.MSpace.kWorld) -> np.ndarray:
+    return np.array(mesh_fn.getPoints(space), dtype=np.float64)[:, :3];
+
+def readNormals(mesh_fn: om2.MFnMesh, space: om2.MSpace = om2.MSpace.kWorld) -> np.ndarray:
+    return np.array(mesh_fn.getNormals(space), dtype=np.float64);
+
+def readEdgeVertices(mesh_fn: om2.MFnMesh, edge_ids: np.ndarray) -> np.ndarray:
+    get_edge_vertices = mesh_fn.getEdgeVertices;
+    return np.array([get_edge_vertices(int(e)) for e in edge_ids], dtype=np.int64).reshape(-1, 2);
+
+def readFaceVertices(mesh_fn: om2.MFnMesh) -> tuple:
+    face_counts, face_vertices = mesh_fn.getVertices();
+    face_counts = np.array(face_counts, dtype=np.int64);
+    return (face_counts, TKCM_ChainMath.faceOffsets(face_counts), np.array(face_vertices, dtype=np.int64));
+
+###################################################################################################################################
+## プラグインから使う共有のキャッシュ
+
+_mesh_cache = MeshCache();
+
+def getMeshCache() -> MeshCache:
+    return _mesh_cache;
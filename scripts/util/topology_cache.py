@@ -0,0 +1,179 @@
+###################################################################################################################################
+###################################################################################################################################
+# モジュール
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+# 自前のモジュール
+import util.chain_math as TKCM_ChainMath
+###################################################################################################################################
+###################################################################################################################################
+## メッシュの隣接関係をディスクに保存するキャッシュ（Mayaに依存しないのでmayapyのバッチ処理からも使える）
+## - キーはフェースの頂点リスト(CSR)のハッシュ（同じトポロジーのメッシュなら別のシーンやセッションでも同じキーになる）
+## - 1つのキーにつき1つのディレクトリに meta.json と配列ごとの .npy を保存し、読み込みは mmap_mode='r' でコピーせずにマップする
+## - キャッシュのディレクトリは環境変数 TKCM_CJOMC_TOPOLOGY_CACHE か setCacheDir() で指定する（指定が無い場合は使わない）
+
+kCacheDirEnv = "TKCM_CJOMC_TOPOLOGY_CACHE"
+kFormatVersion = 1 # 保存する配列の内容を変えた場合は上げる（古いエントリーは読み込み時に作り直す）
+kMetaFileName = "meta.json"
+kAdjacencyArrays = ("face_offsets", "edges", "vertex_indptr", "vertex_indices")
+kHashDigestSize = 20
+kEntryNamePattern = re.compile(r"^[0-9a-f]{%d}$" % ( kHashDigestSize * 2 ))         # エントリーのディレクトリ名（topologyHash()）
+kTempNamePattern = re.compile(r"^[0-9a-f]{%d}\..+\.tmp$" % ( kHashDigestSize * 2 )) # 書き込み中の一時ディレクトリ名（saveEntry()）
+
+_cache_dir = None
+
+def setCacheDir(path: str):
+    # キャッシュのディレクトリを指定する（Noneの場合は環境変数の値に戻す、空文字の場合は使わない）
+    global _cache_dir
+    _cache_dir = path
+
+def getCacheDir() -> str:
+    # 使用するキャッシュのディレクトリ（キャッシュを使わない場合はNone）
+    path = _cache_dir if _cache_dir is not None else os.environ.get(kCacheDirEnv, "")
+    return path if len(path) > 0 else None
+
+def topologyHash(face_counts: np.ndarray, face_vertices: np.ndarray) -> str:
+    # フェースごとの頂点数と頂点IDリストのハッシュ（環境で整数の型が違っても同じ値になるようにint64にしてから計算する）
+    hasher = hashlib.blake2b(digest_size=kHashDigestSize)
+    hasher.update(np.ascontiguousarray(face_counts, dtype='<i8').tobytes())
+    hasher.update(np.ascontiguousarray(face_vertices, dtype='<i8').tobytes())
+    return hasher.hexdigest()
+
+def compactIndices(array: np.ndarray) -> np.ndarray:
+    # インデックスの配列を値が収まる範囲でint32にする（ディスクとメモリの使用量を半分にする）
+    if len(array) == 0 or int(array.max()) < np.iinfo(np.int32).max:
+        return array.astype(np.int32)
+    return array.astype(np.int64)
+
+###################################################################################################################################
+## 隣接関係
+
+def buildAdjacency(face_counts: np.ndarray, face_vertices: np.ndarray, vertex_count: int) -> dict:
+    # フェースのオフセット・メッシュの全エッジ・頂点の隣接リスト(CSR)を作る
+    face_offsets = TKCM_ChainMath.faceOffsets(face_counts)
+    edges = TKCM_ChainMath.meshEdgesFromFaces(face_counts, face_offsets, face_vertices)
+    vertex_indptr, vertex_indices = TKCM_ChainMath.adjacencyCSR(edges.reshape(-1, 2), vertex_count)
+    return {"face_offsets": face_offsets, "edges": compactIndices(edges), "vertex_indptr": vertex_indptr, "vertex_indices": compactIndices(vertex_indices)}
+
+def meshAdjacency(face_counts: np.ndarray, face_vertices: np.ndarray, vertex_count: int, key: str = None) -> [np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # ディスクのキャッシュがあればマップして返し、無ければ作成して保存する（キャッシュを使わない場合は作成するだけ）
+    # key: 計算済みのtopologyHash()（省略した場合はここで計算する）
+    # 戻り値: [face_offsets, edges(E,2), vertex_indptr, vertex_indices]
+    cache_dir = getCacheDir()
+    if cache_dir is None:
+        arrays = buildAdjacency(face_counts, face_vertices, vertex_count)
+        return [arrays[name] for name in kAdjacencyArrays]
+
+    if key is None:
+        key = topologyHash(face_counts, face_vertices)
+    counts = {"vertices": int(vertex_count), "faces": int(len(face_counts)), "face_vertices": int(len(face_vertices))}
+    arrays = loadEntry(cache_dir, key, counts)
+    if arrays is None:
+        arrays = buildAdjacency(face_counts, face_vertices, vertex_count)
+        saveEntry(cache_dir, key, counts, arrays)
+    return [arrays[name] for name in kAdjacencyArrays]
+
+###################################################################################################################################
+## エントリーの読み書き
+
+def entryPath(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, key)
+
+def readMeta(path: str) -> dict:
+    try:
+        with open(os.path.join(path, kMetaFileName), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def isStale(path: str, meta: dict, counts: dict = None) -> bool:
+    # フォーマットのバージョン・メッシュの要素数・配列のファイルが保存した時と一致しない場合は古いエントリーとみなす
+    if meta is None or meta.get("version") != kFormatVersion:
+        return True
+    if counts is not None and meta.get("counts") != counts:
+        return True
+    for name, info in meta.get("arrays", {}).items():
+        file_path = os.path.join(path, name + ".npy")
+        if os.path.isfile(file_path) == False or os.path.getsize(file_path) != info.get("file_bytes"):
+            return True
+    return set(meta.get("arrays", {}).keys()) != set(kAdjacencyArrays)
+
+def loadEntry(cache_dir: str, key: str, counts: dict) -> dict:
+    # 保存済みのエントリーを読み込み専用でマップする（古いエントリーは削除してNoneを返す）
+    path = entryPath(cache_dir, key)
+    if os.path.isdir(path) == False:
+        return None
+    meta = readMeta(path)
+    if isStale(path, meta, counts):
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+    try:
+        arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode='r', allow_pickle=False) for name in kAdjacencyArrays}
+    except (OSError, ValueError):
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+    os.utime(os.path.join(path, kMetaFileName)) # purge(older_than_days)で最後に使った日時として使う
+    return arrays
+
+def saveEntry(cache_dir: str, key: str, counts: dict, arrays: dict):
+    # 一時ディレクトリに書き出してから名前を変えるので、書き込み中のエントリーを他のプロセスが読むことは無い
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = tempfile.mkdtemp(prefix=key + ".", suffix=".tmp", dir=cache_dir)
+        meta = {"version": kFormatVersion, "key": key, "counts": counts, "created": time.time(), "arrays": {}}
+        for name in kAdjacencyArrays:
+            file_path = os.path.join(temp_path, name + ".npy")
+            np.save(file_path, np.ascontiguousarray(arrays[name]), allow_pickle=False)
+            meta["arrays"][name] = {"shape": list(arrays[name].shape), "dtype": str(arrays[name].dtype), "file_bytes": os.path.getsize(file_path)}
+        with open(os.path.join(temp_path, kMetaFileName), "w") as f:
+            json.dump(meta, f)
+        try:
+            os.replace(temp_path, entryPath(cache_dir, key))
+        except OSError: # 他のプロセスが先に同じエントリーを保存した
+            shutil.rmtree(temp_path, ignore_errors=True)
+    except OSError:
+        pass # ディスクに書けない場合はキャッシュせずに続ける
+
+###################################################################################################################################
+## 削除
+
+def purge(older_than_days: float = -1.0, stale_only: bool = False, cache_dir: str = None) -> [int, int]:
+    # キャッシュのエントリーを削除する（キャッシュの名前のディレクトリ以外には触れないので、キャッシュ以外のディレクトリを指定しても何も消さない）
+    # older_than_days: 最後に使ってからこの日数を超えたエントリーだけを削除する（負の値の場合は日数で絞らない）
+    # stale_only: 古いフォーマットや壊れたエントリー（書き込み途中の一時ディレクトリを含む）だけを削除する
+    # 戻り値: [削除したエントリー数, 削除したバイト数]（マップ中などで削除できなかったエントリーは数えない）
+    cache_dir = getCacheDir() if cache_dir is None else cache_dir
+    if cache_dir is None or os.path.isdir(cache_dir) == False:
+        return [0, 0]
+    removed, removed_bytes = 0, 0
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isdir(path) == False or os.path.islink(path):
+            continue
+        if kTempNamePattern.match(name):
+            stale = True
+        elif kEntryNamePattern.match(name):
+            meta = readMeta(path)
+            if meta is None or meta.get("key") != name: # このキャッシュが書いたエントリーではない
+                continue
+            stale = isStale(path, meta)
+        else:
+            continue
+        if stale_only and stale == False:
+            continue
+        if older_than_days >= 0.0 and stale == False and now - os.path.getmtime(os.path.join(path, kMetaFileName)) <= older_than_days * 86400.0:
+            continue
+        entry_bytes = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+        shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(path) == False:
+            removed += 1
+            removed_bytes += entry_bytes
+    return [removed, removed_bytes]
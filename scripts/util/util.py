@@ -34,23 +34,19 @@ def selectedComponentType(selection_list: om2.MSelectionList, id: int) -> MeshCo
     else:
         return MeshCompType.kNon;
 
+# MeshCompTypeに対応するコンポーネントのMFnタイプ
+kComponentFnTypes = {
+    MeshCompType.kVertex: om2.MFn.kMeshVertComponent,
+    MeshCompType.kEdge: om2.MFn.kMeshEdgeComponent,
+    MeshCompType.kFace: om2.MFn.kMeshPolygonComponent,
+}
+
 def getSelectedComponentIds(selection_list: om2.MSelectionList, id: int, orderedSelection: bool =False) -> om2.MIntArray:
     if orderedSelection:
-        orderedIDs = om2.MIntArray();
-        sel_comp_str = str( mel.eval("ls -orderedSelection -flatten") );
-
-        p = Literal;
-        comp_type = selectedComponentType(selection_list, id);
-        for s in sel_comp_str.split(", "):
-            if comp_type == MeshCompType.kVertex:
-                p = r'vtx\[(.*)\]\'';
-            elif comp_type == MeshCompType.kEdge:
-                p = r'e\[(.*)\]\'';
-            elif comp_type == MeshCompType.kFace:
-                p = r'f\[(.*)\]\'';
-            m = re.findall(p, s); #大カッコ[]の間の文字列を取得する
-            orderedIDs.append(int(str(m[0])));
-        return orderedIDs;
+        # 選択順のリストから対象メッシュの同じタイプのコンポーネントだけを取り出す
+        dag_path, _ = selection_list.getComponent (id);
+        ordered_list = om2.MGlobal.getActiveSelectionList(True);
+        return getOrderedComponentIds(ordered_list, dag_path, selectedComponentType(selection_list, id));
     else:
         if selectedComponentType(selection_list, id) == -1:
             return om2.MIntArray(0);
@@ -58,6 +54,44 @@ def getSelectedComponentIds(selection_list: om2.MSelectionList, id: int, ordered
             _, comp_obj = selection_list.getComponent (id);
             comp_id_array = om2.MFnSingleIndexedComponent(comp_obj);
             return comp_id_array.getElements();
+
+def getOrderedComponentIds(ordered_list: om2.MSelectionList, dag_path: om2.MDagPath, comp_type: MeshCompType) -> om2.MIntArray:
+    # 選択順のリスト(MGlobal.getActiveSelectionList(True))の要素を順に処理してコンポーネントIDを1つの配列にまとめる
+    # 文字列化やflattenは行わず、範囲選択（vtx[0:9]など）はコンポーネントから直接展開する
+    if comp_type not in kComponentFnTypes:
+        return om2.MIntArray();
+    comp_fn_type = kComponentFnTypes[comp_type]; # ループ内でコンポーネントタイプを毎回判定しないように先に決めておく
+    shape_obj = om2.MDagPath(dag_path).extendToShape().node();
+    ordered_ids = [];
+    for i in range(ordered_list.length()):
+        try:
+            item_path, comp_obj = ordered_list.getComponent(i);
+        except RuntimeError: # コンポーネント以外（DGノードなど）は対象外
+            continue;
+        if comp_obj.isNull() or comp_obj.hasFn(comp_fn_type) == False:
+            continue;
+        if item_path.extendToShape().node() != shape_obj:
+            continue;
+        ordered_ids.extend(om2.MFnSingleIndexedComponent(comp_obj).getElements());
+    return om2.MIntArray(ordered_ids);
+
+# 従来の文字列を解析する方法で選択順のコンポーネントIDを取得する（getOrderedComponentIds()との比較用）
+def getOrderedComponentIdsFromString(selection_list: om2.MSelectionList, id: int) -> om2.MIntArray:
+    orderedIDs = om2.MIntArray();
+    sel_comp_str = str( mel.eval("ls -orderedSelection -flatten") );
+
+    p = Literal;
+    comp_type = selectedComponentType(selection_list, id);
+    for s in sel_comp_str.split(", "):
+        if comp_type == MeshCompType.kVertex:
+            p = r'vtx\[(.*)\]\'';
+        elif comp_type == MeshCompType.kEdge:
+            p = r'e\[(.*)\]\'';
+        elif comp_type == MeshCompType.kFace:
+            p = r'f\[(.*)\]\'';
+        m = re.findall(p, s); #大カッコ[]の間の文字列を取得する
+        orderedIDs.append(int(str(m[0])));
+    return orderedIDs;
         
 
 class MatrixType(Enum):
@@ -131,6 +165,14 @@ def toMelString(val) -> str:
     tbl = str.maketrans({'(': '', ',': '', ')': ' '}); # 変換テーブルを作成する
     return str(val).translate(tbl);
 
+def toMPointArray(array) -> om2.MPointArray:
+    # (N,3)の配列をMPointArrayに変換する
+    return om2.MPointArray(array.tolist() if hasattr(array, 'tolist') else array);
+
+def toMVectorArray(array) -> om2.MVectorArray:
+    # (N,3)の配列をMVectorArrayに変換する
+    return om2.MVectorArray(array.tolist() if hasattr(array, 'tolist') else array);
+
 def toDeg3(radian: om2.MEulerRotation) ->(float, float, float):
     return (math.degrees(radian.x), math.degrees(radian.y), math.degrees(radian.z));
 
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# プラグインと同じように scripts を import のルートにする（util.chain_math, tools.* など）
+kScriptsDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+if kScriptsDir not in sys.path:
+    sys.path.insert(0, kScriptsDir)
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+
+import numpy as np
+import pytest
+
+import util.chain_math as TKCM_ChainMath
+import tools.maya_stand_in as TKCM_MayaStandIn
+import tools.create_joints_on_mesh_components_batch as TKCM_Batch
+
+###################################################################################################################################
+## tools.maya_stand_in を使ってMaya無しでバッチ処理を確認する
+
+@pytest.fixture
+def stand_in():
+    # 代わりのmayaモジュールをテストの間だけ登録する
+    saved = {name: module for name, module in sys.modules.items() if name == "maya" or name.startswith("maya.")}
+    del TKCM_MayaStandIn.calls[:]
+    TKCM_Batch._maya_initialized = False
+    yield TKCM_MayaStandIn
+    for name in [name for name in sys.modules if name == "maya" or name.startswith("maya.")]:
+        del sys.modules[name]
+    sys.modules.update(saved)
+    TKCM_Batch._maya_initialized = False
+
+def straight_chain(count: int = 11, length: float = 10.0) -> dict:
+    pos = np.stack([np.linspace(0.0, length, count), np.zeros(count), np.zeros(count)], axis=1)
+    return {"points": pos.tolist(), "normals": np.tile([0.0, 1.0, 0.0], (count, 1)).tolist(), "offsets": [0, count]}
+
+def write_scene(path, size: int) -> str:
+    path.write_text("//Maya ASCII\n" + "//\n" * size)
+    return str(path)
+
+###################################################################################################################################
+
+def test_failed_job_does_not_stop_others(tmp_path):
+    spec = {"jobs": [
+        {"name": "good", "scene": write_scene(tmp_path / "good.ma", 10), "output": str(tmp_path / "out.ma"), "runs": [{"chain": ["pSphere1.e[1] pSphere1.e[2]"], "createType": 1}]},
+        {"name": "missing", "scene": str(tmp_path / "missing.ma"), "runs": [{}]},
+        {"name": "plan", "arrays": straight_chain(), "options": {"createType": 1, "createCount": 3}},
+        {"name": "short", "arrays": {"points": [[0.0, 0.0, 0.0]] * 3, "normals": [[0.0, 1.0, 0.0]] * 3, "offsets": [0, 2, 3]}},
+    ]}
+    results = TKCM_Batch.run_jobs(spec, workers=2, stand_in=True)
+    assert [result["name"] for result in results] == ["good", "missing", "plan", "short"]
+    assert [result["status"] for result in results] == ["ok", "failed", "ok", "failed"]
+    assert results[0]["result"]["runs"][0]["result"] == ["joint1"]
+    assert "File not found" in results[1]["error"]
+    assert "at least 2 points" in results[3]["error"]
+    assert results[2]["result"]["joints"] == 5
+    assert all(result["wall_sec"] >= result["sec"] for result in results)
+
+def test_main_reports_failures(tmp_path):
+    spec_path = tmp_path / "jobs.json"
+    report_path = tmp_path / "report.json"
+    spec_path.write_text(json.dumps({"jobs": [{"name": "good", "arrays": straight_chain()}, {"name": "missing", "scene": str(tmp_path / "missing.ma"), "runs": [{}]}]}))
+    assert TKCM_Batch.main([str(spec_path), "--stand-in", "--workers", "2", "--report", str(report_path)]) == 1
+    assert [result["status"] for result in json.loads(report_path.read_text())] == ["ok", "failed"]
+
+    spec_path.write_text(json.dumps({"jobs": [{"name": "good", "arrays": straight_chain()}]}))
+    assert TKCM_Batch.main([str(spec_path), "--stand-in"]) == 0
+
+@pytest.mark.skipif(os.name == "nt", reason="uses a shell script as the worker interpreter")
+def test_timeout_is_isolated(tmp_path):
+    slow = tmp_path / "slow.sh"
+    slow.write_text("#!/bin/sh\nsleep 10\n")
+    slow.chmod(0o755)
+    spec = {"jobs": [{"name": "a", "arrays": straight_chain()}, {"name": "b", "arrays": straight_chain()}]}
+    results = TKCM_Batch.run_jobs(spec, workers=2, timeout=0.5, python=str(slow))
+    assert [result["status"] for result in results] == ["timeout", "timeout"]
+    assert all(result["sec"] < 5.0 for result in results)
+
+@pytest.mark.skipif(os.name == "nt", reason="uses a shell script as the worker interpreter")
+def test_worker_crash_is_isolated(tmp_path):
+    # 結果を書く前に終了したワーカーは失敗として記録する
+    crash = tmp_path / "crash.sh"
+    crash.write_text("#!/bin/sh\nexit 3\n")
+    crash.chmod(0o755)
+    spec = {"jobs": [{"name": "a", "arrays": straight_chain()}]}
+    result = TKCM_Batch.run_jobs(spec, python=str(crash))[0]
+    assert result["status"] == "failed"
+    assert result["error"] == "worker exited with code 3"
+
+def test_largest_scene_first(tmp_path, stand_in):
+    small = write_scene(tmp_path / "small.ma", 10)
+    large = write_scene(tmp_path / "large.ma", 1000)
+    medium = write_scene(tmp_path / "medium.ma", 100)
+    jobs = [{"arrays": straight_chain()}, {"scene": small, "runs": []}, {"scene": large, "runs": []}, {"scene": medium, "runs": []}]
+    assert TKCM_Batch.schedule_order(jobs) == [2, 3, 1, 0]
+
+    results = TKCM_Batch.run_jobs({"jobs": jobs}, stand_in=True, in_process=True)
+    assert [result["status"] for result in results] == ["ok"] * 4
+    opened = [args[0] for name, args, kwargs in stand_in.calls if name == "file" and kwargs.get("open")]
+    assert opened == [large, medium, small]
+
+def test_scene_job_flags(tmp_path, stand_in):
+    scene = write_scene(tmp_path / "scene.ma", 1)
+    job = {"scene": scene, "output": str(tmp_path / "out.mb"), "options": {"createType": 2}, "runs": [{"chain": ["a.vtx[0] a.vtx[1]"], "createCount": 4}]}
+    result = TKCM_Batch.run_jobs({"defaults": {"createType": 1, "createCount": 9, "axisType": 0}, "jobs": [job]}, stand_in=True, in_process=True)[0]
+    assert result["status"] == "ok"
+    commands = [kwargs for name, args, kwargs in stand_in.calls if name == "createJointsOnMeshComponents"]
+    assert commands == [{"createType": 2, "createCount": 4, "axisType": 0, "chain": ["a.vtx[0] a.vtx[1]"]}]
+    saves = [kwargs for name, args, kwargs in stand_in.calls if name == "file" and kwargs.get("save")]
+    assert saves[0]["type"] == "mayaBinary"
+
+###################################################################################################################################
+## 配列のジョブ
+
+def test_compute_plan_evenly():
+    chain = straight_chain()
+    plan = TKCM_Batch.compute_plan(chain["points"], chain["normals"], chain["offsets"], {"createType": 1, "createCount": 3})
+    np.testing.assert_allclose(plan.joint_pos[:, 0], [0.0, 2.5, 5.0, 7.5, 10.0], atol=1.0e-12)
+    assert plan.parent_ids.tolist() == [-1, 0, 1, 2, 3]
+    # axisType=3(XY)の既定値では、X軸がチェインの向き・Y軸が法線
+    np.testing.assert_allclose(plan.frames[0], np.eye(3), atol=1.0e-12)
+    np.testing.assert_allclose(plan.local_rad, 0.0, atol=1.0e-12)
+
+def test_compute_plan_matches_chain_math():
+    rng = np.random.default_rng(0)
+    pos = np.cumsum(rng.normal(size=(30, 3)), axis=0)
+    nml = TKCM_ChainMath.normalizeRows(rng.normal(size=(30, 3)))
+    offsets = np.array([0, 12, 30])
+    options = {"createType": 4, "spacing": 0.8, "axisType": 1, "createRootjoint": False, "frameType": 1, "normalBlend": 0.3, "jointName": "ignored"}
+    plan = TKCM_Batch.compute_plan(pos, nml, offsets, options)
+    s_pos, s_nml, s_offsets, error = TKCM_ChainMath.resampleChains(pos, nml, offsets, 4, 0, spacing=0.8)
+    ref = TKCM_ChainMath.JointChainPlan((), s_pos, s_nml, s_offsets, 1, False, False, False, True, 1, 0.3, error)
+    np.testing.assert_allclose(plan.joint_pos, ref.joint_pos)
+    np.testing.assert_allclose(plan.local_rad, ref.local_rad)
+    assert plan.joint_offsets.tolist() == ref.joint_offsets.tolist()
+
+@pytest.mark.parametrize("offsets, options, message", [
+    ([0, 1, 11], {}, "at least 2 points"),
+    ([0, 5], {}, "offsets must"),
+    ([0, 11], {"createType": 4, "spacing": 0.0}, "spacing"),
+    ([0, 11], {"createType": 1, "createCount": -1}, "createCount"),
+])
+def test_compute_plan_rejects_invalid_input(offsets, options, message):
+    chain = straight_chain()
+    with pytest.raises(ValueError, match=message):
+        TKCM_Batch.compute_plan(chain["points"], chain["normals"], offsets, options)
+
+def test_array_job_writes_plan(tmp_path):
+    chain = straight_chain()
+    arrays_path = tmp_path / "chains.npz"
+    np.savez(arrays_path, points=np.array(chain["points"]), normals=np.array(chain["normals"]), offsets=np.array(chain["offsets"]))
+    output = tmp_path / "plan.npz"
+    result = TKCM_Batch.run_job({"arrays": str(arrays_path), "output": str(output), "options": {"createType": 4, "spacing": 3.0}}, {}, TKCM_Batch.kDefaultPlugin)
+    assert result["status"] == "ok"
+    assert result["result"]["joints"] == 5
+    with np.load(output) as data:
+        assert sorted(data.files) == ["frames", "joint_offsets", "joint_pos", "local_rad", "parent_ids"]
+        np.testing.assert_allclose(data["joint_pos"][:, 0], [0.0, 3.0, 6.0, 9.0, 10.0])
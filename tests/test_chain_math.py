@@ -0,0 +1,558 @@
+import bisect
+
+import numpy as np
+import pytest
+
+import util.chain_math as TKCM_ChainMath
+
+###################################################################################################################################
+## テスト用のデータと、一括処理に置き換える前のループによる実装
+
+def helix(count: int, turns: float = 1.5, height: float = 4.0, radius: float = 1.0) -> np.ndarray:
+    t = np.linspace(0.0, turns * 2.0 * np.pi, count)
+    return np.stack([np.cos(t) * radius, np.sin(t) * radius, np.linspace(0.0, height, count)], axis=1)
+
+def noisy_normals(count: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return TKCM_ChainMath.normalizeRows(np.array([0.0, 0.0, 1.0]) + rng.normal(scale=0.3, size=(count, 3)))
+
+def two_chains():
+    pos_a, pos_b = helix(23), helix(41, turns=0.7, height=2.0) + np.array([5.0, 0.0, 0.0])
+    nml_a, nml_b = noisy_normals(23, 1), noisy_normals(41, 2)
+    return [(pos_a, nml_a), (pos_b, nml_b)]
+
+def grid_mesh(size: int) -> [np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # size x size 個の四角形のメッシュ（頂点IDは行ごとに (size+1) 個）
+    v = np.arange(( size + 1 ) ** 2).reshape(size + 1, size + 1)
+    quads = np.stack([v[:-1, :-1], v[:-1, 1:], v[1:, 1:], v[1:, :-1]], axis=-1).reshape(-1, 4)
+    face_counts = np.full(len(quads), 4)
+    return [v, face_counts, TKCM_ChainMath.faceOffsets(face_counts), quads.ravel()]
+
+def baseline_evenly(div_count: int, pos: np.ndarray, nml: np.ndarray) -> [np.ndarray, np.ndarray]:
+    # 元のRecomputeIntervalPosAndNml()（累積距離を二分探索して1点ずつ補間する）
+    length_pack = [0.0]
+    for i in range(len(pos) - 1):
+        length_pack.append(length_pack[-1] + float(np.linalg.norm(pos[i + 1] - pos[i])))
+    e = length_pack[-1] / ( div_count + 1 )
+    out_pos, out_nml = [pos[0]], [nml[0]]
+    for i in range(1, div_count + 1):
+        tree_i = min(bisect.bisect_right(length_pack, e * i) - 1, len(length_pack) - 2)
+        t = ( e * i - length_pack[tree_i] ) / ( length_pack[tree_i + 1] - length_pack[tree_i] )
+        out_pos.append(pos[tree_i] + ( pos[tree_i + 1] - pos[tree_i] ) * t)
+        out_nml.append(nml[tree_i] + ( nml[tree_i + 1] - nml[tree_i] ) * t)
+    out_pos.append(pos[-1])
+    out_nml.append(nml[-1])
+    return [np.array(out_pos), np.array(out_nml)]
+
+def baseline_double_reflection(pos: np.ndarray, dir: np.ndarray, nml: np.ndarray) -> np.ndarray:
+    # ダブルリフレクション法を1区間ずつ適用する
+    r = nml[0] - np.dot(nml[0], dir[0]) * dir[0]
+    ups = [r / np.linalg.norm(r)]
+    for i in range(1, len(pos)):
+        v1 = pos[i] - pos[i - 1]
+        c1 = np.dot(v1, v1)
+        r_l = ups[-1] - ( 2.0 / c1 ) * np.dot(v1, ups[-1]) * v1
+        t_l = dir[i - 1] - ( 2.0 / c1 ) * np.dot(v1, dir[i - 1]) * v1
+        v2 = dir[i] - t_l
+        c2 = np.dot(v2, v2)
+        r = r_l - ( 2.0 / c2 ) * np.dot(v2, r_l) * v2 if c2 > 1.0e-20 else r_l
+        ups.append(r / np.linalg.norm(r))
+    return np.array(ups)
+
+def baseline_frame(direction: np.ndarray, upvector: np.ndarray, axis_type: int, aim_neg: bool, up_neg: bool) -> np.ndarray:
+    # 元のquaternionFromDirectionAndUpvector()の回転行列（行がX,Y,Z軸）
+    unit = lambda v: v / np.linalg.norm(v)
+    v0 = -unit(direction) if aim_neg else unit(direction)
+    v1 = unit(np.cross(np.cross(v0, unit(upvector)), v0)) * ( -1.0 if up_neg else 1.0 )
+    v2 = unit(np.cross(v1, v0))
+    axes = {0: (v2, v1, v0), 1: (v1, -v2, v0), 2: (v0, v2, v1), 3: (v0, v1, -v2), 4: (v1, v0, v2), 5: (-v2, v0, v1)}[axis_type]
+    return np.array(axes)
+
+def baseline_douglas_peucker(pos: np.ndarray, first: int, last: int, tolerance: float, keep: np.ndarray):
+    if last - first < 2:
+        return
+    interior = np.arange(first + 1, last)
+    dist = TKCM_ChainMath.pointSegmentDistances(pos[interior], np.repeat(pos[first][None], len(interior), 0), np.repeat(pos[last][None], len(interior), 0))
+    split = int(np.argmax(dist))
+    if dist[split] > tolerance:
+        keep[interior[split]] = True
+        baseline_douglas_peucker(pos, first, interior[split], tolerance, keep)
+        baseline_douglas_peucker(pos, interior[split], last, tolerance, keep)
+
+def euler_xyz_matrix(rad: np.ndarray) -> np.ndarray:
+    # 回転順序XYZのEulerから回転行列（Mayaと同じ行ベクトル形式）を作る
+    cx, sx, cy, sy, cz, sz = np.cos(rad[0]), np.sin(rad[0]), np.cos(rad[1]), np.sin(rad[1]), np.cos(rad[2]), np.sin(rad[2])
+    rot_x = np.array([[1.0, 0.0, 0.0], [0.0, cx, sx], [0.0, -sx, cx]])
+    rot_y = np.array([[cy, 0.0, -sy], [0.0, 1.0, 0.0], [sy, 0.0, cy]])
+    rot_z = np.array([[cz, sz, 0.0], [-sz, cz, 0.0], [0.0, 0.0, 1.0]])
+    return rot_x @ rot_y @ rot_z
+
+def mixed_mesh(offset: float = 0.0) -> [np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # 三角形・四角形（1つは平面ではない）・五角形・六角形が混ざったメッシュ
+    rng = np.random.default_rng(7)
+    points = rng.uniform(-1.0, 1.0, size=(16, 3)) + offset
+    face_vertices = np.array([0, 1, 2,  2, 1, 3, 4,  5, 6, 7, 8, 9,  10, 11, 12, 13, 14, 15,  3, 7, 11, 15])
+    face_counts = np.array([3, 4, 5, 6, 4])
+    return [points, face_counts, TKCM_ChainMath.faceOffsets(face_counts), face_vertices]
+
+def baseline_face_pos_and_nml(face_ids: np.ndarray, points: np.ndarray, face_counts: np.ndarray, face_offsets: np.ndarray, face_vertices: np.ndarray) -> [np.ndarray, np.ndarray]:
+    # 元のGetComponentPosAndNml()のフェースモード（頂点の平均）と、getPolygonNormal()と同じNewell法の法線を1フェースずつ算出する
+    out_pos, out_nml = [], []
+    for face_id in face_ids:
+        vtx_ids = face_vertices[face_offsets[face_id]:face_offsets[face_id] + face_counts[face_id]]
+        pos = np.zeros(3)
+        for vtx in vtx_ids:
+            pos += points[vtx]
+        out_pos.append(pos / len(vtx_ids))
+        nml = np.zeros(3)
+        for i in range(len(vtx_ids)):
+            cur, nxt = points[vtx_ids[i]], points[vtx_ids[( i + 1 ) % len(vtx_ids)]]
+            nml += [( cur[1] - nxt[1] ) * ( cur[2] + nxt[2] ), ( cur[2] - nxt[2] ) * ( cur[0] + nxt[0] ), ( cur[0] - nxt[0] ) * ( cur[1] + nxt[1] )]
+        out_nml.append(nml / np.linalg.norm(nml))
+    return [np.array(out_pos), np.array(out_nml)]
+
+def random_frame(seed: int) -> np.ndarray:
+    # ランダムな正規直交基底（行が長さ方向・幅方向・法線）
+    q, _ = np.linalg.qr(np.random.default_rng(seed).normal(size=(3, 3)))
+    return q.T
+
+def strip_card(root: np.ndarray, frame: np.ndarray, rows: int, columns: int = 2, length: float = 4.0, width: float = 0.5, bend: float = 0.0, tip_first: bool = False) -> dict:
+    # 長さ方向にrows個・幅方向にcolumns-1個の四角形が並んだカード（頂点IDは段ごとにcolumns個、tip_firstの場合はティップ側の段から）
+    # bend: 法線方向に曲げる量（長さ方向の位置の2乗に比例）
+    s = np.linspace(0.0, 1.0, rows + 1)
+    s = s[::-1] if tip_first else s
+    j = np.linspace(-0.5, 0.5, columns)
+    grid_s, grid_j = np.repeat(s, columns), np.tile(j, rows + 1)
+    points = root + frame[0] * ( length * grid_s )[:, None] + frame[1] * ( width * grid_j )[:, None] + frame[2] * ( bend * grid_s ** 2 )[:, None]
+    v = np.arange(( rows + 1 ) * columns).reshape(rows + 1, columns)
+    quads = np.stack([v[:-1, :-1], v[:-1, 1:], v[1:, 1:], v[1:, :-1]], axis=-1).reshape(-1, 4)
+    centers = root + frame[0] * ( length * np.linspace(0.0, 1.0, rows + 1) )[:, None] + frame[2] * ( bend * np.linspace(0.0, 1.0, rows + 1) ** 2 )[:, None]
+    return {"points": points, "normals": np.tile(frame[2], (len(points), 1)), "uvs": np.stack([grid_j + 0.5, grid_s], axis=1), "quads": quads, "centers": centers}
+
+def card_mesh(cards: list) -> [np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # 複数のカードを1つのメッシュにまとめる 戻り値: [頂点の座標, 法線, エッジ(E,2), UV]
+    starts = np.cumsum([0] + [len(card["points"]) for card in cards])
+    quads = np.concatenate([card["quads"] + start for card, start in zip(cards, starts)])
+    face_counts = np.full(len(quads), 4)
+    edges = TKCM_ChainMath.meshEdgesFromFaces(face_counts, TKCM_ChainMath.faceOffsets(face_counts), quads.ravel())
+    return [np.concatenate([card["points"] for card in cards]), np.concatenate([card["normals"] for card in cards]), edges, np.concatenate([card["uvs"] for card in cards])]
+
+def tube_mesh(ring_count: int, columns: int, twist: float = 0.0, seed: int = 0) -> [np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Z方向に並んだリングのチューブ。始点側は1頂点（ポール）で、終点側は頂点数が半分のリングとポールで閉じる
+    # リング内の頂点IDはランダムに並べ替えるので、IDの大小はリング間の繋がりと関係しない
+    # 戻り値: [頂点の座標, 隣接リストのindptr, indices, 頂点ID(ring_count, columns)（列が長さ方向に繋がった頂点）]
+    rng = np.random.default_rng(seed)
+    ids = np.array([k * columns + rng.permutation(columns) for k in range(ring_count)])
+    angles = 2.0 * np.pi * np.arange(columns) / columns + twist * np.arange(ring_count)[:, None]
+    points = np.zeros((ring_count * columns + columns // 2 + 2, 3))
+    points[ids.ravel()] = np.stack([np.cos(angles), np.sin(angles), np.repeat(np.arange(ring_count, dtype=np.float64), columns).reshape(ring_count, columns)], axis=-1).reshape(-1, 3)
+    half = ring_count * columns + np.arange(columns // 2)
+    half_angles = 4.0 * np.pi * np.arange(columns // 2) / columns + twist * ring_count
+    points[half] = np.stack([np.cos(half_angles) * 0.5, np.sin(half_angles) * 0.5, np.full(len(half), float(ring_count))], axis=1)
+    start_pole, end_pole = len(points) - 2, len(points) - 1
+    points[start_pole], points[end_pole] = [0.0, 0.0, -1.0], [0.0, 0.0, ring_count + 1.0]
+
+    faces = []
+    for k in range(ring_count - 1):
+        faces += [[ids[k, j], ids[k, ( j + 1 ) % columns], ids[k + 1, ( j + 1 ) % columns], ids[k + 1, j]] for j in range(columns)]
+    faces += [[start_pole, ids[0, ( j + 1 ) % columns], ids[0, j]] for j in range(columns)]
+    last = ids[-1]
+    for k in range(columns // 2): # 頂点数が半分のリングへ三角形で繋ぐ
+        b0, b1 = half[k], half[( k + 1 ) % len(half)]
+        faces += [[last[2 * k], last[2 * k + 1], b0], [last[2 * k + 1], b1, b0], [last[2 * k + 1], last[( 2 * k + 2 ) % columns], b1], [b0, b1, end_pole]]
+    face_counts = np.array([len(face) for face in faces])
+    edges = TKCM_ChainMath.meshEdgesFromFaces(face_counts, TKCM_ChainMath.faceOffsets(face_counts), np.concatenate(faces))
+    indptr, indices = TKCM_ChainMath.adjacencyCSR(edges, len(points))
+    return [points, indptr, indices, ids]
+
+def ring_rows(ring_vertices: np.ndarray, ring_offsets: np.ndarray, ids: np.ndarray) -> list:
+    # 並べたリングがtube_mesh()の何番目のリングかを返す
+    rings = [set(ring_vertices[a:b].tolist()) for a, b in zip(ring_offsets[:-1], ring_offsets[1:])]
+    return [next(k for k in range(len(ids)) if set(ids[k].tolist()) == ring) for ring in rings]
+
+def track_columns(tracks: np.ndarray, ids: np.ndarray) -> list:
+    return [int(np.flatnonzero(ids == track)[0] % ids.shape[1]) for track in tracks]
+
+###################################################################################################################################
+## コンポーネントの中央位置と法線
+
+def test_vertex_pos_and_nml_matches_baseline():
+    points, _, _, _ = mixed_mesh()
+    normals = noisy_normals(len(points))
+    vtx_ids = np.array([5, 0, 5, 15, 3, 3], dtype=np.int32) # 選択順・重複したID
+    pos, nml = TKCM_ChainMath.vertexPosAndNml(vtx_ids, points, normals)
+    assert pos.tolist() == [points[i].tolist() for i in vtx_ids]
+    assert nml.tolist() == [normals[i].tolist() for i in vtx_ids]
+
+def test_edge_pos_and_nml_matches_baseline():
+    points, _, _, _ = mixed_mesh()
+    normals = noisy_normals(len(points))
+    edge_vtx = np.array([[0, 1], [2, 1], [0, 1], [15, 3], [7, 8]])
+    pos, nml = TKCM_ChainMath.edgePosAndNml(edge_vtx, points, normals)
+    ref_pos = [( points[vtx0] + points[vtx1] ) * 0.5 for vtx0, vtx1 in edge_vtx]
+    ref_nml = [( normals[vtx0] + normals[vtx1] ) * 0.5 for vtx0, vtx1 in edge_vtx]
+    np.testing.assert_allclose(pos, ref_pos, atol=1.0e-15)
+    np.testing.assert_allclose(nml, ref_nml, atol=1.0e-15)
+
+@pytest.mark.parametrize("face_ids", [[0, 1, 2, 3, 4], [3, 0, 3, 4, 2, 2, 1], [2]])
+def test_face_pos_and_nml_matches_baseline(face_ids):
+    points, face_counts, face_offsets, face_vertices = mixed_mesh()
+    face_ids = np.array(face_ids)
+    pos, nml = TKCM_ChainMath.facePosAndNml(face_ids, points, face_counts, face_offsets, face_vertices)
+    ref_pos, ref_nml = baseline_face_pos_and_nml(face_ids, points, face_counts, face_offsets, face_vertices)
+    np.testing.assert_allclose(pos, ref_pos, atol=1.0e-12)
+    np.testing.assert_allclose(nml, ref_nml, atol=1.0e-12)
+
+def test_face_normal_of_planar_faces():
+    # 平面のフェースの法線は、辺の外積（右回り・左回りはフェースの頂点の順番）と同じ向き
+    face_counts = np.array([3, 4, 6])
+    angles = np.linspace(0.0, 2.0 * np.pi, 7)[:-1]
+    points = np.concatenate([[[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], [[0.0, 0.0, 0.0], [0.0, 0.0, 1.0], [0.0, 1.0, 1.0], [0.0, 1.0, 0.0]], np.stack([np.cos(angles), np.zeros(6), np.sin(angles)], 1)])
+    face_vertices = np.arange(len(points))
+    pos, nml = TKCM_ChainMath.facePosAndNml(np.arange(3), points, face_counts, TKCM_ChainMath.faceOffsets(face_counts), face_vertices)
+    np.testing.assert_allclose(nml, [[0.0, 0.0, 1.0], [-1.0, 0.0, 0.0], [0.0, -1.0, 0.0]], atol=1.0e-12)
+    np.testing.assert_allclose(pos, [[1.0 / 3.0, 1.0 / 3.0, 0.0], [0.0, 0.5, 0.5], [0.0, 0.0, 0.0]], atol=1.0e-12)
+
+def test_face_normal_far_from_origin():
+    # 原点から離れたメッシュでも、原点付近にある同じ形のメッシュと同じ法線になる（桁落ちしない）
+    face_ids = np.arange(5)
+    near = TKCM_ChainMath.facePosAndNml(face_ids, *mixed_mesh())[1]
+    far = TKCM_ChainMath.facePosAndNml(face_ids, *mixed_mesh(1.0e6))[1]
+    np.testing.assert_allclose(far, near, atol=1.0e-8)
+
+###################################################################################################################################
+## 再サンプリング
+
+@pytest.mark.parametrize("div_count", [0, 1, 5, 40])
+def test_evenly_matches_baseline(div_count):
+    pos, nml = helix(30), noisy_normals(30)
+    out_pos, out_nml, offsets, error = TKCM_ChainMath.resampleChains(pos, nml, TKCM_ChainMath.uniformOffsets(1, len(pos)), 1, div_count)
+    ref_pos, ref_nml = baseline_evenly(div_count, pos, nml)
+    np.testing.assert_allclose(out_pos, ref_pos, atol=1.0e-12)
+    np.testing.assert_allclose(out_nml, ref_nml, atol=1.0e-12)
+    assert offsets.tolist() == [0, div_count + 2]
+    assert error == 0.0
+
+@pytest.mark.parametrize("create_type, create_count", [(0, 0), (1, 7), (2, 7), (3, 0), (4, 0)])
+def test_multi_chain_matches_each_chain(create_type, create_count):
+    chains = two_chains()
+    pos = np.concatenate([p for p, _ in chains])
+    nml = np.concatenate([n for _, n in chains])
+    offsets = TKCM_ChainMath.chainOffsets([len(p) for p, _ in chains])
+    out_pos, out_nml, out_offsets, _ = TKCM_ChainMath.resampleChains(pos, nml, offsets, create_type, create_count, 0.5, 0.05, 0.3)
+
+    ref = [TKCM_ChainMath.resampleChains(p, n, TKCM_ChainMath.uniformOffsets(1, len(p)), create_type, create_count, 0.5, 0.05, 0.3) for p, n in chains]
+    np.testing.assert_allclose(out_pos, np.concatenate([r[0] for r in ref]), atol=1.0e-12)
+    np.testing.assert_allclose(out_nml, np.concatenate([r[1] for r in ref]), atol=1.0e-12)
+    assert out_offsets.tolist() == TKCM_ChainMath.chainOffsets([r[2][-1] for r in ref]).tolist()
+
+def test_curvature_weight_zero_matches_evenly():
+    pos, nml = helix(50), noisy_normals(50)
+    offsets = TKCM_ChainMath.uniformOffsets(1, len(pos))
+    evenly = TKCM_ChainMath.resampleChains(pos, nml, offsets, 1, 12)
+    curvature = TKCM_ChainMath.resampleChains(pos, nml, offsets, 2, 12, curvature_weight=0.0)
+    np.testing.assert_allclose(curvature[0], evenly[0], atol=1.0e-12)
+    np.testing.assert_allclose(curvature[1], evenly[1], atol=1.0e-12)
+
+def test_curvature_weight_places_more_joints_on_bends():
+    # 直線 -> 急な曲がり -> 直線 のチェインでは、曲がり角の周辺の間隔が距離だけの場合より狭くなる
+    pos = np.concatenate([np.stack([np.linspace(-5.0, 0.0, 20), np.zeros(20), np.zeros(20)], 1), np.stack([np.zeros(20), np.linspace(0.25, 5.0, 20), np.zeros(20)], 1)])
+    nml = np.tile([0.0, 0.0, 1.0], (len(pos), 1))
+    offsets = TKCM_ChainMath.uniformOffsets(1, len(pos))
+    weighted = TKCM_ChainMath.resampleChains(pos, nml, offsets, 2, 9, curvature_weight=0.8)[0]
+    corner = np.linalg.norm(weighted, axis=1)
+    assert np.sort(corner)[1] < 5.0 / 6.0
+
+@pytest.mark.parametrize("tolerance", [0.0, 0.01, 0.1, 0.5, 10.0])
+def test_simplify_matches_recursive_douglas_peucker(tolerance):
+    chains = two_chains()
+    pos = np.concatenate([p for p, _ in chains])
+    offsets = TKCM_ChainMath.chainOffsets([len(p) for p, _ in chains])
+    keep, max_error = TKCM_ChainMath.simplifyChains(pos, offsets, tolerance)
+
+    ref_keep = np.zeros(len(pos), dtype=bool)
+    for first, end in zip(offsets[:-1], offsets[1:]):
+        ref_keep[[first, end - 1]] = True
+        baseline_douglas_peucker(pos, first, end - 1, tolerance, ref_keep)
+    assert keep.tolist() == ref_keep.tolist()
+
+    # 残さなかったポイントと簡略化したラインとの距離は全てtolerance以内で、その最大値がmax_error
+    errors = []
+    for first, end in zip(offsets[:-1], offsets[1:]):
+        kept = np.flatnonzero(keep[first:end]) + first
+        for a, b in zip(kept[:-1], kept[1:]):
+            interior = np.arange(a + 1, b)
+            if len(interior) > 0:
+                errors.extend(TKCM_ChainMath.pointSegmentDistances(pos[interior], np.repeat(pos[a][None], len(interior), 0), np.repeat(pos[b][None], len(interior), 0)))
+    assert max_error == pytest.approx(max(errors) if errors else 0.0, abs=1.0e-12)
+    assert max_error <= tolerance or tolerance == 0.0 and max_error == 0.0
+
+def test_spacing_places_joints_at_fixed_distance():
+    pos = np.stack([np.linspace(0.0, 10.0, 11), np.zeros(11), np.zeros(11)], 1)
+    nml = np.tile([0.0, 1.0, 0.0], (11, 1))
+    out_pos, _, offsets, _ = TKCM_ChainMath.resampleChains(pos, nml, TKCM_ChainMath.uniformOffsets(1, 11), 4, 0, spacing=3.0)
+    assert out_pos[:, 0].tolist() == pytest.approx([0.0, 3.0, 6.0, 9.0, 10.0])
+    assert offsets.tolist() == [0, 5]
+
+###################################################################################################################################
+## ジョイントの向き
+
+def test_rotation_minimizing_matches_double_reflection():
+    chains = two_chains()
+    pos = np.concatenate([p for p, _ in chains])
+    nml = np.concatenate([n for _, n in chains])
+    offsets = TKCM_ChainMath.chainOffsets([len(p) for p, _ in chains])
+    dir = TKCM_ChainMath.chainDirections(pos, offsets)
+    up = TKCM_ChainMath.transportedUp(pos, dir, nml, offsets)
+    for first, end in zip(offsets[:-1], offsets[1:]):
+        np.testing.assert_allclose(up[first:end], baseline_double_reflection(pos[first:end], dir[first:end], nml[first:end]), atol=1.0e-9)
+    # アップベクトルは向きに垂直
+    assert np.abs(np.einsum('ij,ij->i', up, dir)).max() < 1.0e-9
+
+@pytest.mark.parametrize("axis_type", range(6))
+@pytest.mark.parametrize("aim_neg", [False, True])
+@pytest.mark.parametrize("up_neg", [False, True])
+def test_frames_from_basis_matches_baseline(axis_type, aim_neg, up_neg):
+    rng = np.random.default_rng(axis_type)
+    dir = TKCM_ChainMath.normalizeRows(rng.normal(size=(16, 3)))
+    up = TKCM_ChainMath.normalizeRows(rng.normal(size=(16, 3)))
+    frames = TKCM_ChainMath.framesFromBasis(TKCM_ChainMath.aimUpBasis(dir, up, aim_neg, up_neg), axis_type)
+    ref = np.array([baseline_frame(d, u, axis_type, aim_neg, up_neg) for d, u in zip(dir, up)])
+    np.testing.assert_allclose(frames, ref, atol=1.0e-12)
+    np.testing.assert_allclose(np.linalg.det(frames), 1.0, atol=1.0e-12) # 右手系の回転行列
+
+def test_euler_round_trip():
+    rng = np.random.default_rng(3)
+    rad = rng.uniform(-np.pi, np.pi, size=(200, 3))
+    rad[:, 1] = rng.uniform(-np.pi / 2.0 + 1.0e-3, np.pi / 2.0 - 1.0e-3, size=200)
+    mats = np.array([euler_xyz_matrix(r) for r in rad])
+    np.testing.assert_allclose(TKCM_ChainMath.eulerXYZFromMatrices(mats), rad, atol=1.0e-9)
+
+def test_euler_gimbal_rebuilds_matrix():
+    rad = np.array([[0.4, np.pi / 2.0, -0.3], [1.1, -np.pi / 2.0, 0.2]])
+    mats = np.array([euler_xyz_matrix(r) for r in rad])
+    rebuilt = np.array([euler_xyz_matrix(r) for r in TKCM_ChainMath.eulerXYZFromMatrices(mats)])
+    np.testing.assert_allclose(rebuilt, mats, atol=1.0e-9)
+
+def test_local_rotations_compose_to_global():
+    chains = two_chains()
+    pos = np.concatenate([p for p, _ in chains])
+    nml = np.concatenate([n for _, n in chains])
+    offsets = TKCM_ChainMath.chainOffsets([len(p) for p, _ in chains])
+    plan = TKCM_ChainMath.JointChainPlan((), pos, nml, offsets, 3, False, False, True, True)
+    for i, parent in enumerate(plan.parent_ids):
+        local = euler_xyz_matrix(plan.local_rad[i])
+        expected = plan.frames[i] if parent < 0 else plan.frames[i] @ plan.frames[parent].T
+        np.testing.assert_allclose(local, expected, atol=1.0e-9)
+
+###################################################################################################################################
+## 間隔を指定した場合のチャンクごとの計算
+
+@pytest.mark.parametrize("root, tip", [(True, True), (False, True), (True, False), (False, False)])
+@pytest.mark.parametrize("frame_type, normal_blend", [(TKCM_ChainMath.kFrameNormal, 0.0), (TKCM_ChainMath.kFrameRotationMinimizing, 0.0), (TKCM_ChainMath.kFrameRotationMinimizing, 0.4)])
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 4096])
+def test_spaced_chunks_match_plan(root, tip, frame_type, normal_blend, chunk_size):
+    chains = two_chains()
+    pos = np.concatenate([p for p, _ in chains])
+    nml = np.concatenate([n for _, n in chains])
+    offsets = TKCM_ChainMath.chainOffsets([len(p) for p, _ in chains])
+    spacing = 0.37
+    s_pos, s_nml, s_offsets, _ = TKCM_ChainMath.resampleChains(pos, nml, offsets, 4, 0, spacing=spacing)
+    plan = TKCM_ChainMath.JointChainPlan((), s_pos, s_nml, s_offsets, 2, False, True, root, tip, frame_type, normal_blend)
+
+    chunks = list(TKCM_ChainMath.iterSpacedJointChunks(pos, nml, offsets, spacing, 2, False, True, root, tip, frame_type, normal_blend, chunk_size))
+    joint_ids = np.concatenate([c.joint_ids for c in chunks])
+    assert joint_ids.tolist() == list(range(plan.jointCount()))
+    np.testing.assert_allclose(np.concatenate([c.joint_pos for c in chunks]), plan.joint_pos, atol=1.0e-12)
+    np.testing.assert_allclose(np.concatenate([c.frames for c in chunks]), plan.frames, atol=1.0e-9)
+    np.testing.assert_allclose(np.concatenate([c.local_rad for c in chunks]), plan.local_rad, atol=1.0e-9)
+    assert np.concatenate([c.parent_ids for c in chunks]).tolist() == plan.parent_ids.tolist()
+    np.testing.assert_allclose(np.concatenate([c.local_pos for c in chunks]), TKCM_ChainMath.localTranslations(plan.joint_pos, plan.frames, plan.parent_ids), atol=1.0e-9)
+
+###################################################################################################################################
+## 隣接関係による並べ替え
+
+def test_order_vertices_open():
+    v, face_counts, face_offsets, face_vertices = grid_mesh(4)
+    row = v[2]
+    ids = np.random.default_rng(0).permutation(row)
+    ordered, status = TKCM_ChainMath.orderComponents(TKCM_ChainMath.kCompVertex, ids, face_counts, face_offsets, face_vertices)
+    assert status == TKCM_ChainMath.kPathOpen
+    assert ordered.tolist() == row.tolist()
+    ordered, status = TKCM_ChainMath.orderComponents(TKCM_ChainMath.kCompVertex, ids, face_counts, face_offsets, face_vertices, reverse=True)
+    assert ordered.tolist() == row[::-1].tolist()
+    ordered, status = TKCM_ChainMath.orderComponents(TKCM_ChainMath.kCompVertex, ids, face_counts, face_offsets, face_vertices, start_id=int(row[-1]))
+    assert ordered.tolist() == row[::-1].tolist()
+    _, status = TKCM_ChainMath.orderComponents(TKCM_ChainMath.kCompVertex, ids, face_counts, face_offsets, face_vertices, start_id=int(row[2]))
+    assert status == TKCM_ChainMath.kPathInvalidStart
+
+def test_order_vertices_closed():
+    v, face_counts, face_offsets, face_vertices = grid_mesh(3)
+    loop = np.concatenate([v[0, :-1], v[:-1, -1], v[-1, :0:-1], v[:0:-1, 0]]) # 外周を1周する頂点
+    ordered, status = TKCM_ChainMath.orderComponents(TKCM_ChainMath.kCompVertex, loop[::-1].copy(), face_counts, face_offsets, face_vertices, start_id=int(loop[0]))
+    assert status == TKCM_ChainMath.kPathClosed
+    assert ordered[0] == loop[0]
+    assert sorted(ordered.tolist()) == sorted(loop.tolist())
+    # 隣り合う頂点は外周のエッジで繋がっている
+    position = {int(vtx): i for i, vtx in enumerate(loop)}
+    steps = [( position[int(b)] - position[int(a)] ) % len(loop) for a, b in zip(ordered, np.roll(ordered, -1))]
+    assert set(steps) in ({1}, {len(loop) - 1})
+
+def test_order_vertices_branching_and_disconnected():
+    v, face_counts, face_offsets, face_vertices = grid_mesh(4)
+    branching = np.concatenate([v[0], v[1:3, 2]]) # T字
+    _, status = TKCM_ChainMath.orderComponents(TKCM_ChainMath.kCompVertex, branching, face_counts, face_offsets, face_vertices)
+    assert status == TKCM_ChainMath.kPathBranching
+    disconnected = np.concatenate([v[0, :2], v[3, 2:4]])
+    _, status = TKCM_ChainMath.orderComponents(TKCM_ChainMath.kCompVertex, disconnected, face_counts, face_offsets, face_vertices)
+    assert status == TKCM_ChainMath.kPathDisconnected
+
+def test_order_faces_and_edges():
+    v, face_counts, face_offsets, face_vertices = grid_mesh(4)
+    face_row = np.arange(4, 8) # 2行目のフェース
+    ordered, status = TKCM_ChainMath.orderComponents(TKCM_ChainMath.kCompFace, face_row[[2, 0, 3, 1]], face_counts, face_offsets, face_vertices)
+    assert status == TKCM_ChainMath.kPathOpen
+    assert ordered.tolist() == face_row.tolist()
+
+    edge_vtx = np.stack([v[1, :-1], v[1, 1:]], axis=1) # 横に並んだエッジ（エッジIDは仮の番号）
+    edge_ids = np.array([13, 11, 10, 12])
+    ordered, status = TKCM_ChainMath.orderComponents(TKCM_ChainMath.kCompEdge, edge_ids, face_counts, face_offsets, face_vertices, edge_vtx=edge_vtx[edge_ids - 10])
+    assert status == TKCM_ChainMath.kPathOpen
+    assert ordered.tolist() in ([10, 11, 12, 13], [13, 12, 11, 10])
+
+def test_order_vertices_with_cached_edges():
+    v, face_counts, face_offsets, face_vertices = grid_mesh(4)
+    mesh_edges = TKCM_ChainMath.meshEdgesFromFaces(face_counts, face_offsets, face_vertices).astype(np.int32)
+    ids = v[:, 1][::-1].copy()
+    ordered, status = TKCM_ChainMath.orderComponents(TKCM_ChainMath.kCompVertex, ids, face_counts, face_offsets, face_vertices, mesh_edges=mesh_edges)
+    assert status == TKCM_ChainMath.kPathOpen
+    assert ordered.tolist() == v[:, 1].tolist()
+
+###################################################################################################################################
+## ヘアカード
+
+def test_connected_components_matches_flood_fill():
+    rng = np.random.default_rng(5)
+    node_count = 60
+    pairs = rng.integers(0, node_count, size=(45, 2))
+    # 長い一本道（ラベルの伝播に何回もかかる形）も含める
+    path = rng.permutation(node_count)[:20]
+    pairs = np.concatenate([pairs, np.stack([path[:-1], path[1:]], axis=1)])
+    labels, count = TKCM_ChainMath.connectedComponents(pairs, node_count)
+
+    neighbors = {i: set() for i in range(node_count)}
+    for a, b in pairs:
+        neighbors[int(a)].add(int(b))
+        neighbors[int(b)].add(int(a))
+    groups, seen = [], set()
+    for i in range(node_count):
+        if i in seen:
+            continue
+        group, stack = set(), [i]
+        while stack:
+            node = stack.pop()
+            if node not in group:
+                group.add(node)
+                stack.extend(neighbors[node] - group)
+        seen |= group
+        groups.append(group)
+    assert count == len(groups)
+    assert sorted(set(labels.tolist())) == list(range(count))
+    for group in groups:
+        assert len({int(labels[i]) for i in group}) == 1
+
+def test_connected_components_without_edges():
+    labels, count = TKCM_ChainMath.connectedComponents(np.zeros((0, 2), dtype=np.int64), 4)
+    assert labels.tolist() == [0, 1, 2, 3]
+    assert count == 4
+
+def test_principal_axes():
+    rng = np.random.default_rng(6)
+    directions = TKCM_ChainMath.normalizeRows(rng.normal(size=(3, 3)))
+    t = rng.uniform(-2.0, 2.0, size=(3, 30))
+    points = np.concatenate([c + d * t_k[:, None] + rng.normal(scale=0.01, size=(30, 3)) for c, d, t_k in zip(rng.normal(size=(3, 3)) * 5.0, directions, t)])
+    labels = np.repeat(np.arange(3), 30)
+    centroids, axes = TKCM_ChainMath.principalAxes(points, labels, 3)
+    np.testing.assert_allclose(centroids, [points[labels == k].mean(axis=0) for k in range(3)], atol=1.0e-12)
+    np.testing.assert_allclose(np.abs(np.einsum('ij,ij->i', axes, directions)), 1.0, atol=1.0e-4)
+
+def test_card_chains_with_uvs():
+    cards = [strip_card(np.array([0.0, 0.0, 0.0]), random_frame(0), 4),
+             strip_card(np.array([5.0, 1.0, 0.0]), random_frame(1), 6, columns=3, bend=1.5), # 幅方向に分割して曲げたカード
+             strip_card(np.array([-3.0, 2.0, 4.0]), random_frame(2), 3, tip_first=True)]
+    points, normals, edges, uvs = card_mesh(cards)
+    pos, nml, offsets = TKCM_ChainMath.cardChains(points, normals, edges, uvs)
+    assert offsets.tolist() == TKCM_ChainMath.chainOffsets([5, 7, 4]).tolist()
+    # 段の中心をVが小さい方（ルート）から並べる
+    np.testing.assert_allclose(pos, np.concatenate([card["centers"] for card in cards]), atol=1.0e-12)
+    np.testing.assert_allclose(nml, np.concatenate([np.tile(card["normals"][0], (len(card["centers"]), 1)) for card in cards]), atol=1.0e-12)
+
+def test_card_chains_root_follows_low_v():
+    card = strip_card(np.array([0.0, 0.0, 0.0]), random_frame(3), 5)
+    points, normals, edges, uvs = card_mesh([card])
+    uvs[:, 1] = 1.0 - uvs[:, 1] # Vを反転するとティップ側がルートになる
+    pos, _, _ = TKCM_ChainMath.cardChains(points, normals, edges, uvs)
+    np.testing.assert_allclose(pos, card["centers"][::-1], atol=1.0e-12)
+
+def test_card_chains_without_uvs():
+    # UVが無い場合は主軸を長さ方向にして、メッシュ全体の中心に近い端をルートにする（頭から外側に生えたカード）
+    cards = []
+    for k, angle in enumerate(np.radians([0.0, 120.0, 240.0])):
+        direction = np.array([np.cos(angle), 0.0, np.sin(angle)])
+        frame = np.array([direction, [0.0, 1.0, 0.0], np.cross(direction, [0.0, 1.0, 0.0])])
+        cards.append(strip_card(direction * 0.5, frame, 4 + k, bend=0.3, tip_first=k == 1))
+    points, normals, edges, _ = card_mesh(cards)
+    pos, nml, offsets = TKCM_ChainMath.cardChains(points, normals, edges)
+    assert offsets.tolist() == TKCM_ChainMath.chainOffsets([5, 6, 7]).tolist()
+    np.testing.assert_allclose(pos, np.concatenate([card["centers"] for card in cards]), atol=1.0e-9)
+    np.testing.assert_allclose(nml, np.concatenate([np.tile(card["normals"][0], (len(card["centers"]), 1)) for card in cards]), atol=1.0e-12)
+
+###################################################################################################################################
+## チューブのリング
+
+def test_tube_rings_from_middle_ring():
+    _, indptr, indices, ids = tube_mesh(10, 8)
+    ring_vertices, ring_offsets, tracks = TKCM_ChainMath.tubeRings(indptr, indices, ids[4][::-1].copy())
+    # 両方向に辿って、両端のキャップ（ポール・頂点数が違うリング）の手前で止まる
+    assert ring_offsets.tolist() == TKCM_ChainMath.uniformOffsets(10, 8).tolist()
+    assert ring_rows(ring_vertices, ring_offsets, ids) == list(range(10))
+    assert tracks[4] == ids[4].min()
+    # 追跡する頂点は、どのリングでも長さ方向に繋がった同じ列の頂点
+    assert len(set(track_columns(tracks, ids))) == 1
+
+@pytest.mark.parametrize("start, expected", [(0, list(range(10))), (9, list(range(9, -1, -1)))])
+def test_tube_rings_from_end_ring(start, expected):
+    # 開始リングがチューブの端の場合は開始リングをルートにする
+    _, indptr, indices, ids = tube_mesh(10, 6, seed=1)
+    ring_vertices, ring_offsets, tracks = TKCM_ChainMath.tubeRings(indptr, indices, ids[start])
+    assert ring_rows(ring_vertices, ring_offsets, ids) == expected
+    assert len(set(track_columns(tracks, ids))) == 1
+
+def test_tube_rings_reverse_and_track():
+    _, indptr, indices, ids = tube_mesh(7, 8, seed=2)
+    track = int(ids[3, 5])
+    ring_vertices, ring_offsets, tracks = TKCM_ChainMath.tubeRings(indptr, indices, ids[3], track)
+    assert ring_rows(ring_vertices, ring_offsets, ids) == list(range(7))
+    assert track_columns(tracks, ids) == [5] * 7
+    rev_vertices, rev_offsets, rev_tracks = TKCM_ChainMath.tubeRings(indptr, indices, ids[3], track, reverse=True)
+    assert ring_rows(rev_vertices, rev_offsets, ids) == list(range(6, -1, -1))
+    assert rev_tracks.tolist() == tracks[::-1].tolist()
+
+def test_walk_rings_stops_when_ring_size_changes():
+    _, indptr, indices, ids = tube_mesh(5, 8, seed=3)
+    visited = np.zeros(len(indptr) - 1, dtype=bool)
+    visited[ids[:3].ravel()] = True
+    rings, tracks = TKCM_ChainMath.walkRings(indptr, indices, ids[2], visited, int(ids[2, 0]))
+    assert [set(ring.tolist()) for ring in rings] == [set(ids[3].tolist()), set(ids[4].tolist())]
+    assert tracks == [int(ids[3, 0]), int(ids[4, 0])]
+
+def test_ring_centroids_follow_twist():
+    twist = 0.2
+    points, indptr, indices, ids = tube_mesh(9, 8, twist=twist, seed=4)
+    ring_vertices, ring_offsets, tracks = TKCM_ChainMath.tubeRings(indptr, indices, ids[4])
+    centroids, ups = TKCM_ChainMath.ringCentroids(points, ring_vertices, ring_offsets, tracks)
+    np.testing.assert_allclose(centroids, np.stack([np.zeros(9), np.zeros(9), np.arange(9.0)], axis=1), atol=1.0e-12)
+    # アップベクトルはねじれに合わせて1リングごとに同じ角度だけ回る（別の列の頂点に飛ばない）
+    angles = np.unwrap(np.arctan2(ups[:, 1], ups[:, 0]))
+    np.testing.assert_allclose(np.diff(angles), twist, atol=1.0e-12)
+    np.testing.assert_allclose(ups[:, 2], 0.0, atol=1.0e-12)
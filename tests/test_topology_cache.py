@@ -0,0 +1,181 @@
+import os
+import json
+import time
+
+import numpy as np
+import pytest
+
+import util.topology_cache as TKCM_TopologyCache
+
+###################################################################################################################################
+## テスト用のデータ
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    # テストの間だけキャッシュのディレクトリを一時ディレクトリにする
+    monkeypatch.delenv(TKCM_TopologyCache.kCacheDirEnv, raising=False)
+    path = tmp_path / "cache"
+    TKCM_TopologyCache.setCacheDir(str(path))
+    yield str(path)
+    TKCM_TopologyCache.setCacheDir(None)
+
+def grid_faces(size: int) -> [np.ndarray, np.ndarray, int]:
+    # size x size 個の四角形のメッシュ
+    v = np.arange(( size + 1 ) ** 2).reshape(size + 1, size + 1)
+    quads = np.stack([v[:-1, :-1], v[:-1, 1:], v[1:, 1:], v[1:, :-1]], axis=-1).reshape(-1, 4)
+    return [np.full(len(quads), 4), quads.ravel(), v.size]
+
+def save_grid(cache_dir: str, size: int) -> [str, dict]:
+    face_counts, face_vertices, vertex_count = grid_faces(size)
+    key = TKCM_TopologyCache.topologyHash(face_counts, face_vertices)
+    counts = {"vertices": vertex_count, "faces": len(face_counts), "face_vertices": len(face_vertices)}
+    TKCM_TopologyCache.saveEntry(cache_dir, key, counts, TKCM_TopologyCache.buildAdjacency(face_counts, face_vertices, vertex_count))
+    return [key, counts]
+
+def write_meta(path: str, meta: dict):
+    with open(os.path.join(path, TKCM_TopologyCache.kMetaFileName), "w") as f:
+        json.dump(meta, f)
+
+###################################################################################################################################
+## キーと読み書き
+
+def test_topology_hash_ignores_int_type():
+    face_counts, face_vertices, _ = grid_faces(3)
+    key = TKCM_TopologyCache.topologyHash(face_counts, face_vertices)
+    assert TKCM_TopologyCache.kEntryNamePattern.match(key)
+    assert TKCM_TopologyCache.topologyHash(face_counts.astype(np.int32), face_vertices.astype(np.int32)) == key
+    assert TKCM_TopologyCache.topologyHash(face_counts, np.roll(face_vertices, 1)) != key
+
+def test_save_and_load_round_trip(cache_dir):
+    face_counts, face_vertices, vertex_count = grid_faces(4)
+    built = TKCM_TopologyCache.buildAdjacency(face_counts, face_vertices, vertex_count)
+    key, counts = save_grid(cache_dir, 4)
+    assert sorted(os.listdir(cache_dir)) == [key] # 一時ディレクトリは残らない
+
+    loaded = TKCM_TopologyCache.loadEntry(cache_dir, key, counts)
+    for name in TKCM_TopologyCache.kAdjacencyArrays:
+        assert isinstance(loaded[name], np.memmap)
+        assert loaded[name].flags.writeable == False
+        assert loaded[name].dtype == built[name].dtype
+        np.testing.assert_array_equal(loaded[name], built[name])
+    assert built["edges"].dtype == np.int32
+
+def test_load_refreshes_last_used(cache_dir):
+    key, counts = save_grid(cache_dir, 2)
+    meta_path = os.path.join(cache_dir, key, TKCM_TopologyCache.kMetaFileName)
+    os.utime(meta_path, (0.0, 0.0))
+    assert TKCM_TopologyCache.loadEntry(cache_dir, key, counts) is not None
+    assert os.path.getmtime(meta_path) > time.time() - 60.0
+
+def test_mesh_adjacency_uses_cache(cache_dir):
+    face_counts, face_vertices, vertex_count = grid_faces(3)
+    first = TKCM_TopologyCache.meshAdjacency(face_counts, face_vertices, vertex_count)
+    key = TKCM_TopologyCache.topologyHash(face_counts, face_vertices)
+    assert os.listdir(cache_dir) == [key]
+    second = TKCM_TopologyCache.meshAdjacency(face_counts, face_vertices, vertex_count, key)
+    for a, b in zip(first, second):
+        assert isinstance(b, np.memmap)
+        np.testing.assert_array_equal(a, b)
+
+    TKCM_TopologyCache.setCacheDir("")
+    assert TKCM_TopologyCache.getCacheDir() is None
+    uncached = TKCM_TopologyCache.meshAdjacency(face_counts, face_vertices, vertex_count)
+    assert not any(isinstance(a, np.memmap) for a in uncached)
+    for a, b in zip(first, uncached):
+        np.testing.assert_array_equal(a, b)
+
+###################################################################################################################################
+## 古いエントリーの判定
+
+@pytest.mark.parametrize("damage", ["version", "counts", "file_size", "missing_array", "no_meta"])
+def test_is_stale(cache_dir, damage):
+    key, counts = save_grid(cache_dir, 3)
+    path = os.path.join(cache_dir, key)
+    assert TKCM_TopologyCache.isStale(path, TKCM_TopologyCache.readMeta(path), counts) == False
+
+    meta = TKCM_TopologyCache.readMeta(path)
+    if damage == "version":
+        meta["version"] = TKCM_TopologyCache.kFormatVersion - 1
+        write_meta(path, meta)
+    elif damage == "counts":
+        counts = dict(counts, vertices=counts["vertices"] + 1)
+    elif damage == "file_size":
+        with open(os.path.join(path, "edges.npy"), "ab") as f:
+            f.write(b"\0" * 8)
+    elif damage == "missing_array":
+        del meta["arrays"]["vertex_indices"]
+        write_meta(path, meta)
+    elif damage == "no_meta":
+        os.remove(os.path.join(path, TKCM_TopologyCache.kMetaFileName))
+    assert TKCM_TopologyCache.isStale(path, TKCM_TopologyCache.readMeta(path), counts)
+
+    # 読み込み時に古いエントリーは削除される
+    assert TKCM_TopologyCache.loadEntry(cache_dir, key, counts) is None
+    assert os.path.exists(path) == False
+
+###################################################################################################################################
+## 削除
+
+def test_purge_leaves_foreign_files(cache_dir, tmp_path):
+    key, _ = save_grid(cache_dir, 2)
+    foreign_key = "0" * 40
+    foreign = {
+        "project": {"scene.ma": "//Maya ASCII"},                         # キャッシュの名前ではないディレクトリ
+        foreign_key: {"notes.txt": "not a cache entry"},                 # キーの名前だがmeta.jsonが無い
+        "f" * 40: {"meta.json": json.dumps({"key": "something else"})},  # meta.jsonのキーが名前と違う
+        "backup.tmp": {"data.bin": "x"},                                  # 一時ディレクトリの名前ではない
+    }
+    for name, files in foreign.items():
+        os.makedirs(os.path.join(cache_dir, name))
+        for file_name, text in files.items():
+            with open(os.path.join(cache_dir, name, file_name), "w") as f:
+                f.write(text)
+    with open(os.path.join(cache_dir, "readme.txt"), "w") as f:
+        f.write("keep")
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "keep.txt").write_text("keep")
+    if hasattr(os, "symlink"):
+        os.symlink(str(outside), os.path.join(cache_dir, "a" * 40))
+
+    removed, removed_bytes = TKCM_TopologyCache.purge(cache_dir=cache_dir)
+    assert removed == 1
+    assert removed_bytes > 0
+    assert os.path.exists(os.path.join(cache_dir, key)) == False
+    for name, files in foreign.items():
+        for file_name in files:
+            assert os.path.isfile(os.path.join(cache_dir, name, file_name))
+    assert os.path.isfile(os.path.join(cache_dir, "readme.txt"))
+    assert (outside / "keep.txt").read_text() == "keep"
+
+def test_purge_missing_directory(tmp_path):
+    assert TKCM_TopologyCache.purge(cache_dir=str(tmp_path / "missing")) == [0, 0]
+
+def test_purge_older_than_days(cache_dir):
+    old_key, _ = save_grid(cache_dir, 2)
+    new_key, _ = save_grid(cache_dir, 3)
+    old_time = time.time() - 10.0 * 86400.0
+    os.utime(os.path.join(cache_dir, old_key, TKCM_TopologyCache.kMetaFileName), (old_time, old_time))
+
+    assert TKCM_TopologyCache.purge(older_than_days=30.0, cache_dir=cache_dir)[0] == 0
+    assert TKCM_TopologyCache.purge(older_than_days=7.0, cache_dir=cache_dir)[0] == 1
+    assert sorted(os.listdir(cache_dir)) == [new_key]
+
+def test_purge_stale_only(cache_dir):
+    fresh_key, _ = save_grid(cache_dir, 2)
+    stale_key, _ = save_grid(cache_dir, 3)
+    stale_path = os.path.join(cache_dir, stale_key)
+    meta = TKCM_TopologyCache.readMeta(stale_path)
+    meta["version"] = TKCM_TopologyCache.kFormatVersion - 1
+    write_meta(stale_path, meta)
+    temp_path = os.path.join(cache_dir, fresh_key + ".abc123.tmp") # 書き込み途中で終了した一時ディレクトリ
+    os.makedirs(temp_path)
+
+    assert TKCM_TopologyCache.purge(stale_only=True, cache_dir=cache_dir)[0] == 2
+    assert sorted(os.listdir(cache_dir)) == [fresh_key]
+    # 古いエントリーは日数に関係なく削除する
+    meta = TKCM_TopologyCache.readMeta(os.path.join(cache_dir, fresh_key))
+    meta["version"] = TKCM_TopologyCache.kFormatVersion - 1
+    write_meta(os.path.join(cache_dir, fresh_key), meta)
+    assert TKCM_TopologyCache.purge(older_than_days=30.0, cache_dir=cache_dir)[0] == 1
+    assert os.listdir(cache_dir) == []